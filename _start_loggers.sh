@@ -1,22 +1,11 @@
 #!/bin/sh
-for name in network1 network2; do (
-	CONF_FILE=configs/$name.conf
-	PID_FILE=$name.pid
-	ERROR_LOG_FILE=logs/$name-error-log.txt
-	start_logger() {
-		echo $name is not running. starting...
-		nohup python logger.py $CONF_FILE >> $ERROR_LOG_FILE 2>&1&
-		echo $! > $PID_FILE
-	}
-	if [ -f $CONF_FILE ]; then
-		if [ ! -f $PID_FILE ]; then
-			start_logger
-		else
-			if ! ps -p `cat $PID_FILE` > /dev/null 2>&1; then
-				start_logger
-			else
-				echo $name is already running.
-			fi
-		fi
-	fi
-); done
+# Log all networks of configs/*.conf, spread over one worker process per core.
+# supervisor.py restarts crashed or hung workers itself; send it SIGHUP after editing configs.
+# Does nothing while the supervisor started last time (see logs/supervisor.pid) is still running.
+pidfile=logs/supervisor.pid
+if [ -f $pidfile ] && ps -p "`cat $pidfile`" -o args= 2>/dev/null | grep -q supervisor.py; then
+	echo "supervisor.py is already running (pid `cat $pidfile`)."
+	exit 1
+fi
+nohup python supervisor.py --workers `nproc` configs >> logs/supervisor-error-log.txt 2>&1&
+echo $! > $pidfile
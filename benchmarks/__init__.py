@@ -0,0 +1 @@
+"""Benchmarks for pyrclib; run `python -m benchmarks --help`."""
@@ -0,0 +1,85 @@
+"""Run the pyrclib benchmarks or compare two runs.
+
+python -m benchmarks run [--lines N] [--only NAME ...] [--no-memory] [-o results.json]
+python -m benchmarks compare before.json after.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from .suite import benchmarks, run
+
+# (key, label, higher is better)
+_columns = (
+	('linesPerSec', 'lines/s', True),
+	('p50LatencyUs', 'p50 us', False),
+	('p99LatencyUs', 'p99 us', False),
+	('cpuSeconds', 'cpu s', False),
+	('peakMemory', 'peak mem', False),
+)
+
+def _fmt(value) -> str:
+	if value is None:
+		return '-'
+	if isinstance(value, int) or value >= 1000:
+		return '%i' % value
+	return '%.3g' % value
+
+def runMain(args):
+	names = args.only or list(benchmarks)
+	results = {}
+	print('%-18s' % 'benchmark' + ''.join(' %11s' % label for key, label, better in _columns))
+	for name in names:
+		result = results[name] = run(name, args.lines, not args.no_memory)
+		print('%-18s' % name + ''.join(' %11s' % _fmt(result[key]) for key, label, better in _columns))
+		sys.stdout.flush()
+	if args.output:
+		with open(args.output, 'w') as fo:
+			json.dump({
+				'time': time.time(),
+				'python': platform.python_version(),
+				'lines': args.lines,
+				'results': results,
+			}, fo, indent = '\t')
+
+def compareMain(args):
+	with open(args.before) as fo:
+		before = json.load(fo)['results']
+	with open(args.after) as fo:
+		after = json.load(fo)['results']
+	print('%-18s' % 'benchmark' + ''.join(' %22s' % label for key, label, better in _columns))
+	for name in before:
+		if name not in after:
+			continue
+		cells = []
+		for key, label, higherIsBetter in _columns:
+			old, new = before[name][key], after[name][key]
+			if not old or new is None:
+				cells.append(' %22s' % '-')
+				continue
+			change = new / old
+			cells.append(' %22s' % ('%s -> %s (%.2fx)' % (_fmt(old), _fmt(new), change if higherIsBetter else 1 / change)))
+		print('%-18s' % name + ''.join(cells))
+	print('(x > 1 means the second run is better)')
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = 'python -m benchmarks', description = 'pyrclib benchmarks')
+	commands = parser.add_subparsers(dest = 'command', required = True)
+	runParser = commands.add_parser('run', help = 'run benchmarks')
+	runParser.add_argument('--lines', type = int, default = 20000, help = 'lines per benchmark')
+	runParser.add_argument('--only', nargs = '+', choices = sorted(benchmarks), help = 'benchmarks to run')
+	runParser.add_argument('--no-memory', action = 'store_true', help = 'skip the peak memory pass')
+	runParser.add_argument('-o', '--output', help = 'write results as JSON to this file')
+	compareParser = commands.add_parser('compare', help = 'compare two result files')
+	compareParser.add_argument('before')
+	compareParser.add_argument('after')
+	args = parser.parse_args(argv)
+	if args.command == 'run':
+		runMain(args)
+	else:
+		compareMain(args)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,102 @@
+"""A tiny stand-in ircd for benchmarks.
+
+Speaks just enough RFC 1459 for pyrclib: registration (welcome burst and MOTD), PING,
+JOIN with NAMES replies and QUIT. `flood` sends PRIVMSG, JOIN or QUIT floods to all
+registered clients; PRIVMSG and QUIT lines carry the time.perf_counter_ns() at which they were
+written, so in-process clients can measure dispatch latency (see `sentAt`).
+"""
+
+import asyncio
+import time
+
+def sentAt(msg) -> int:
+	"""Return the perf_counter_ns timestamp of a flood message, or None."""
+	try:
+		return int(msg.params[-1].rsplit(' ', 1)[-1])
+	except (IndexError, ValueError):
+		return None
+
+class FakeIRCd:
+	def __init__(self, host: str = '127.0.0.1', port: int = 0, namesCount: int = 100, sslContext = None):
+		self.host = host
+		self.port = port
+		self.namesCount = namesCount # number of users in each joined channel's NAMES reply
+		self.sslContext = sslContext # server side SSLContext to speak TLS
+		self.clients = {} # writer -> nick
+		self.received = 0 # lines received from clients
+		self.joined = None # asyncio.Event, set when a client joined a channel
+		self.__server = None
+	async def start(self):
+		self.joined = asyncio.Event()
+		self.__server = await asyncio.start_server(self.__handle, self.host, self.port, ssl = self.sslContext)
+		self.port = self.__server.sockets[0].getsockname()[1]
+	async def stop(self):
+		for writer in list(self.clients):
+			writer.close()
+		self.__server.close()
+		await self.__server.wait_closed()
+	async def __handle(self, reader, writer):
+		nick = '*'
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				self.received += 1
+				parts = line.decode('utf-8', 'replace').rstrip('\r\n').split(' ')
+				command = parts[0].upper()
+				if command == 'NICK':
+					nick = parts[1].lstrip(':')
+				elif command == 'USER':
+					self.clients[writer] = nick
+					writer.write(self.__welcome(nick))
+				elif command == 'PING':
+					writer.write(b':fake.ircd PONG fake.ircd %s\r\n' % ' '.join(parts[1:]).encode())
+				elif command == 'JOIN':
+					for channel in parts[1].lstrip(':').split(','):
+						writer.write(self.__join(nick, channel))
+					self.joined.set()
+				elif command == 'QUIT':
+					break
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			self.clients.pop(writer, None)
+			writer.close()
+	def __welcome(self, nick: str) -> bytes:
+		lines = [
+			':fake.ircd 001 %s :Welcome to the fake IRC network %s' % (nick, nick),
+			':fake.ircd 002 %s :Your host is fake.ircd' % nick,
+			':fake.ircd 003 %s :This server was created today' % nick,
+			':fake.ircd 004 %s fake.ircd fake-1.0 iow biklmnopstv' % nick,
+			':fake.ircd 005 %s PREFIX=(ov)@+ CHANTYPES=#& CHANMODES=b,k,l,imnpst NETWORK=Fake :are supported by this server' % nick,
+			':fake.ircd 375 %s :- fake.ircd Message of the day -' % nick,
+			':fake.ircd 372 %s :- benchmarks only' % nick,
+			':fake.ircd 376 %s :End of /MOTD command.' % nick,
+		]
+		return ''.join(line + '\r\n' for line in lines).encode()
+	def __join(self, nick: str, channel: str) -> bytes:
+		lines = [':%s!bench@fake.host JOIN %s' % (nick, channel)]
+		names = ['%suser%i' % ('@' if i % 10 == 0 else '', i) for i in range(self.namesCount)] + [nick]
+		for i in range(0, len(names), 50):
+			lines.append(':fake.ircd 353 %s = %s :%s' % (nick, channel, ' '.join(names[i:i + 50])))
+		lines.append(':fake.ircd 366 %s %s :End of /NAMES list.' % (nick, channel))
+		return ''.join(line + '\r\n' for line in lines).encode()
+	@staticmethod
+	def floodLine(kind: str, i: int, channel: str) -> bytes:
+		if kind == 'PRIVMSG':
+			return b':user%i!u@fake.host PRIVMSG %s :flood line %i %i\r\n' % (i % 500, channel.encode(), i, time.perf_counter_ns())
+		if kind == 'JOIN':
+			return b':user%i!u@fake.host JOIN %s\r\n' % (i, channel.encode())
+		if kind == 'QUIT':
+			return b':user%i!u@fake.host QUIT :Quit: %i\r\n' % (i, time.perf_counter_ns())
+		raise ValueError('Unknown flood kind: %s' % kind)
+	async def flood(self, kind: str, count: int, channel: str = '#bench', chunk: int = 256):
+		"""Send count lines of kind ('PRIVMSG', 'JOIN' or 'QUIT') to all clients."""
+		for start in range(0, count, chunk):
+			data = b''.join(self.floodLine(kind, i, channel) for i in range(start, min(count, start + chunk)))
+			for writer in list(self.clients):
+				writer.write(data)
+			for writer in list(self.clients):
+				await writer.drain()
@@ -0,0 +1,206 @@
+"""The pyrclib benchmarks.
+
+Every benchmark takes the number of lines to process and returns (lines processed, latencies in ns or None).
+`run` measures wall time, CPU time and (in a second pass) peak memory around them.
+"""
+
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from pyrclib.archive import ArchiveIRCLogger
+from pyrclib.client import IRCClient
+from pyrclib.events import EventEmitter
+from pyrclib.irc import IRC
+from pyrclib.logger import AutoNamedLogger, RawIRCLogger, PrettyIRCLogger
+from pyrclib.message import MessageBase as Message
+from pyrclib.timer import TimerManager
+from .fakeircd import FakeIRCd, sentAt
+
+def _sampleLines(count: int) -> list:
+	"""Return a realistic mix of received lines."""
+	random.seed(count)
+	lines = []
+	for i in range(count):
+		kind = random.random()
+		nick = b'user%i' % random.randrange(2000)
+		if kind < 0.7:
+			lines.append(b':%s!ident@host.example.net PRIVMSG #channel%i :some message text, number %i' % (nick, i % 20, i))
+		elif kind < 0.8:
+			lines.append(b':%s!ident@host.example.net JOIN #channel%i' % (nick, i % 20))
+		elif kind < 0.9:
+			lines.append(b':%s!ident@host.example.net QUIT :Ping timeout: 240 seconds' % nick)
+		elif kind < 0.95:
+			lines.append(b'@time=2020-01-01T00:00:00.000Z;account=%s :%s!ident@host NOTICE #channel :tagged' % (nick, nick))
+		else:
+			lines.append(b':irc.example.net 353 me = #channel%i :@%s +other plain names list' % (i % 20, nick))
+	return lines
+
+# micro benchmarks
+
+def benchParse(count: int):
+	lines = _sampleLines(count)
+	for line in lines:
+		msg = Message(line)
+		msg.command
+		msg.params
+	return count, None
+
+def benchEmit(count: int):
+	emitter = EventEmitter()
+	commands = ['PRIVMSG', 'JOIN', 'PART', 'QUIT', 'NICK', 'MODE', '353', '366', 'NOTICE', 'KICK']
+	for command in commands:
+		for _ in range(5):
+			emitter.addEventHandler('recv', lambda msg: None, command)
+	emitter.addEventHandler('recv', lambda msg: None)
+	msgs = [Message(line) for line in _sampleLines(count)]
+	latencies = []
+	clock = time.perf_counter_ns
+	for msg in msgs:
+		start = clock()
+		emitter.emitKeyedEvent('recv', msg.command, msg)
+		latencies.append(clock() - start)
+	return count, latencies
+
+def benchTimers(count: int):
+	manager = TimerManager()
+	random.seed(count)
+	fired = []
+	timers = [manager.callIn(random.randrange(50), fired.append, i) for i in range(count)]
+	for timer in timers[::10]:
+		timer.cancel()
+	while manager.nextDeadline() is not None:
+		manager.tick()
+	return count, None
+
+def _benchLogger(factory):
+	def bench(count: int):
+		directory = tempfile.mkdtemp(prefix = 'pyrclib-bench-')
+		try:
+			logger = factory(os.path.join(directory, 'log'))
+			for line in _sampleLines(count):
+				logger.log(None, Message(line))
+			logger.close()
+			logger.writer.stop()
+		finally:
+			shutil.rmtree(directory)
+		return count, None
+	return bench
+
+class _RawFileLogger(RawIRCLogger):
+	pass
+
+class _AutoNamedRawLogger(AutoNamedLogger, RawIRCLogger):
+	bytesThrough = True
+
+# client benchmarks
+
+def _benchAsyncClient(kind: str):
+	def bench(count: int):
+		latencies = []
+		async def main():
+			ircd = FakeIRCd()
+			await ircd.start()
+			client = IRCClient(['bench'], 'bench', 'pyrclib benchmark')
+			client.floodControl = None
+			client.addServer(ircd.host, ircd.port, False)
+			client.addChannel('#bench')
+			done = asyncio.get_running_loop().create_future()
+			clock = time.perf_counter_ns
+			def handler(irc, msg):
+				sent = sentAt(msg)
+				if sent is not None:
+					latencies.append(clock() - sent)
+				handler.count += 1
+				if handler.count == count and not done.done():
+					done.set_result(None)
+			handler.count = 0
+			task = asyncio.ensure_future(client.runAsync())
+			while client.irc is None:
+				await asyncio.sleep(0)
+			client.irc.addEventHandler('recv', handler, kind)
+			await ircd.joined.wait()
+			await ircd.flood(kind, count)
+			await done
+			client.stop()
+			await task
+			await ircd.stop()
+		asyncio.run(main())
+		return count, latencies if kind != 'JOIN' else None
+	return bench
+
+def benchSyncIRC(count: int):
+	"""IRC.run on the main thread, the fake ircd on a thread of its own."""
+	loop = asyncio.new_event_loop()
+	ircd = FakeIRCd()
+	loop.run_until_complete(ircd.start())
+	thread = threading.Thread(target = loop.run_forever, daemon = True)
+	thread.start()
+	irc = IRC('bench', 'bench', 'pyrclib benchmark')
+	irc.floodControl = None
+	latencies = []
+	clock = time.perf_counter_ns
+	def handler(irc, msg):
+		latencies.append(clock() - sentAt(msg))
+		if len(latencies) == count:
+			irc.quit()
+	def flood(irc, msg):
+		asyncio.run_coroutine_threadsafe(ircd.flood('PRIVMSG', count), loop)
+	irc.addEventHandler('recv', handler, 'PRIVMSG')
+	irc.addEventHandler('recv', flood, 'RPL_ENDOFNAMES')
+	irc.addEventHandler('recv', lambda irc, msg: irc.join('#bench'), 'RPL_ENDOFMOTD')
+	irc.connect(ircd.host, ircd.port, False)
+	try:
+		irc.run()
+	except Exception:
+		pass # the fake ircd closes the connection on QUIT
+	asyncio.run_coroutine_threadsafe(ircd.stop(), loop).result()
+	loop.call_soon_threadsafe(loop.stop)
+	thread.join()
+	return count, latencies
+
+benchmarks = {
+	'parse': benchParse,
+	'emit': benchEmit,
+	'timers': benchTimers,
+	'logger-raw': _benchLogger(lambda path: _RawFileLogger(path + '.txt', 2**10)),
+	'logger-autonamed': _benchLogger(lambda path: _AutoNamedRawLogger(path, 2**10)),
+	'logger-pretty': _benchLogger(lambda path: PrettyIRCLogger(path + '.txt', 2**10)),
+	'logger-archive': _benchLogger(lambda path: ArchiveIRCLogger(path, 2**12)),
+	'client-privmsg': _benchAsyncClient('PRIVMSG'),
+	'client-join': _benchAsyncClient('JOIN'),
+	'client-quit': _benchAsyncClient('QUIT'),
+	'irc-sync': benchSyncIRC,
+}
+
+def _percentile(values: list, fraction: float) -> float:
+	values = sorted(values)
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run(name: str, count: int, memory: bool = True) -> dict:
+	"""Run a benchmark and return its results."""
+	bench = benchmarks[name]
+	cpuStart, wallStart = time.process_time(), time.perf_counter()
+	lines, latencies = bench(count)
+	wall, cpu = time.perf_counter() - wallStart, time.process_time() - cpuStart
+	result = {
+		'lines': lines,
+		'seconds': wall,
+		'cpuSeconds': cpu,
+		'linesPerSec': lines / wall if wall else None,
+		'p50LatencyUs': _percentile(latencies, 0.5) / 1000 if latencies else None,
+		'p99LatencyUs': _percentile(latencies, 0.99) / 1000 if latencies else None,
+		'peakMemory': None,
+	}
+	if memory: # second pass, tracemalloc slows things down too much to time the first one
+		tracemalloc.start()
+		try:
+			bench(count)
+			result['peakMemory'] = tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+	return result
@@ -1,10 +1,210 @@
 from pyrclib.client import IRCClient
+from pyrclib.sendqueue import FloodControl
 from pyrclib.logger import *
+from pyrclib.archive import ArchiveIRCLogger
+from pyrclib.binlog import BinaryIRCLogger
+from pyrclib.writer import BackgroundWriter
+from pyrclib.resolver import Resolver, defaultResolver
+from pyrclib.tls import TLSContext
+from pyrclib.metrics import Metrics
+from pyrclib.profiling import HandlerProfiler
 from confparser import dictFromLines as parseConf
+import asyncio
+import os
+import signal
 import sys
 
 class AutoNamedIRCLogger(AutoFlushIRCLoggerMixin, AutoNamedLogger, RawIRCLogger):
 	flushTime = 60
+	bytesThrough = True
+
+class AutoFlushArchiveIRCLogger(AutoFlushIRCLoggerMixin, ArchiveIRCLogger):
+	flushTime = 60
+
+class AutoFlushBinaryIRCLogger(AutoFlushIRCLoggerMixin, BinaryIRCLogger):
+	flushTime = 60
+
+def loadConf(confname):
+	with open(confname) as fo:
+		return parseConf(fo)
+
+def _channelsFromConf(conf) -> list:
+	channels = []
+	for channel in conf['channel']:
+		if ':' in channel:
+			channels.append(tuple(channel.rsplit(':', 1))) # split channel string into name and password
+		else:
+			channels.append((channel, None))
+	return channels
+
+def _serversFromConf(conf) -> list:
+	useSsl = 'use ssl' in conf
+	servers = []
+	for server in conf['server']:
+		host, port = server.split(':') # split server string into host and port
+		servers.append((host, port, useSsl))
+	return servers
+
+def _floodControlFromConf(conf):
+	if 'no flood control' in conf:
+		return None
+	if 'flood control' in conf: # seconds per line, bytes per second, burst seconds
+		return FloodControl(*(float(e) for e in conf['flood control']))
+	return FloodControl()
+
+def _sslContextFromConf(conf):
+	if 'ssl no verify' in conf or 'ssl ca file' in conf or 'ssl cert' in conf:
+		certFiles = conf['ssl cert'] if 'ssl cert' in conf else [None] # certificate file [key file]
+		return TLSContext(
+			verify = 'ssl no verify' not in conf,
+			caFile = conf['ssl ca file'][0] if 'ssl ca file' in conf else None,
+			certFile = certFiles[0],
+			keyFile = certFiles[1] if len(certFiles) > 1 else None)
+	return None
+
+def loggersFromConf(conf, writer = None) -> list:
+	"""Return the (logger, send, recv) tuples a config asks for."""
+	logPath = conf['log path'][0]
+	maxBufferBytes = int(conf['log buffer'][0]) if 'log buffer' in conf else None # bytes buffered before writing
+	if 'archive' in conf: # compressed archive instead of plain text files
+		compression = conf['archive'][0] if conf['archive'] is not True and conf['archive'] else 'gzip'
+		loggers = [(AutoFlushArchiveIRCLogger(logPath, 2**12, writer, compression, maxBufferBytes or 2**20), True, True)]
+	elif 'binary log' in conf: # records which can be queried by command, channel and nick
+		loggers = [(AutoFlushBinaryIRCLogger(logPath, 2**14, writer, maxBufferBytes or 2**20), True, True)]
+	else:
+		loggers = [(AutoNamedIRCLogger(logPath, 2**7, writer, maxBufferBytes), True, True)]
+	if not ('silenced' in conf or 'quiet' in conf):
+		loggers.append((PrettyIRCLogger(sys.stdout, 0, writer), False, True))
+	return loggers
+
+def writerFromConf(conf) -> BackgroundWriter:
+	"""Create the log writer: 'log overflow: drop-newest|drop-oldest|block|spill [spill directory [max spill MB]]'
+
+	Raise ValueError for an unknown policy, or spill without a spill directory."""
+	if 'log overflow' not in conf:
+		return BackgroundWriter()
+	args = conf['log overflow']
+	options = {'overflow': args[0]}
+	if len(args) > 1:
+		options['spillPath'] = args[1]
+	if len(args) > 2:
+		options['maxSpillBytes'] = int(float(args[2]) * 2**20)
+	return BackgroundWriter(**options)
+
+def clientFromConf(conf, writer = None, metrics = None, network = None):
+	"""Create an IRCClient with loggers from a parsed config.
+
+	writer: the writer used by the loggers (see pyrclib.writer)
+	metrics: a Metrics instance to register the client and loggers with, labelled with network
+
+	Raise KeyError if a required config key is missing."""
+	client = IRCClient(conf['nick'], conf['username'][0], conf['realname'][0], _serversFromConf(conf), _channelsFromConf(conf))
+	client.floodControl = _floodControlFromConf(conf)
+	client.sslContext = _sslContextFromConf(conf)
+	if 'race servers' in conf: # number of servers connected to at once
+		client.raceServers = int(conf['race servers'][0])
+	if 'dns ttl' in conf: # seconds DNS results are cached
+		client.resolver = Resolver(float(conf['dns ttl'][0]))
+	for logger, send, recv in loggersFromConf(conf, writer):
+		client.addLogger(logger, send, recv)
+	if metrics is not None:
+		metrics.watchClient(client, network = network)
+		for logger, send, recv in client.loggers:
+			metrics.watchLogger(logger, network = network, name = type(logger).__name__)
+	return client
+
+_loggerKeys = 'log path', 'log buffer', 'archive', 'binary log', 'quiet', 'silenced'
+_sslKeys = 'ssl no verify', 'ssl ca file', 'ssl cert'
+_restartKeys = 'username', 'realname', 'metrics port', 'profile handlers', 'log overflow' # only read at startup
+
+def _changed(old, new, keys) -> bool:
+	return any(old.get(key) != new.get(key) for key in keys)
+
+def applyConf(client, old, new, writer = None, metrics = None, network = None):
+	"""Apply the differences between two parsed configs to a client, without reconnecting.
+
+	Channels are joined and parted, nicks changed if ours is gone, loggers replaced (after writing
+	what they buffered) and servers, flood control and TLS settings are used from now on.
+
+	Raise KeyError (missing key), ValueError (bad value) or OSError (TLS files); nothing is changed then."""
+	# check the new config before changing anything
+	for key in 'username', 'realname', 'nick', 'log path':
+		new[key]
+	channels, servers = _channelsFromConf(new), _serversFromConf(new)
+	floodControl = _floodControlFromConf(new)
+	sslContext = _sslContextFromConf(new) if _changed(old, new, _sslKeys) else client.sslContext
+	raceServers = int(new['race servers'][0]) if 'race servers' in new else IRCClient.raceServers
+	resolver = Resolver(float(new['dns ttl'][0])) if 'dns ttl' in new else defaultResolver
+	loggers = loggersFromConf(new, writer) if _changed(old, new, _loggerKeys) else None
+	# apply the differences
+	if _changed(old, new, ('channel',)):
+		client.setChannels(channels)
+	if _changed(old, new, ('nick',)):
+		client.setNicks(new['nick'])
+	if _changed(old, new, ('server', 'use ssl')):
+		client.setServers(servers)
+	if _changed(old, new, ('flood control', 'no flood control')):
+		client.setFloodControl(floodControl)
+	if _changed(old, new, _sslKeys):
+		client.sslContext = sslContext
+		if client.irc is not None:
+			client.irc.sslContext = sslContext
+	client.raceServers = raceServers
+	if _changed(old, new, ('dns ttl',)):
+		client.resolver = resolver
+	if loggers is not None:
+		for logger, send, recv in list(client.loggers):
+			client.removeLogger(logger)
+			if metrics is not None:
+				metrics.unwatchLogger(logger, network = network, name = type(logger).__name__)
+		for logger, send, recv in loggers:
+			client.addLogger(logger, send, recv)
+			if metrics is not None:
+				metrics.watchLogger(logger, network = network, name = type(logger).__name__)
+	for key in _restartKeys:
+		if _changed(old, new, (key,)):
+			print('Changing %s takes a restart.' % key)
+
+class ConfWatcher:
+	"""Reloads a config file on SIGHUP or when it changes, and applies it to a client (see applyConf)."""
+	def __init__(self, path, conf, client, writer = None, metrics = None, network = None):
+		self.path = path
+		self.conf = conf
+		self.client = client
+		self.writer = writer
+		self.metrics = metrics
+		self.network = network
+		self.__mtime = self.__stat()
+	def __stat(self):
+		try:
+			return os.stat(self.path).st_mtime_ns
+		except OSError:
+			return None
+	def reload(self):
+		try:
+			conf = loadConf(self.path)
+			applyConf(self.client, self.conf, conf, self.writer, self.metrics, self.network)
+		except KeyError as err:
+			print('%s: Missing config key: %s' % (self.path, err))
+		except (OSError, ValueError) as err:
+			print('%s: %s' % (self.path, err))
+		else:
+			self.conf = conf
+			print('Reloaded %s.' % self.path)
+	def check(self):
+		"""Reload if the file changed since it was last looked at."""
+		mtime = self.__stat()
+		if mtime is not None and mtime != self.__mtime:
+			self.__mtime = mtime
+			self.reload()
+	def install(self, loop, interval: float = None):
+		"""Reload on SIGHUP, and every `interval` seconds if the file changed."""
+		loop.add_signal_handler(signal.SIGHUP, self.reload)
+		if interval:
+			def poll():
+				self.check()
+				loop.call_later(interval, poll)
+			loop.call_later(interval, poll)
 
 def main():
 	try:
@@ -13,36 +213,38 @@ def main():
 		print('Usage: %s path-to-config-file' % sys.argv[0])
 		return
 	# load config file
-	with open(confname) as fo:
-		conf = parseConf(fo)
+	conf = loadConf(confname)
+	try:
+		writer = writerFromConf(conf) # keeps disk I/O out of the IRC loop
+	except (ValueError, OSError) as err:
+		print('log overflow: %s' % err)
+		return
+	metrics = None
+	if 'metrics port' in conf: # serve metrics on http://127.0.0.1:<port>/metrics
+		metrics = Metrics()
+		metrics.serve(int(conf['metrics port'][0]))
 	try:
-		username, realname = conf['username'][0], conf['realname'][0]
-		nicks, channels, servers = conf['nick'], conf['channel'], conf['server']
-		useSsl = 'use ssl' in conf
-		logPath = conf['log path'][0]
-		isSilenced = 'silenced' in conf or 'quiet' in conf
+		client = clientFromConf(conf, writer, metrics, os.path.splitext(os.path.basename(confname))[0])
+		if 'profile handlers' in conf: # budget in ms; SIGUSR1 dumps a report and cProfile stats
+			client.profiler = HandlerProfiler(float(conf['profile handlers'][0]) / 1000, cprofile = True)
+			client.profiler.installSignal()
 	except KeyError as err:
-		print('Missing config key: %s' % err.message)
+		print('Missing config key: %s' % err)
+	except (ValueError, OSError) as err:
+		print('%s: %s' % (confname, err))
 	else:
-		# create a new client & set config
-		client = IRCClient(username = username, realname = realname)
-		client.addNicks(*nicks)
-		for channel in channels:
-			if ':' in channel:
-				client.addChannel(*channel.rsplit(':', 1)) # split channel string into name and password
-			else:
-				client.addChannel(channel)
-		for server in servers:
-			host, port = server.split(':')
-			client.addServer(host, port, useSsl) # split server string into host and port
-		# create and add loggers
-		logToFile = AutoNamedIRCLogger(logPath, 2**7)
-		client.addLogger(logToFile)
-		if not isSilenced:
-			logToStdout = PrettyIRCLogger(sys.stdout, 0)
-			client.addLogger(logToStdout, send = False)
 		# hand over control to the client
-		client.run()
+		watcher = ConfWatcher(confname, conf, client, writer, metrics, os.path.splitext(os.path.basename(confname))[0])
+		async def run():
+			# reload on SIGHUP, and with 'watch config: seconds' whenever the file changes
+			watcher.install(asyncio.get_running_loop(), float(conf['watch config'][0]) if 'watch config' in conf else None)
+			await client.runAsync()
+		try:
+			asyncio.run(run())
+		except KeyboardInterrupt:
+			pass
+	finally:
+		writer.stop()
 
 if __name__ == '__main__':
 	main()
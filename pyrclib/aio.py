@@ -0,0 +1,243 @@
+import asyncio
+import ssl
+from .irc import IRC, IRCConnection, IRCConnectionError, deliverMessages
+from .connection import ReceiveBuffer
+from .sendqueue import SendQueue, priorityOf, PRIORITY_HIGH
+from .resolver import defaultResolver, connectFirstAsync
+from .tls import defaultContext
+
+class AsyncIRCConnection(asyncio.BufferedProtocol):
+	"""asyncio based counterpart of IRCConnection.
+
+	The connection is only established by `open`, which has to be awaited on a running loop.
+	Messages sent before that are queued and written as soon as the transport is up.
+	Like IRCConnection, outgoing messages go through a flood controlled SendQueue;
+	it is drained with one transport write per batch whenever flood control allows.
+	Lines received while reading is paused are held back until it resumes.
+
+	Without a connected `sock`, the addresses of host are raced (see pyrclib.resolver.connectFirstAsync)."""
+	EOL = IRCConnection.EOL
+	resolver = defaultResolver
+	connectTimeout = 10 # seconds
+	def __init__(self, host: str, port: int, delegate, useSsl: bool, sock = None):
+		super().__init__()
+		self.host = host
+		self.port = port
+		self.useSsl = useSsl
+		self.sock = sock
+		self.delegate = delegate
+		self.closed = None # future, resolved when the connection is gone
+		self.sendQueue = SendQueue(getattr(delegate, 'floodControl', None))
+		self.bytesIn = 0 # totals, see pyrclib.metrics
+		self.bytesOut = 0
+		self.linesIn = 0
+		self.__transport = None
+		self.__writePaused = False
+		self.readingPaused = False
+		self.__held = [] # received lines not delivered because reading was paused
+		self.__drainHandle = None
+		self.__recvbuf = ReceiveBuffer()
+		self.__sslContext = None
+		self.__sslObject = None
+	def _sslContext(self) -> ssl.SSLContext:
+		context = getattr(self.delegate, 'sslContext', None)
+		return context if context is not None else defaultContext()
+	async def open(self):
+		loop = asyncio.get_running_loop()
+		self.closed = loop.create_future()
+		sock, self.sock = self.sock, None
+		if sock is None:
+			addresses = [(None, info) for info in await self.resolver.resolveAsync(self.host, self.port)]
+			sock = (await connectFirstAsync(addresses, timeout = self.connectTimeout))[1]
+		self.__sslContext = sslContext = self._sslContext() if self.useSsl else None
+		try:
+			await loop.create_connection(lambda: self, sock = sock, ssl = sslContext,
+				server_hostname = self.host if sslContext is not None else None)
+		except BaseException:
+			sock.close()
+			raise
+	# data handling
+	def send(self, msgString: str, priority: int = None) -> bool:
+		if self.__transport is None and self.closed is not None: # already gone
+			return False
+		msgData = msgString.encode('utf-8')
+		if msgData:
+			if priority is None:
+				priority = priorityOf(msgString)
+			self.sendQueue.put(msgData + self.EOL, priority)
+			self.__queued(priority)
+		return True
+	def sendMany(self, msgStrings: list, priority: int) -> bool:
+		"""Queue several lines of one priority class at once."""
+		if self.__transport is None and self.closed is not None:
+			return False
+		EOL = self.EOL
+		self.sendQueue.putMany([msgString.encode('utf-8') + EOL for msgString in msgStrings if msgString], priority)
+		self.__queued(priority)
+		return True
+	def __queued(self, priority: int):
+		if self.__drainHandle is None:
+			self.__drain()
+		elif priority == PRIORITY_HIGH: # don't wait for flood controlled messages
+			self.__drainHandle.cancel()
+			self.__drain()
+	def __drain(self):
+		self.__drainHandle = None
+		transport = self.__transport
+		if transport is None or self.__writePaused:
+			return
+		batch = self.sendQueue.pop()
+		if batch:
+			data = b''.join(batch)
+			transport.write(data)
+			self.bytesOut += len(data)
+		delay = self.sendQueue.nextSendDelay()
+		if delay is not None:
+			self.__drainHandle = asyncio.get_running_loop().call_later(delay, self.__drain)
+	def sendBufferSize(self) -> int:
+		return self.__transport.get_write_buffer_size() if self.__transport is not None else 0
+	def receiveBufferSize(self) -> int:
+		return len(self.__recvbuf)
+	def pauseReading(self):
+		self.readingPaused = True
+		if self.__transport is not None:
+			self.__transport.pause_reading()
+	def resumeReading(self):
+		self.readingPaused = False
+		if self.__transport is not None:
+			self.__transport.resume_reading()
+		if self.__held:
+			asyncio.get_running_loop().call_soon(self.__deliver, [])
+	# connection handling
+	def isConnected(self) -> bool:
+		return self.__transport is not None
+	def disconnect(self):
+		if self.__transport is not None:
+			self.__transport.close()
+	def abort(self, err: Exception):
+		"""Drop the connection and make `closed` raise err."""
+		if self.closed is not None and not self.closed.done():
+			self.closed.set_exception(err)
+		if self.__transport is not None:
+			self.__transport.abort()
+	# asyncio.BufferedProtocol
+	def connection_made(self, transport):
+		self.__transport = transport
+		if self.readingPaused:
+			transport.pause_reading()
+		self.__sslObject = transport.get_extra_info('ssl_object')
+		if self.__sslObject is not None and hasattr(self.__sslContext, 'handshakeDone'):
+			self.__sslContext.handshakeDone(self.host, self.__sslObject)
+		self.__drain()
+	def pause_writing(self):
+		self.__writePaused = True
+	def resume_writing(self):
+		self.__writePaused = False
+		if self.__drainHandle is None:
+			self.__drain()
+	def get_buffer(self, sizehint: int) -> memoryview:
+		return self.__recvbuf.getBuffer(max(sizehint, 4096))
+	def buffer_updated(self, nbytes: int):
+		recvbuf = self.__recvbuf
+		recvbuf.commit(nbytes)
+		self.bytesIn += nbytes
+		msgsData = recvbuf.readLines(self.EOL)
+		self.linesIn += len(msgsData)
+		self.__deliver(msgsData)
+	def __deliver(self, msgsData: list):
+		if self.__held:
+			msgsData = self.__held + msgsData
+			self.__held = []
+		try:
+			delivered = deliverMessages(self.delegate, msgsData, self)
+		except Exception as err:
+			self.abort(err)
+		else:
+			self.__held = msgsData[delivered:]
+	def connection_lost(self, exc):
+		self.__transport = None
+		if self.__sslObject is not None and hasattr(self.__sslContext, 'storeSession'):
+			self.__sslContext.storeSession(self.host, self.__sslObject) # with the session tickets received since the handshake
+		if self.__drainHandle is not None:
+			self.__drainHandle.cancel()
+			self.__drainHandle = None
+		if not self.closed.done():
+			if exc is None:
+				self.closed.set_result(None)
+			else:
+				self.closed.set_exception(IRCConnectionError(str(exc)))
+
+class AsyncIRC(IRC):
+	"""IRC running on an asyncio event loop.
+
+	Instead of polling like IRCBase.run, this only wakes up when data arrives or a timer is due.
+	Use `await irc.runAsync()` from a running loop, or `irc.run()` to start a loop of its own."""
+	_connectionClass = AsyncIRCConnection
+	keepAliveInterval = 5000 # check the connection at least every X ms
+	def __init__(self, nick: str, user: str, real: str):
+		super().__init__(nick, user, real)
+		self.__loop = None
+		self.__wakeHandle = None
+		self.__wakeTime = None # when the wake handle is due (TimerManager clock)
+	def callIn(self, ms, func, *args, **kwargs):
+		timer = super().callIn(ms, func, *args, **kwargs)
+		self.__timerAdded(timer)
+		return timer
+	def callEvery(self, ms, func, *args, **kwargs):
+		timer = super().callEvery(ms, func, *args, **kwargs)
+		self.__timerAdded(timer)
+		return timer
+	def __timerAdded(self, timer):
+		if self.__wakeTime is None or timer.deadline < self.__wakeTime:
+			self.__scheduleWake()
+	def __scheduleWake(self):
+		if self.__loop is None:
+			return
+		if self.__wakeHandle is not None:
+			self.__wakeHandle.cancel()
+		now = self._now()
+		wakeTime = now + self.keepAliveInterval
+		deadline = self.nextDeadline()
+		if deadline is not None and deadline < wakeTime:
+			wakeTime = deadline
+		self.__wakeTime = wakeTime
+		self.__wakeHandle = self.__loop.call_later(max(0, wakeTime - now) / 1000, self.__wake)
+	def __wake(self):
+		self.__wakeHandle = self.__wakeTime = None
+		try:
+			self.tick()
+		except Exception as err:
+			self._ircConnection.abort(err)
+		else:
+			self.__scheduleWake()
+	def _wakeUp(self):
+		loop = self.__loop
+		if loop is not None: # otherwise the posted calls run with the first tick
+			try:
+				loop.call_soon_threadsafe(self.__runPosted)
+			except RuntimeError: # loop closed
+				pass
+	def __runPosted(self):
+		try:
+			self._runPosted()
+		except Exception as err:
+			self._ircConnection.abort(err)
+	#
+	async def runAsync(self):
+		self.isRunning = True
+		self.__loop = asyncio.get_running_loop()
+		con = self._ircConnection
+		try:
+			await con.open()
+			self.__scheduleWake()
+			await con.closed
+		finally:
+			if self.__wakeHandle is not None:
+				self.__wakeHandle.cancel()
+				self.__wakeHandle = self.__wakeTime = None
+			self.__loop = None
+			con.disconnect()
+		if self.isRunning:
+			raise IRCConnectionError('Connection closed by remote.')
+	def run(self):
+		asyncio.run(self.runAsync())
@@ -0,0 +1,176 @@
+"""Compressed, time indexed log archives.
+
+An archive is a set of daily segments named `basename-YYYY-MM-DD.log.gz` (or `.log.xz`).
+A segment is a series of independently compressed blocks (gzip members or xz streams),
+so it can still be read as a whole by zcat/xzcat. Every segment has a sidecar index
+`<segment>.idx` with one line per block: first timestamp, last timestamp, offset, length and line count.
+Readers use it to only decompress the blocks overlapping the requested time window.
+
+Lines are stored in RawIRCLogger format: `<unix timestamp> <raw line>`.
+"""
+
+import gzip
+import lzma
+import os
+import re
+import sys
+import time
+from .logger import AutoNamedLogger, RawIRCLogger, PrettyIRCLogger
+from .message import MessageBase as Message
+
+compressions = {
+	'gzip': ('.log.gz', lambda data: gzip.compress(data, mtime = 0), gzip.decompress),
+	'lzma': ('.log.xz', lambda data: lzma.compress(data, lzma.FORMAT_XZ), lzma.decompress),
+}
+
+def _timestamp(line: bytes) -> float:
+	return float(line[:line.index(b' ')])
+
+def _checkCompression(compression: str):
+	if compression not in compressions:
+		raise ValueError('Unknown compression: %s (known: %s)' % (compression, ', '.join(sorted(compressions))))
+
+class ArchiveLogger(AutoNamedLogger):
+	"""A logger writing block compressed, indexed daily archive segments.
+
+	Every flush becomes one compressed block; compressing and writing happen in the writer
+	(so on its thread with a BackgroundWriter). Logged lines have to start with a unix timestamp.
+	Raise ValueError for a compression not in `compressions`."""
+	def __init__(self, basename, maxBufferLines: int = 2**12, writer = None, compression: str = 'gzip', maxBufferBytes: int = 2**20):
+		_checkCompression(compression)
+		super().__init__(basename, maxBufferLines, writer, maxBufferBytes)
+		self.compression = compression
+		self.__files = {} # path -> open file; only used from the writer
+	def _rotate(self):
+		self.close()
+		now = time.localtime()
+		suffix = compressions[self.compression][0]
+		self._out = '%s-%s%s' % (self.basename, time.strftime('%Y-%m-%d', now), suffix)
+		self._rotateAt = time.mktime((now.tm_year, now.tm_mon, now.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+	def flush(self):
+		if not self._buf:
+			return
+		lineCount = self._bufLines
+		self._writer.submit(self._writeBlock, self._out, self._takeBuffer(), lineCount)
+	def close(self):
+		self.flush()
+		self._writer.submit(self._closeFiles)
+	# called by the writer
+	def __file(self, path: str):
+		fo = self.__files.get(path)
+		if fo is None:
+			fo = self.__files[path] = open(path, 'ab')
+		return fo
+	def _writeBlock(self, path: str, data: bytearray, lineCount: int):
+		compress = compressions[self.compression][1]
+		block = compress(data)
+		segment = self.__file(path)
+		offset = segment.tell()
+		segment.write(block)
+		segment.flush()
+		index = self.__file(path + '.idx')
+		lastLine = data[data.rfind(b'\n', 0, len(data) - 1) + 1:]
+		index.write(b'%.3f %.3f %i %i %i\n' % (_timestamp(data), _timestamp(lastLine), offset, len(block), lineCount))
+		index.flush()
+	def _closeFiles(self):
+		files, self.__files = self.__files, {}
+		for fo in files.values():
+			fo.close()
+
+class ArchiveIRCLogger(ArchiveLogger, RawIRCLogger):
+	"""Log all IRC messages in raw form into an archive."""
+	bytesThrough = True
+
+def segments(basename: str, suffix: str, start: float = None, end: float = None) -> list:
+	"""Return the paths of the daily segments `basename-YYYY-MM-DD<suffix>` overlapping the time window, oldest first."""
+	directory, name = os.path.split(basename)
+	pattern = re.compile(re.escape(name) + r'-(\d{4})-(\d\d)-(\d\d)' + re.escape(suffix) + '$')
+	found = []
+	for fn in os.listdir(directory or '.'):
+		match = pattern.match(fn)
+		if match is None:
+			continue
+		year, month, day = (int(e) for e in match.groups())
+		segStart = time.mktime((year, month, day, 0, 0, 0, 0, 0, -1))
+		segEnd = time.mktime((year, month, day + 1, 0, 0, 0, 0, 0, -1))
+		if (start is None or segEnd > start) and (end is None or segStart <= end):
+			found.append((segStart, os.path.join(directory, fn)))
+	return [path for segStart, path in sorted(found)]
+
+class ArchiveReader:
+	"""Reads lines of a time window from an archive.
+
+	Raise ValueError for a compression not in `compressions`."""
+	def __init__(self, basename: str, compression: str = 'gzip'):
+		_checkCompression(compression)
+		self.basename = basename
+		self.compression = compression
+	def segments(self, start: float = None, end: float = None) -> list:
+		"""Return the paths of the segments overlapping the time window, oldest first."""
+		return segments(self.basename, compressions[self.compression][0], start, end)
+	@staticmethod
+	def blocks(path: str) -> list:
+		"""Return the index of a segment as a list of (first timestamp, last timestamp, offset, length, line count)."""
+		blocks = []
+		with open(path + '.idx', 'rb') as fo:
+			for line in fo:
+				first, last, offset, length, count = line.split()
+				blocks.append((float(first), float(last), int(offset), int(length), int(count)))
+		return blocks
+	def read(self, start: float = None, end: float = None):
+		"""Yield the lines (bytes, without line break) logged within [start, end]."""
+		decompress = compressions[self.compression][2]
+		for path in self.segments(start, end):
+			with open(path, 'rb') as fo:
+				for first, last, offset, length, count in self.blocks(path):
+					if (start is not None and last < start) or (end is not None and first > end):
+						continue
+					fo.seek(offset)
+					for line in decompress(fo.read(length)).split(b'\n'):
+						if not line:
+							continue
+						if start is not None or end is not None:
+							ts = _timestamp(line)
+							if (start is not None and ts < start) or (end is not None and ts > end):
+								continue
+						yield line
+
+def parseTime(s: str) -> float:
+	"""Parse a unix timestamp or a local time like `2020-01-31 14:32[:00]`."""
+	try:
+		return float(s)
+	except ValueError:
+		pass
+	for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+		try:
+			return time.mktime(time.strptime(s, fmt))
+		except ValueError:
+			pass
+	raise ValueError('Invalid time: %s' % s)
+
+def main(argv = None):
+	import argparse
+	parser = argparse.ArgumentParser(description = 'Print the lines of a time window from a log archive.')
+	parser.add_argument('basename', help = 'archive base name (path without -YYYY-MM-DD.log.gz)')
+	parser.add_argument('--from', dest = 'start', type = parseTime, help = 'unix timestamp or local time (YYYY-MM-DD HH:MM[:SS])')
+	parser.add_argument('--to', dest = 'end', type = parseTime, help = 'unix timestamp or local time (YYYY-MM-DD HH:MM[:SS])')
+	parser.add_argument('--pretty', action = 'store_true', help = 'print in PrettyIRCLogger format instead of raw')
+	parser.add_argument('--compression', choices = sorted(compressions), default = 'gzip')
+	args = parser.parse_args(argv)
+	reader = ArchiveReader(args.basename, args.compression)
+	out = sys.stdout.buffer
+	pretty = PrettyIRCLogger(None) if args.pretty else None
+	try:
+		for line in reader.read(args.start, args.end):
+			if pretty is not None:
+				ts, raw = line.split(b' ', 1)
+				line = pretty.format(Message(raw), float(ts))
+				if line is None:
+					continue
+				line = line.encode('utf-8')
+			out.write(line + b'\n')
+	except BrokenPipeError:
+		pass
+
+if __name__ == '__main__':
+	main()
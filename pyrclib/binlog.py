@@ -0,0 +1,291 @@
+"""Binary logs: compact records which can be filtered without parsing IRC lines.
+
+A binary log is a set of daily segments named `basename-YYYY-MM-DD.bin`. A segment is a series of
+blocks, one per flush, each of them self-contained:
+
+	header: magic b'PYRB', name table length, records length, record count, first and last timestamp
+	name table: the names used in the block, separated by line feeds; the first one has id 1
+	records: payload length (u32), timestamp (f64), command id, channel id, nick id (u16 each), payload
+
+All numbers are little endian. Id 0 means none. The payload is the raw line as received (or sent).
+Commands are stored upper case, channels and nicks lower case (rfc1459), so lookups ignore case.
+
+Readers map segments and walk the block headers: blocks outside the time window are skipped,
+as are blocks whose name table lacks a name filtered for (a substring search on the table).
+Only the fixed size record headers of the remaining blocks are decoded; payloads are never parsed.
+A block written partially (e.g. by a crash) is cut off when the logger opens the segment again;
+readers skip such blocks by searching for the next magic.
+"""
+
+import mmap
+import struct
+import sys
+import time
+from .archive import segments, parseTime
+from .logger import AutoNamedLogger, IRCLoggerBase, PrettyIRCLogger
+from .message import MessageBase as Message
+
+suffix = '.bin'
+_magic = b'PYRB'
+_blockHeader = struct.Struct('<4sIIIdd') # magic, name table length, records length, record count, first and last timestamp
+_recordHeader = struct.Struct('<IdHHH') # payload length, timestamp, command, channel and nick ids
+_maxNames = 2**16 - 1
+_lowerTable = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\~', b'abcdefghijklmnopqrstuvwxyz{}|^')
+
+def lower(name: 'str or bytes') -> bytes:
+	"""Fold a channel or nick the way they are stored."""
+	if isinstance(name, str):
+		name = name.encode('utf-8')
+	return name.translate(_lowerTable)
+
+def fields(data: bytes) -> tuple:
+	"""Return the command, channel and nick of a raw line as stored (bytes, channel and nick None if absent)."""
+	nick = channel = None
+	start = 0
+	if data.startswith(b'@'): # skip tags
+		start = data.find(b' ') + 1
+		if not start:
+			return b'', channel, nick
+	if data.startswith(b':', start):
+		end = data.find(b' ', start)
+		if end < 0:
+			return b'', channel, nick
+		nick = data[start + 1:end].split(b'!', 1)[0].translate(_lowerTable)
+		start = end + 1
+	end = data.find(b' ', start)
+	if end < 0:
+		return data[start:].upper(), channel, nick
+	command = data[start:end].upper()
+	# first param, if it's a channel (JOIN's may be trailing, ours may be a list)
+	start = end + 1
+	if data.startswith(b':', start):
+		start += 1
+	if data[start:start + 1] in (b'#', b'&'):
+		end = len(data)
+		for sep in b' ', b',':
+			pos = data.find(sep, start, end)
+			if pos >= 0:
+				end = pos
+		channel = data[start:end].translate(_lowerTable)
+	return command, channel, nick
+
+class BinaryLogger(AutoNamedLogger):
+	"""A logger writing daily binary log segments (see the module documentation).
+
+	Every flush becomes one block, which is written by the writer (so on its thread with a BackgroundWriter)."""
+	def __init__(self, basename, maxBufferLines: int = 2**14, writer = None, maxBufferBytes: int = 2**20):
+		if not 0 < maxBufferLines <= _maxNames // 3:
+			raise ValueError('maxBufferLines must be between 1 and %i.' % (_maxNames // 3))
+		super().__init__(basename, maxBufferLines, writer, maxBufferBytes)
+		self._names = {} # name -> id in the buffered block
+		self.__files = {} # path -> open file; only used from the writer
+		self._firstTime = self._lastTime = 0.0
+	def _rotate(self):
+		self.close()
+		now = time.localtime()
+		self._out = '%s-%s%s' % (self.basename, time.strftime('%Y-%m-%d', now), suffix)
+		self._rotateAt = time.mktime((now.tm_year, now.tm_mon, now.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+	def _id(self, name: bytes) -> int:
+		if not name:
+			return 0
+		names = self._names
+		id = names.get(name)
+		if id is None:
+			id = names[name] = len(names) + 1
+		return id
+	def logRecord(self, timestamp: float, data: bytes):
+		"""Log a raw line (bytes, without line break)."""
+		self._checkTarget()
+		command, channel, nick = fields(data)
+		buf = self._buf
+		buf += _recordHeader.pack(len(data), timestamp, self._id(command), self._id(channel), self._id(nick))
+		buf += data
+		if not self._bufLines:
+			self._firstTime = timestamp
+		self._lastTime = timestamp
+		self._bufLines += 1
+		if self._bufLines >= self._maxBufferLines or len(buf) > self._maxBufferBytes:
+			self.flush()
+	def log(self, s: 'str or bytes'):
+		self.logRecord(time.time(), s if isinstance(s, bytes) else s.encode('utf-8'))
+	def flush(self):
+		if not self._buf:
+			return
+		table = b'\n'.join(self._names)
+		self._names = {}
+		header = _blockHeader.pack(_magic, len(table), len(self._buf), self._bufLines, self._firstTime, self._lastTime)
+		self._writer.submit(self._writeBlock, self._out, header + table, self._takeBuffer())
+	def close(self):
+		self.flush()
+		self._writer.submit(self._closeFiles)
+	# called by the writer
+	def _writeBlock(self, path: str, head: bytes, records: bytearray):
+		fo = self.__files.get(path)
+		if fo is None:
+			fo = open(path, 'ab')
+			offset = _complete(path)
+			if offset < fo.tell():
+				print('Cutting off %i bytes of a partial block at the end of %s.' % (fo.tell() - offset, path))
+				fo.truncate(offset)
+				fo.seek(offset)
+			self.__files[path] = fo
+		offset = fo.tell()
+		try:
+			fo.write(head)
+			fo.write(records)
+			fo.flush()
+		except OSError:
+			fo.truncate(offset) # keep the segment readable past this block
+			raise
+	def _closeFiles(self):
+		files, self.__files = self.__files, {}
+		for fo in files.values():
+			fo.close()
+
+def _blocks(data):
+	"""Yield (table start, records start, end, first, last timestamp) of the complete blocks in a segment's data.
+
+	A block is complete if it's followed by another block or the end of data; others are skipped."""
+	size = len(data)
+	pos = 0
+	while pos + _blockHeader.size <= size:
+		magic, tableLength, recordsLength, count, first, last = _blockHeader.unpack_from(data, pos)
+		tableStart = pos + _blockHeader.size
+		recordsStart = tableStart + tableLength
+		end = recordsStart + recordsLength
+		if magic != _magic or not (end == size or (end < size and data[end:end + len(_magic)] == _magic)):
+			pos = data.find(_magic, pos + 1) # not (completely) written
+			if pos < 0:
+				return
+			continue
+		yield tableStart, recordsStart, end, first, last
+		pos = end
+
+def _complete(path: str) -> int:
+	"""Return the end of the last complete block of a segment."""
+	end = 0
+	with open(path, 'rb') as fo:
+		try:
+			mm = mmap.mmap(fo.fileno(), 0, access = mmap.ACCESS_READ)
+		except ValueError: # empty file
+			return end
+	with mm:
+		for tableStart, recordsStart, end, first, last in _blocks(mm):
+			pass
+	return end
+
+class BinaryIRCLogger(BinaryLogger, IRCLoggerBase):
+	"""Log all IRC messages into a binary log."""
+	def log(self, irc, msg):
+		self.logRecord(time.time(), msg.rawBytes)
+
+def _ids(table: bytes, names: frozenset) -> set:
+	"""Return the ids of the names found in a block's name table (with a line feed added at both ends)."""
+	ids = set()
+	if not any(b'\n' + name + b'\n' in table for name in names):
+		return ids
+	for id, name in enumerate(table[1:-1].split(b'\n'), 1):
+		if name in names:
+			ids.add(id)
+	return ids
+
+class BinaryLogReader:
+	"""Reads records from a binary log.
+
+	Filters are a name or a list of names; channels and nicks are compared ignoring case."""
+	def __init__(self, basename: str):
+		self.basename = basename
+	def segments(self, start: float = None, end: float = None) -> list:
+		"""Return the paths of the segments overlapping the time window, oldest first."""
+		return segments(self.basename, suffix, start, end)
+	@staticmethod
+	def _names(names, fold) -> frozenset:
+		if names is None:
+			return None
+		if isinstance(names, (str, bytes)):
+			names = [names]
+		return frozenset(fold(name.encode('utf-8') if isinstance(name, str) else name) for name in names)
+	def read(self, start: float = None, end: float = None, command = None, channel = None, nick = None):
+		"""Yield the (timestamp, raw line bytes) records within [start, end] matching all given filters."""
+		filters = [self._names(command, bytes.upper), self._names(channel, lower), self._names(nick, lower)]
+		for path in self.segments(start, end):
+			with open(path, 'rb') as fo:
+				try:
+					mm = mmap.mmap(fo.fileno(), 0, access = mmap.ACCESS_READ)
+				except ValueError: # empty file
+					continue
+			with mm:
+				yield from self._readSegment(mm, start, end, filters)
+	@staticmethod
+	def _readSegment(mm, start: float, end: float, filters: list):
+		unpackRecord = _recordHeader.unpack_from
+		recordSize = _recordHeader.size
+		for tableStart, recordsStart, pos, first, last in _blocks(mm):
+			if (start is not None and last < start) or (end is not None and first > end):
+				continue
+			wanted = [None, None, None]
+			if any(names is not None for names in filters):
+				table = b'\n' + mm[tableStart:recordsStart] + b'\n'
+				skip = False
+				for i, names in enumerate(filters):
+					if names is not None:
+						wanted[i] = _ids(table, names)
+						if not wanted[i]:
+							skip = True
+							break
+				if skip:
+					continue
+			commands, channels, nicks = wanted
+			timeFiltered = (start is not None and first < start) or (end is not None and last > end)
+			p = recordsStart
+			while p + recordSize <= pos:
+				length, ts, commandId, channelId, nickId = unpackRecord(mm, p)
+				p += recordSize
+				if p + length > pos:
+					break # a damaged block
+				if ((commands is None or commandId in commands)
+						and (channels is None or channelId in channels)
+						and (nicks is None or nickId in nicks)
+						and not (timeFiltered and ((start is not None and ts < start) or (end is not None and ts > end)))):
+					yield ts, mm[p:p + length]
+				p += length
+
+def rawLines(records):
+	"""Convert records to lines in RawIRCLogger format (bytes, without line break)."""
+	for ts, data in records:
+		yield b'%.3f %s' % (ts, data)
+
+def prettyLines(records):
+	"""Convert records to lines in PrettyIRCLogger format, leaving out the ones it doesn't log."""
+	pretty = PrettyIRCLogger(None)
+	for ts, data in records:
+		line = pretty.format(Message(data), ts)
+		if line is not None:
+			yield line
+
+def main(argv = None):
+	import argparse
+	parser = argparse.ArgumentParser(description = 'Print the lines of a binary log matching a time window and filters.')
+	parser.add_argument('basename', help = 'log base name (path without -YYYY-MM-DD.bin)')
+	parser.add_argument('--from', dest = 'start', type = parseTime, help = 'unix timestamp or local time (YYYY-MM-DD HH:MM[:SS])')
+	parser.add_argument('--to', dest = 'end', type = parseTime, help = 'unix timestamp or local time (YYYY-MM-DD HH:MM[:SS])')
+	parser.add_argument('--command', action = 'append', help = 'only lines of this command (may be repeated)')
+	parser.add_argument('--channel', action = 'append', help = 'only lines to this channel (may be repeated)')
+	parser.add_argument('--nick', action = 'append', help = 'only lines from this nick (may be repeated)')
+	parser.add_argument('--pretty', action = 'store_true', help = 'print in PrettyIRCLogger format instead of raw')
+	parser.add_argument('--count', action = 'store_true', help = 'only print the number of matching lines')
+	args = parser.parse_args(argv)
+	records = BinaryLogReader(args.basename).read(args.start, args.end, args.command, args.channel, args.nick)
+	if args.count:
+		print(sum(1 for record in records))
+		return
+	out = sys.stdout.buffer
+	lines = (line.encode('utf-8') for line in prettyLines(records)) if args.pretty else rawLines(records)
+	try:
+		for line in lines:
+			out.write(line + b'\n')
+	except BrokenPipeError:
+		pass
+
+if __name__ == '__main__':
+	main()
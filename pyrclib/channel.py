@@ -5,12 +5,25 @@ class Channel(EventEmitter):
 		super().__init__()
 		self.irc = irc
 		self.name = channel
-		irc.addEventHandler('recv', self.__onJoin)
 		# self.users = []
 		self.__joined = False
+		self.__subscription = None
+		self.rejoin()
+	def rejoin(self):
+		"""Wait for the join to complete again (after IRCBase.join was called for a known channel)."""
+		self.__joined = False
+		if self.__subscription is None:
+			self.__subscription = self.irc.addEventHandler('recv', self.__onJoin, 'RPL_ENDOFNAMES')
+	def dispose(self):
+		"""Stop listening to the IRC instance."""
+		if self.__subscription is not None:
+			self.__subscription.remove()
+			self.__subscription = None
 	def __onJoin(self, irc, msg):
-		if msg.command == '366' or msg.command == 'RPL_ENDOFNAMES': # on successful join, a server sends a list of names.
+		# on successful join, a server sends a list of names.
+		if len(msg.params) > 1 and msg.params[1].lower() == self.name.lower():
 			self.__joined = True
+			self.dispose() # only needed until the join completed
 			self.emitEvent('join', self)
 	def msg(self, text: str):
 		if self.__joined:
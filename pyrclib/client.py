@@ -1,8 +1,19 @@
 from .irc import IRC
-from time import sleep
+from .aio import AsyncIRC
+from .sendqueue import FloodControl
+from .state import StateTracker
+from .servers import ServerPool, connectAny, connectAnyAsync
+from .resolver import defaultResolver
+from time import sleep, monotonic
+import asyncio
 import traceback
 
+def _channelName(channel) -> str:
+	return channel if isinstance(channel, str) else channel[0]
+
 class IRCClient:
+	raceServers = 2 # number of servers connected to at once, the first one to answer is used
+	joinTimeout = 30 # seconds after RPL_WELCOME to join the channels if the end of the MOTD doesn't come
 	def __init__(self, nicknames = None, username = None, realname = None, servers = None, channels = None):
 		super().__init__()
 		# config
@@ -10,69 +21,209 @@ class IRCClient:
 		self.username = username
 		self.realname = realname
 		self.servers = list(servers) if servers is not None else []
+		self.serverPool = ServerPool(self.servers) # health and backoff of the servers
+		self.resolver = defaultResolver
 		self.channels = list(channels) if channels is not None else []
 		self.loggers = []
+		self.floodControl = FloodControl() # outbound rate limit, None to disable
+		self.sslContext = None # see pyrclib.tls, None for the default context
+		self.metrics = None # see pyrclib.metrics.Metrics.watchClient
+		self.metricsLabels = {}
+		self.profiler = None # see pyrclib.profiling.HandlerProfiler
+		self.offloader = None # see pyrclib.offload.Offloader
 		# state
 		self.isRunning = False
 		self.isConnected = False
-		self.joinedChannels = []
+		self.state = None # StateTracker of the IRC instance
+		self.reconnects = {} # reason (exception type name) -> count
 		self.irc = None # reference to the IRC instance
 		# private state
 		self.__nickIndex = 0
-		self.__serverIndex = -1
+		self.__channelsJoined = False
+		self.__joinTimer = None # joins the channels if the end of the MOTD doesn't come
+		self.__loggerSubscriptions = {} # id(logger) -> Subscriptions
 	# accessors
 	def addNicks(self, *names):
 		for name in names:
 			self.nicknames.append(name)
 	def addServer(self, host, port, useSsl):
 		self.servers.append((host, port, useSsl))
+		self.serverPool.add(host, port, useSsl)
 	def addChannel(self, name, passwd = None):
 		self.channels.append((name, passwd))
 	def addLogger(self, logger, send = True, recv = True):
 		self.loggers.append((logger, send, recv))
+		if self.irc is not None:
+			self.__subscribeLogger(logger, send, recv)
+	def removeLogger(self, logger):
+		"""Stop logging to a logger and close it, writing the lines it buffered."""
+		for i, (other, send, recv) in enumerate(self.loggers):
+			if other is logger:
+				del self.loggers[i]
+				break
+		else:
+			raise ValueError('No such logger.')
+		for sub in self.__loggerSubscriptions.pop(id(logger), ()):
+			sub.remove()
+		timer = getattr(logger, '_flushTimer', None)
+		if timer is not None:
+			timer.cancel()
+		logger.close()
+	def __subscribeLogger(self, logger, send: bool, recv: bool):
+		subs = self.__loggerSubscriptions.setdefault(id(logger), [])
+		if send: subs.append(self.irc.addEventHandler('send', logger))
+		if recv: subs.append(self.irc.addEventHandler('recv', logger))
+	# changes while running
+	def setNicks(self, nicks: list):
+		"""Change the nicks; if ours isn't one of them anymore, change to the first."""
+		self.nicknames = list(nicks)
+		self.__nickIndex = 0
+		current = self.state.nick if self.state is not None else None
+		if self.irc is not None and self.isConnected and current not in self.nicknames:
+			self.irc.nick(self.nicknames[0])
+	def setChannels(self, channels: list):
+		"""Change the channels (names or (name, password) pairs); when connected, join and part the difference."""
+		fold = self.state.isupport.lower if self.state is not None else str.lower
+		def names(channels):
+			return {fold(_channelName(channel)): _channelName(channel) for channel in channels}
+		old, new = names(self.channels), names(channels)
+		self.channels = list(channels)
+		if self.irc is None or not self.__channelsJoined: # joined with the new list at the end of the MOTD (or after joinTimeout)
+			return
+		parting = [name for folded, name in old.items() if folded not in new]
+		if parting:
+			self.irc.partMany(parting)
+		joining = [channel for channel in channels if fold(_channelName(channel)) not in old]
+		if joining:
+			self.irc.joinMany(joining)
+	def setServers(self, servers: list):
+		"""Change the (host, port, useSsl) servers used for the next connects; the current connection stays."""
+		self.servers = list(servers)
+		self.serverPool.update(self.servers)
+	def setFloodControl(self, floodControl: FloodControl):
+		self.floodControl = floodControl
+		if self.irc is not None:
+			self.irc.floodControl = floodControl
+			if self.irc.sendQueue is not None:
+				self.irc.sendQueue.floodControl = floodControl
+	def flushLoggers(self):
+		for logger, send, recv in self.loggers:
+			logger.flush()
+	@property
+	def joinedChannels(self) -> list:
+		"""The names of the channels we are in."""
+		return self.state.channels() if self.state is not None else []
 	# irc msg handlers
 	def successfullyConnectedHandler(self, irc, msg):
-		# check if we just successfully connected (a welcome or motd message = connected)
-		if not self.isConnected and msg.command in ('001', 'RPL_WELCOME', '376', 'RPL_ENDOFMOTD'):
-			self.isConnected = True
-			# join channels
-			for channel in self.channels:
-				if isinstance(channel, str):
-					irc.join(channel)
-				else:
-					irc.join(*channel)
+		"""RPL_WELCOME handler"""
+		self.isConnected = True
+		self.__channelsJoined = False
+		# some servers send neither RPL_ENDOFMOTD nor ERR_NOMOTD
+		self.__cancelJoinTimer()
+		self.__joinTimer = irc.callIn(self.joinTimeout * 1000, self.endOfMotdHandler, irc, None)
+	def endOfMotdHandler(self, irc, msg):
+		"""RPL_ENDOFMOTD/ERR_NOMOTD handler: ISUPPORT is known by now, join the channels in as few messages as it allows"""
+		self.__cancelJoinTimer()
+		if irc is self.irc and not self.__channelsJoined:
+			self.__channelsJoined = True
+			irc.joinMany(self.channels)
 	def nickAlreadyInUseHandler(self, irc, msg):
 		"""`nickname already in use` error handler"""
-		if msg.command in ('433', 'ERR_NICKNAMEINUSE'):
-			self.__nickIndex = (self.__nickIndex + 1) % len(self.nicknames)
-			irc.nick(self.nicknames[self.__nickIndex])
-			return True
+		self.__nickIndex = (self.__nickIndex + 1) % len(self.nicknames)
+		irc.nick(self.nicknames[self.__nickIndex])
+		return True
+	def __cancelJoinTimer(self):
+		if self.__joinTimer is not None:
+			self.__joinTimer.cancel()
+			self.__joinTimer = None
 	# 
-	def run(self):
-		self.irc = irc = IRC(self.nicknames[0], self.username, self.realname)
+	def _createIRC(self, ircClass):
+		self.irc = irc = ircClass(self.nicknames[0], self.username, self.realname)
+		irc.floodControl = self.floodControl
+		irc.sslContext = self.sslContext
+		self.state = StateTracker(irc)
 		# add own handlers first
-		irc.addEventHandler('recv', self.nickAlreadyInUseHandler)
-		irc.addEventHandler('recv', self.successfullyConnectedHandler)
+		irc.addEventHandler('recv', self.nickAlreadyInUseHandler, 'ERR_NICKNAMEINUSE')
+		irc.addEventHandler('recv', self.successfullyConnectedHandler, 'RPL_WELCOME')
+		irc.addEventHandler('recv', self.endOfMotdHandler, 'RPL_ENDOFMOTD')
+		irc.addEventHandler('recv', self.endOfMotdHandler, 'ERR_NOMOTD')
 		# add external handlers (loggers)
 		for logger, send, recv in self.loggers:
-			if send: irc.addEventHandler('send', logger)
-			if recv: irc.addEventHandler('recv', logger)
-		#
+			self.__subscribeLogger(logger, send, recv)
+		if self.metrics is not None:
+			self.metrics.watchIRC(irc, **self.metricsLabels)
+		if self.offloader is not None:
+			self.offloader.install(irc)
+		if self.profiler is not None:
+			self.profiler.install(irc)
+		return irc
+	def _discardIRC(self, irc):
+		"""Called when `run` is done with an IRC instance: drop what refers to it from shared objects."""
+		self.__cancelJoinTimer()
+		if self.offloader is not None:
+			self.offloader.uninstall(irc)
+	def _countReconnect(self, err: Exception):
+		reason = type(err).__name__
+		self.reconnects[reason] = self.reconnects.get(reason, 0) + 1
+	def _connectionFailed(self, err: Exception, server: tuple, connectedAt: float) -> float:
+		"""Record a failed or lost connection; return the seconds to wait before reconnecting."""
+		self.__cancelJoinTimer() # of the lost connection
+		self._countReconnect(err)
+		if connectedAt is not None: # connecting itself was recorded by connectAny
+			self.serverPool.disconnected(server, monotonic() - connectedAt, err)
+		traceback.print_exc()
+		delay = self.serverPool.nextAttemptIn()
+		if delay:
+			print('Reconnecting in %.1f seconds.' % delay)
+		return delay
+	def run(self):
+		irc = self._createIRC(IRC)
+		self.isRunning = True
+		try:
+			while self.isRunning:
+				# reset connected state
+				self.isConnected = False
+				server = connectedAt = None
+				try:
+					# race the best servers, the first one to answer wins
+					server, sock = connectAny(self.serverPool, self.raceServers, self.resolver)
+					connectedAt = monotonic()
+					irc.connect(*server, sock)
+					irc.run() # hand over control to the irc library
+				except KeyboardInterrupt:
+					self.flushLoggers()
+					raise
+				except Exception as err:
+					if not self.isRunning: # stopped on purpose
+						break
+					sleep(self._connectionFailed(err, server, connectedAt))
+		finally:
+			self._discardIRC(irc)
+	async def runAsync(self):
+		"""Like `run`, but using AsyncIRC on the running asyncio loop."""
+		irc = self._createIRC(AsyncIRC)
 		self.isRunning = True
-		while self.isRunning:
-			# get next server & port
-			self.__serverIndex = (self.__serverIndex + 1) % len(self.servers)
-			server, port, useSsl = self.servers[self.__serverIndex]
-			# reset connected state
-			self.isConnected = False
-			try:
-				irc.connect(server, port, useSsl)
-				irc.run() # hand over control to the irc library
-			except KeyboardInterrupt:
-				for logger, send, recv in self.loggers:
-					logger.flush()
-				raise
-			except Exception as err:
-				traceback.print_exc()
-				print('Reconnecting in 5 seconds.')
-				sleep(5)
+		try:
+			while self.isRunning:
+				self.isConnected = False
+				server = connectedAt = None
+				try:
+					server, sock = await connectAnyAsync(self.serverPool, self.raceServers, self.resolver)
+					connectedAt = monotonic()
+					irc.connect(*server, sock)
+					await irc.runAsync()
+				except asyncio.CancelledError:
+					self.flushLoggers()
+					raise
+				except Exception as err:
+					if not self.isRunning: # stopped on purpose
+						break
+					await asyncio.sleep(self._connectionFailed(err, server, connectedAt))
+			self.flushLoggers()
+		finally:
+			self._discardIRC(irc)
+	def stop(self, message: str = None):
+		"""Quit and stop reconnecting."""
+		self.isRunning = False
+		if self.irc is not None and self.irc.isRunning:
+			self.irc.quit(message)
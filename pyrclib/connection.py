@@ -1,34 +1,128 @@
 import socket
 import ssl
 from select import select
+from .resolver import defaultResolver, connectFirst
+from .tls import defaultContext
+
+class ReceiveBuffer:
+	"""A preallocated receive buffer with incremental line framing.
+
+	Sockets receive straight into the free space returned by `getBuffer` (no per-chunk bytes objects),
+	consumed data is reclaimed by moving the (usually tiny) unconsumed tail to the front,
+	and `readLines` only scans bytes which arrived since its last call."""
+	def __init__(self, size: int = 2**16):
+		self.__buf = bytearray(size)
+		self.__view = memoryview(self.__buf)
+		self.__start = 0 # first unconsumed byte
+		self.__end = 0 # end of received data
+		self.__scanned = 0 # data before this offset contains no complete line
+	def __len__(self):
+		return self.__end - self.__start
+	def getBuffer(self, minSize: int = 4096) -> memoryview:
+		"""Return a writable view of the free space; it is at least minSize bytes long."""
+		buf, start, end = self.__buf, self.__start, self.__end
+		if len(buf) - end < minSize:
+			size = end - start
+			if len(buf) - size < minSize:
+				# grow into a new buffer; views handed out earlier may still exist, so don't resize in place
+				newBuf = bytearray(max(2 * len(buf), size + minSize))
+				newBuf[:size] = self.__view[start:end]
+				self.__buf = buf = newBuf
+				self.__view = memoryview(newBuf)
+			elif size:
+				buf[:size] = buf[start:end]
+			self.__scanned -= start
+			self.__start, self.__end = 0, size
+		return self.__view[self.__end:]
+	def commit(self, amount: int):
+		"""Mark `amount` bytes written into the view returned by `getBuffer` as received."""
+		self.__end += amount
+	def write(self, data: bytes):
+		view = self.getBuffer(len(data))
+		view[:len(data)] = data
+		self.commit(len(data))
+	def peek(self, amount = None) -> bytes:
+		end = self.__end if amount is None else min(self.__end, self.__start + amount)
+		return bytes(self.__view[self.__start:end])
+	def discard(self, amount):
+		self.__start = min(self.__end, self.__start + amount)
+		self.__scanned = max(self.__scanned, self.__start)
+		self.__reset()
+	def readLines(self, eol: bytes) -> list:
+		"""Remove and return all complete lines (without eol)."""
+		buf, view, start, end = self.__buf, self.__view, self.__start, self.__end
+		lines = []
+		pos = buf.find(eol, max(start, self.__scanned - len(eol) + 1), end)
+		while pos >= 0:
+			lines.append(bytes(view[start:pos]))
+			start = pos + len(eol)
+			pos = buf.find(eol, start, end)
+		self.__start, self.__scanned = start, end
+		self.__reset()
+		return lines
+	def __reset(self):
+		if self.__start == self.__end: # everything consumed; start over at the front
+			self.__start = self.__end = self.__scanned = 0
 
 class SocketConnection:
-	def __init__(self, host: str, port: int, useSsl: bool):
+	"""A non-blocking socket connection.
+
+	Pass an already connected socket as `sock` (see pyrclib.servers.connectAny), otherwise the
+	addresses of host are raced (see pyrclib.resolver.connectFirst).
+
+	With useSsl, the TLS handshake runs in `tick` without blocking; data sent before it completes
+	is buffered. sslContext defaults to pyrclib.tls.defaultContext().
+
+	While reading is paused (see `pauseReading`), `tick` only sends."""
+	maxReadsPerTick = 16 # max number of recv calls per readiness event
+	resolver = defaultResolver
+	connectTimeout = 10 # seconds
+	def __init__(self, host: str, port: int, useSsl: bool, sock: socket.socket = None, sslContext: ssl.SSLContext = None):
 		self.host = host
 		self.port = port
 		self.useSsl = useSsl
-		self.__sendbuf = b''
-		self.__recvbuf = b''
-		self.__socket = self._getSocket()
-	def _getSocket(self) -> socket.socket:
-		s = None
-		for af, socktype, proto, canonname, sa in socket.getaddrinfo(self.host, self.port, socket.AF_UNSPEC, socket.SOCK_STREAM):
-			try:
-				s = socket.socket(af, socktype, proto)
-			except socket.error as msg:
-				s = None
-				continue
+		self.sslContext = sslContext if sslContext is not None or not useSsl else defaultContext()
+		self.bytesIn = 0 # totals, see pyrclib.metrics
+		self.bytesOut = 0
+		self.readingPaused = False
+		self.__sendbuf = bytearray()
+		self.__recvbuf = ReceiveBuffer()
+		self.__handshake = None # while handshaking: 'read' or 'write', the socket event the handshake waits for
+		self.__socket = self._getSocket(sock)
+		if self.__socket is not None:
+			self.__socket.setblocking(False)
+			if self.useSsl:
+				self.__socket = self.sslContext.wrap_socket(self.__socket, do_handshake_on_connect = False, server_hostname = host)
+				self.__doHandshake()
+	def _getSocket(self, sock: socket.socket = None) -> socket.socket:
+		if sock is None:
 			try:
-				if self.useSsl:
-					s = ssl.wrap_socket(s, ssl_version = ssl.PROTOCOL_TLSv1)
-				s.connect(sa)
-			except socket.error as msg:
-				s.close()
-				s = None
-				continue
-			break
-		return s
+				addresses = [(None, info) for info in self.resolver.resolve(self.host, self.port)]
+				sock = connectFirst(addresses, timeout = self.connectTimeout)[1]
+			except OSError:
+				return None
+		return sock
+	def __doHandshake(self):
+		"""Continue the TLS handshake. Raise ssl.SSLError (after disconnecting) if it fails."""
+		sock = self.__socket
+		try:
+			sock.do_handshake()
+		except ssl.SSLWantReadError:
+			self.__handshake = 'read'
+		except ssl.SSLWantWriteError:
+			self.__handshake = 'write'
+		except OSError:
+			self.disconnect()
+			raise
+		else:
+			self.__handshake = None
+			if hasattr(self.sslContext, 'handshakeDone'):
+				self.sslContext.handshakeDone(self.host, sock)
 	# data handling
+	def sendBufferSize(self) -> int:
+		return len(self.__sendbuf)
+	def receiveBufferSize(self) -> int:
+		return len(self.__recvbuf)
 	def send(self, data: bytes) -> bool:
 		if not self.isConnected():
 			return False
@@ -39,31 +133,77 @@ class SocketConnection:
 		self.discard(len(ret))
 		return ret
 	def peek(self, amount = None) -> bytes:
-		return self.__recvbuf if amount is None else self.__recvbuf[:amount]
+		return self.__recvbuf.peek(amount)
 	def discard(self, amount):
 		if amount:
-			self.__recvbuf = self.__recvbuf[amount:]
+			self.__recvbuf.discard(amount)
+	def readLines(self, eol: bytes) -> list:
+		"""Remove and return all complete lines received so far."""
+		return self.__recvbuf.readLines(eol)
 	# connection handling
 	def isConnected(self) -> bool:
 		return self.__socket is not None
 	def disconnect(self):
 		if self.__socket is not None:
+			if self.useSsl and self.__handshake is None and hasattr(self.sslContext, 'storeSession'):
+				self.sslContext.storeSession(self.host, self.__socket) # with the session tickets received since the handshake
 			self.__socket.close()
 			self.__socket = None
+	def pauseReading(self):
+		self.readingPaused = True
+	def resumeReading(self):
+		self.readingPaused = False
 	# upkeep
-	def tick(self):
+	def __recv(self) -> bool:
+		"""Read everything that's available right now. Return False if the connection was closed."""
+		sock, recvbuf = self.__socket, self.__recvbuf
+		for _ in range(self.maxReadsPerTick):
+			view = recvbuf.getBuffer()
+			size = len(view)
+			try:
+				amount = sock.recv_into(view)
+			except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+				break
+			finally:
+				view.release()
+			if amount == 0: # connection was closed by other side
+				return False
+			recvbuf.commit(amount)
+			self.bytesIn += amount
+			if amount < size and not (self.useSsl and sock.pending()):
+				break # drained
+		return True
+	def tick(self, timeout: float = 5, wakeSocket: socket.socket = None):
+		"""Wait up to `timeout` seconds for the socket to become readable (or writable, if there's data to send).
+
+		wakeSocket: a socket ending the wait when it becomes readable; its data is discarded"""
 		if not self.isConnected():
 			return
-		# send & receive socket data
 		sock = self.__socket
 		sockList = sock,
-		readable, writable, error = select(sockList, sockList, [], 5)
+		if self.__handshake is not None:
+			handshake = self.__handshake
+			select(sockList if handshake == 'read' else (), sockList if handshake == 'write' else (), [], timeout)
+			self.__doHandshake()
+			return
+		# send & receive socket data
+		readList = [] if self.readingPaused else [sock]
+		if wakeSocket is not None:
+			readList.append(wakeSocket)
+		readable, writable, error = select(readList, sockList if self.__sendbuf else (), [], timeout)
+		if wakeSocket is not None and wakeSocket in readable:
+			try:
+				wakeSocket.recv(4096)
+			except BlockingIOError:
+				pass
 		if sock in readable:
-			chunk = sock.recv(4096)
-			if len(chunk) == 0: # connection was closed by other side
+			if not self.__recv():
 				self.disconnect()
 				return
-			self.__recvbuf += chunk
 		if self.__sendbuf and sock in writable:
-			sent = sock.send(self.__sendbuf)
-			self.__sendbuf = self.__sendbuf[sent:]
+			try:
+				sent = sock.send(self.__sendbuf)
+			except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+				sent = 0
+			del self.__sendbuf[:sent]
+			self.bytesOut += sent
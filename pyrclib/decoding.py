@@ -0,0 +1,80 @@
+from collections import OrderedDict
+
+class Decoder:
+	"""Decodes received lines, trying a list of codecs.
+
+	Nicks and channels are only unique within a network, so every IRC instance has a Decoder of its own.
+
+	Pure ASCII lines are decoded right away. For everything else, the codec that worked
+	is remembered for the line's sources (the sender's nick and the target channel),
+	so the next line from there doesn't have to go through failing codecs first.
+	The number of remembered sources is bounded (least recently used ones are forgotten)."""
+	codecs = ('utf-8', 'iso-8859-15', 'shift_jis', 'latin-1')
+	def __init__(self, codecs = None, maxSources: int = 2**12):
+		if codecs is not None:
+			self.codecs = tuple(codecs)
+		self.maxSources = maxSources
+		self.__sources = OrderedDict() # source -> codec
+	@staticmethod
+	def sources(data: bytes) -> tuple:
+		"""Return the nick and channel a line came from (as bytes, or None)."""
+		nick = channel = None
+		start = 0
+		if data.startswith(b'@'): # skip tags
+			start = data.find(b' ') + 1
+			if not start:
+				return nick, channel
+		if data.startswith(b':', start):
+			end = data.find(b' ', start)
+			if end < 0:
+				return nick, channel
+			prefix = data[start + 1:end]
+			nick = prefix.split(b'!', 1)[0]
+			start = end + 1
+		# first param, if it's a channel
+		start = data.find(b' ', start) + 1
+		if start and data[start:start + 1] in (b'#', b'&'):
+			end = data.find(b' ', start)
+			channel = data[start:] if end < 0 else data[start:end]
+		return nick, channel
+	def __remember(self, source: bytes, codec: str):
+		sources = self.__sources
+		sources[source] = codec
+		sources.move_to_end(source)
+		if len(sources) > self.maxSources:
+			sources.popitem(last = False)
+	def decode(self, data: bytes) -> str:
+		"""Decode a line.
+
+		utf-8 is always tried first: it rejects what isn't utf-8, while the single byte codecs accept
+		any input, so trying one of them first would garble later utf-8 lines of the same source.
+		After utf-8, the codec remembered for the sender comes first, since clients don't change their
+		encoding, then the one remembered for the channel, then the other codecs.
+
+		Raise UnicodeError if no codec works."""
+		if data.isascii():
+			return data.decode('ascii')
+		try:
+			return data.decode('utf-8')
+		except UnicodeError:
+			pass
+		nick, channel = self.sources(data)
+		known = self.__sources
+		preferred = [known.get(source) for source in (nick, channel) if source is not None]
+		codecs = [codec for codec in preferred if codec is not None] + list(self.codecs)
+		tried = {'utf-8'}
+		for codec in codecs:
+			if codec in tried:
+				continue
+			tried.add(codec)
+			try:
+				s = data.decode(codec)
+			except UnicodeError:
+				continue
+			for source in (nick, channel):
+				if source is not None:
+					self.__remember(source, codec)
+			return s
+		raise UnicodeError('Could not decode message text.')
+
+defaultDecoder = Decoder() # for messages not received by an IRC instance
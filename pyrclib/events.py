@@ -1,16 +1,104 @@
+from itertools import count
+
+_order = count() # global registration order, used to merge keyed and wildcard handlers
+
+class Subscription:
+	"""A registered event handler. Call `remove` (or use it as context manager) to unregister it."""
+	__slots__ = 'emitter', 'name', 'key', 'func', 'order'
+	def __init__(self, emitter, name: str, key, func: callable):
+		self.emitter = emitter
+		self.name = name
+		self.key = key
+		self.func = func
+		self.order = next(_order)
+	def remove(self):
+		self.emitter.removeEventHandler(self)
+	def __enter__(self):
+		return self
+	def __exit__(self, *exc):
+		self.remove()
 
 class EventEmitter:
-	__slots__ = '__handlers'
+	"""Calls registered handlers when an event is emitted.
+
+	Handlers can be registered for an event name (wildcard) or for an event name plus a key.
+	`emitKeyedEvent` only calls the handlers of the given key and the wildcard handlers,
+	in the order they were registered. A handler returning True stops the propagation.
+
+	`instrument` wraps every handler, e.g. for timing them (see pyrclib.metrics);
+	without it, dispatch calls the handlers directly."""
+	__slots__ = '__handlers', '__dispatch', '__wrap'
 	def __init__(self):
 		super().__init__()
-		self.__handlers = {}
-	def addEventHandler(self, name: str, func: callable):
-		if name not in self.__handlers:
-			self.__handlers[name] = []
-		self.__handlers[name].append(func)
+		self.__handlers = {} # (name, key) -> list of Subscriptions; key None means wildcard
+		self.__dispatch = {} # (name, key) -> tuple of handler functions, built on demand
+		self.__wrap = None
+	def instrument(self, wrap: callable = None):
+		"""Dispatch to wrap(name, key, func) instead of each handler func; None removes the wrapping.
+
+		Return the previous wrap, so wrappers can be chained."""
+		previous, self.__wrap = self.__wrap, wrap
+		self.__dispatch.clear()
+		return previous
+	def _eventKey(self, key):
+		"""Normalize a key given to addEventHandler. Overwrite to make different spellings of a key equal."""
+		return key
+	def addEventHandler(self, name: str, func: callable, key = None) -> Subscription:
+		if key is not None:
+			key = self._eventKey(key)
+		sub = Subscription(self, name, key, func)
+		self.__handlers.setdefault((name, key), []).append(sub)
+		self.__invalidate(name, key)
+		return sub
+	def removeEventHandler(self, nameOrSubscription, func: callable = None, key = None):
+		"""Remove a handler, given either its Subscription or the arguments it was added with.
+
+		Raise ValueError if there is no such handler."""
+		if isinstance(nameOrSubscription, Subscription):
+			sub = nameOrSubscription
+			name, key = sub.name, sub.key
+		else:
+			name, sub = nameOrSubscription, None
+			if key is not None:
+				key = self._eventKey(key)
+		subs = self.__handlers.get((name, key), ())
+		for i, s in enumerate(subs):
+			if s is sub or (sub is None and s.func == func):
+				del subs[i]
+				break
+		else:
+			raise ValueError('No such event handler.')
+		if not subs:
+			del self.__handlers[name, key]
+		self.__invalidate(name, key)
+	def __invalidate(self, name: str, key):
+		dispatch = self.__dispatch
+		if key is not None:
+			dispatch.pop((name, key), None)
+		else: # wildcard handlers are part of every key's handler list
+			for nameKey in [nameKey for nameKey in dispatch if nameKey[0] == name]:
+				del dispatch[nameKey]
+	def __handlersFor(self, name: str, key) -> tuple:
+		handlers = self.__handlers
+		subs = handlers.get((name, None), [])
+		if key is not None and (name, key) in handlers:
+			subs = sorted(subs + handlers[name, key], key = lambda sub: sub.order)
+		wrap = self.__wrap
+		if wrap is None:
+			funcs = tuple(sub.func for sub in subs)
+		else:
+			funcs = tuple(wrap(name, sub.key, sub.func) for sub in subs)
+		self.__dispatch[name, key] = funcs
+		return funcs
 	def emitEvent(self, name: str, *args, **kwargs):
-		if name not in self.__handlers:
-			return
-		for handler in self.__handlers[name]:
+		"""Call the wildcard handlers of an event."""
+		self.emitKeyedEvent(name, None, *args, **kwargs)
+	def emitKeyedEvent(self, name: str, key, *args, **kwargs):
+		"""Call the handlers registered for key and the wildcard handlers of an event."""
+		try:
+			funcs = self.__dispatch[name, key]
+		except KeyError:
+			funcs = self.__handlersFor(name, key)
+		for handler in funcs:
 			if handler(*args, **kwargs) is True:
 				break
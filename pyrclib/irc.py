@@ -1,130 +1,433 @@
-from time import sleep
+import socket
+import threading
+from collections import deque
 from time import time as now
 from .connection import SocketConnection
+from .sendqueue import SendQueue, FloodControl, priorityOf, commandPriorities, PRIORITY_NORMAL
 from .events import EventEmitter
 from .timer import TimerManager
 from .channel import Channel
+from .isupport import ISupport
 from .message import MessageBase as Message
-from .log import logException
+from .decoding import Decoder
+from . import numerics
+from .log import logException, logWarning
 
 ## irc rfc: https://tools.ietf.org/html/rfc1459
 
 class IRCConnectionError(Exception): pass
 
+def deliverMessages(delegate, msgsData, connection = None) -> int:
+	"""Parse raw lines into messages and pass them to the delegate.
+
+	Stop when the delegate pauses reading from `connection`; return the number of lines handled.
+	Messages are of the delegate's `messageClass` (decoding with its decoder), if it has one."""
+	messageClass = getattr(delegate, 'messageClass', Message)
+	for i, msgData in enumerate(msgsData):
+		if connection is not None and connection.readingPaused:
+			return i
+		try:
+			msg = messageClass(msgData)
+		except Exception as e:
+			logException(e)
+		else:
+			delegate.receivedMessage(msg)
+	return len(msgsData)
+
+def splitText(text: str, maxBytes: int) -> list:
+	"""Split text into lines of at most maxBytes UTF-8 encoded bytes.
+
+	Line breaks (CR, LF or CR LF) start a new line. Longer lines are broken at the last space that fits
+	(which is dropped), or between two characters if there is none. Empty lines are left out,
+	since servers reject empty messages."""
+	if maxBytes < 4:
+		raise ValueError('maxBytes must be at least 4 to fit any character.')
+	if len(text) <= maxBytes // 4 and '\n' not in text and '\r' not in text: # the usual case: a short line
+		return [text] if text else []
+	lines = []
+	for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'): # not splitlines: it splits at IRC's italics code too
+		data = line.encode('utf-8')
+		while len(data) > maxBytes:
+			cut = maxBytes
+			while data[cut] & 0xc0 == 0x80: # don't cut into a character
+				cut -= 1
+			space = data.rfind(b' ', 0, cut + 1)
+			if space > 0:
+				chunk, data = data[:space], data[space + 1:]
+			else:
+				chunk, data = data[:cut], data[cut:]
+			lines.append(chunk.decode('utf-8'))
+		if data:
+			lines.append(data.decode('utf-8'))
+	return lines
+
+def packTargets(command: str, targets: list, keys: list = (), trailing: str = None, maxTargets: int = None, maxBytes: int = 510) -> list:
+	"""Build as few `command target,target,... [key,key,...] [:trailing]` messages as possible.
+
+	Each has at most maxTargets targets (None for no limit) and maxBytes bytes (without CR LF);
+	a target too long to share a message gets one of its own. keys belong to the first targets."""
+	fixed = len(command.encode('utf-8')) + 1 + (len(trailing.encode('utf-8')) + 2 if trailing is not None else 0)
+	msgs = []
+	names, lineKeys, size = [], [], fixed
+	def flush():
+		params = [','.join(names)]
+		if lineKeys:
+			params.append(','.join(lineKeys))
+		if trailing is not None:
+			params.append(trailing)
+		msgs.append(Message.make(command, *params, trailing = trailing is not None))
+	for i, target in enumerate(targets):
+		key = keys[i] if i < len(keys) else None
+		added = len(target.encode('utf-8')) + (1 + len(key.encode('utf-8')) if key is not None else 0)
+		if names and (size + 1 + added > maxBytes or (maxTargets is not None and len(names) >= maxTargets)):
+			flush()
+			names, lineKeys, size = [], [], fixed
+		size += added + (1 if names else 0)
+		names.append(target)
+		if key is not None:
+			lineKeys.append(key)
+	if names:
+		flush()
+	return msgs
+
 class IRCConnection(SocketConnection):
+	"""Outgoing messages go through a SendQueue using the delegate's `floodControl`.
+
+	Lines received while reading is paused are held back until it resumes."""
 	EOL = b'\r\n'
-	def __init__(self, host: str, port: int, delegate, useSsl: bool):
-		super().__init__(host, port, useSsl)
+	def __init__(self, host: str, port: int, delegate, useSsl: bool, sock = None):
+		super().__init__(host, port, useSsl, sock, getattr(delegate, 'sslContext', None))
 		self.delegate = delegate
-	def send(self, msgString: str):
+		self.sendQueue = SendQueue(getattr(delegate, 'floodControl', None))
+		self.linesIn = 0
+		self.__held = [] # received lines not delivered because reading was paused
+	def send(self, msgString: str, priority: int = None):
+		if not self.isConnected():
+			return False
 		msgData = msgString.encode('utf-8')
 		if msgData:
-			msgData += self.EOL
-		return super().send(msgData)
-	def tick(self):
+			self.sendQueue.put(msgData + self.EOL, priorityOf(msgString) if priority is None else priority)
+		return True
+	def sendMany(self, msgStrings: list, priority: int):
+		"""Queue several lines of one priority class at once."""
+		if not self.isConnected():
+			return False
+		EOL = self.EOL
+		self.sendQueue.putMany([msgString.encode('utf-8') + EOL for msgString in msgStrings if msgString], priority)
+		return True
+	def tick(self, timeout: float = 5, wakeSocket: socket.socket = None):
 		if not self.isConnected():
 			raise IRCConnectionError('Connection closed by remote.')
-		super().tick()
-		# parse received data into messages
-		buf = self.peek()
-		msgsLen = buf.rfind(self.EOL)
-		if msgsLen >= 0:
-			self.discard(msgsLen + len(self.EOL))
-			msgs = buf[:msgsLen].split(self.EOL)
-			# send messages to delegate
-			for msgData in msgs:
-				try:
-					msg = Message(msgData)
-				except Exception as e:
-					logException(e)
-				else:
-					self.delegate.receivedMessage(msg)
+		# move sendable messages into the socket buffer in one go
+		batch = self.sendQueue.pop()
+		if batch:
+			super().send(b''.join(batch))
+		delay = self.sendQueue.nextSendDelay()
+		if delay is not None and delay < timeout:
+			timeout = delay
+		if self.__held and not self.readingPaused:
+			timeout = 0
+		super().tick(timeout, wakeSocket)
+		# parse received data into messages & send them to delegate
+		msgsData = self.readLines(self.EOL)
+		self.linesIn += len(msgsData)
+		if self.__held:
+			msgsData = self.__held + msgsData
+		delivered = deliverMessages(self.delegate, msgsData, self)
+		self.__held = msgsData[delivered:]
 
 class IRCBase(EventEmitter, TimerManager):
 	"""Implements the very basic IRC functionality.
 	You should not instantiate this class directly. Use the IRC class instead.
 
-	If you sub-class IRCBase and overwrite `tick` be sure to call TimerManager.tick
-	or IRCBase.tick (which is the same), otherwise the timers won't work!
+	If you sub-class IRCBase and overwrite `tick` be sure to call IRCBase.tick,
+	otherwise the timers and the calls posted by `callSoonThreadsafe` won't run!
+
+	Overwrite `_connectionClass` to use a different transport (see pyrclib.aio).
+
+	'recv' handlers can be registered for a single command, e.g.
+	`irc.addEventHandler('recv', handler, 'PRIVMSG')`; numerics may be given by number or name.
+	Every queued message emits 'send' (irc, msg), including each message of a batch queued with
+	`sendMessages` (and msgSplit, msgMany, ...).
 	"""
+	_connectionClass = IRCConnection
+	hostLength = 63 # assumed length of our host name while `hostmask` is unknown
+	pollInterval = 1 # run will call tick at least every X seconds
 	def __init__(self, nick: str, user: str, real: str):
 		super().__init__()
-		self.__ircConnection = None
+		self._ircConnection = None
+		self.floodControl = FloodControl() # set to None to disable flood control
+		self.sslContext = None # for TLS connections, None for pyrclib.tls.defaultContext()
+		self.hostmask = None # our nick!user@host as the server relays it, kept up to date by a StateTracker
+		self.decoder = Decoder() # remembers the encodings of this network's nicks and channels
+		self.messageClass = type('Message', (Message,), {'__slots__': (), 'decoder': self.decoder}) # received messages
+		self.__channels = {} # lower case channel name -> Channel
 		self.__nick = nick
 		self.__user = user
 		self.__real = real
+		self.__readingPaused = False
+		self.__posted = deque() # (func, args) posted by other threads
+		self.__wakeLock = threading.Lock()
+		self.__wakeSockets = None # (reader, writer) socket pair interrupting the wait in `run`, created on demand
 		self.isRunning = False
+	def _eventKey(self, key: str) -> str:
+		return numerics.canonical(key)
 	# IRCConnection delegate
 	def receivedMessage(self, msg: Message):
-		self.emitEvent('recv', self, msg)
-	def sendRaw(self, msgString: str):
-		self.emitEvent('send', self, Message(msgString))
-		self.__ircConnection.send(msgString)
-	def connect(self, host: str, port: int, useSsl: bool):
-		self.__ircConnection = IRCConnection(host, port, self, useSsl)
+		self.emitKeyedEvent('recv', msg.command, self, msg)
+	def sendMessage(self, msg: Message, priority: int = None):
+		"""Queue a message. Priority defaults to a class depending on the command (see pyrclib.sendqueue)."""
+		self.emitEvent('send', self, msg)
+		if priority is None:
+			priority = commandPriorities.get(msg.command.upper(), PRIORITY_NORMAL)
+		self._ircConnection.send(msg.raw, priority)
+	def sendRaw(self, msgString: str, priority: int = None):
+		self.sendMessage(Message(msgString), priority)
+	def sendMessages(self, msgs: list, priority: int = None):
+		"""Queue several messages, emitting a 'send' event each; they are handed to the queue in one go.
+
+		Without a priority, messages are queued per priority class (in order within each class)."""
+		if not msgs:
+			return
+		for msg in msgs:
+			self.emitEvent('send', self, msg)
+		con = self._ircConnection
+		if priority is not None:
+			con.sendMany([msg.raw for msg in msgs], priority)
+			return
+		byPriority = {}
+		for msg in msgs:
+			byPriority.setdefault(commandPriorities.get(msg.command.upper(), PRIORITY_NORMAL), []).append(msg.raw)
+		for priority, msgStrings in sorted(byPriority.items()):
+			con.sendMany(msgStrings, priority)
+	def sendRawMany(self, msgStrings: list, priority: int = None):
+		"""Queue several raw lines at once (see sendMessages)."""
+		self.sendMessages([Message(msgString) for msgString in msgStrings], priority)
+	def prefixLength(self) -> int:
+		"""Return the length of the prefix (`:nick!user@host `) the server puts before our messages when relaying them."""
+		hostmask = self.hostmask
+		if hostmask is None: # assume the longest host and an ident-less user
+			hostmask = '%s!~%s@%s' % (self.__nick, self.__user, 'x' * self.hostLength)
+		return len(hostmask.encode('utf-8')) + 2
+	@property
+	def sendQueue(self) -> SendQueue:
+		"""The outbound queue of the current connection; see SendQueue.stats for depth and wait times."""
+		return self._ircConnection.sendQueue if self._ircConnection is not None else None
+	def connect(self, host: str, port: int, useSsl: bool, sock = None):
+		"""Connect and register. sock: an already connected socket to use (see pyrclib.servers.connectAny)"""
+		if self.floodControl is not None:
+			self.floodControl.reset()
+		self._ircConnection = self._connectionClass(host, port, self, useSsl, sock)
+		if self.__readingPaused:
+			self._ircConnection.pauseReading()
 		self.nick()
-		self.sendRaw('USER %s * * :%s' % (self.__user, self.__real))
+		self.sendMessage(Message.make('USER', self.__user, '*', '*', self.__real, trailing = True))
+	def pauseReading(self):
+		"""Stop reading from the connection (backpressure, see pyrclib.offload); sending and timers go on."""
+		self.__readingPaused = True
+		if self._ircConnection is not None:
+			self._ircConnection.pauseReading()
+	def resumeReading(self):
+		self.__readingPaused = False
+		if self._ircConnection is not None:
+			self._ircConnection.resumeReading()
+	@property
+	def readingPaused(self) -> bool:
+		return self.__readingPaused
+	# other threads
+	def callSoonThreadsafe(self, func: callable, *args):
+		"""Call func(*args) on the thread running this instance, as soon as possible. May be called from any thread."""
+		self.__posted.append((func, args))
+		self._wakeUp()
+	def _wakeUp(self):
+		"""Interrupt the wait for socket events in `run`."""
+		with self.__wakeLock:
+			if self.__wakeSockets is None:
+				self.__wakeSockets = socket.socketpair()
+				for sock in self.__wakeSockets:
+					sock.setblocking(False)
+		try:
+			self.__wakeSockets[1].send(b'\0')
+		except BlockingIOError: # enough wake-ups pending
+			pass
+	def _runPosted(self):
+		posted = self.__posted
+		while posted:
+			func, args = posted.popleft()
+			func(*args)
 	# IRC commands
 	def msg(self, receiver: str, text: str):
-		self.sendRaw('PRIVMSG %s :%s' % (receiver, text))
+		self.sendMessage(Message.make('PRIVMSG', receiver, text, trailing = True))
 	def ping(self):
-		self.sendRaw('PING %i' % now())
+		self.sendMessage(Message.make('PING', '%i' % now()))
+	def notice(self, receiver: str, text: str):
+		self.sendMessage(Message.make('NOTICE', receiver, text, trailing = True))
 	def join(self, channel: str, key: str = None) -> Channel:
-		key = ' ' + key if key else ''
-		self.sendRaw('JOIN ' + channel + key)
-		return Channel(self, channel)
+		self.sendMessage(Message.make('JOIN', channel, key) if key else Message.make('JOIN', channel))
+		return self._channel(channel)
+	def part(self, channel: str, message: str = None):
+		self.sendMessage(Message.make('PART', channel, message, trailing = True) if message else Message.make('PART', channel))
+		self._forgetChannel(channel)
+	def _forgetChannel(self, channel: str):
+		chan = self.__channels.pop(channel.lower(), None)
+		if chan is not None:
+			chan.dispose()
+	def _channel(self, channel: str) -> Channel:
+		"""Return the Channel of a channel we are joining."""
+		chan = self.__channels.get(channel.lower())
+		if chan is None:
+			chan = self.__channels[channel.lower()] = Channel(self, channel)
+		else:
+			chan.rejoin()
+		return chan
 	def nick(self, nick: str = None):
 		if nick is None:
 			nick = self.__nick
 		else:
 			self.__nick = nick
-		self.sendRaw('NICK ' + nick)
+		self.sendMessage(Message.make('NICK', nick))
 	def quit(self, message: str = None):
 		if message is not None:
-			self.sendRaw('QUIT :' + message)
+			self.sendMessage(Message.make('QUIT', message, trailing = True))
 		else:
-			self.sendRaw('QUIT')
+			self.sendMessage(Message.make('QUIT'))
 		def kill():
 			self.isRunning = False
-			self.__ircConnection.disconnect()
+			self._ircConnection.disconnect()
 		self.callIn(500, kill)
 	#
+	def tick(self):
+		if self.__posted:
+			self._runPosted()
+		super().tick() # TimerManager.tick
+	def _pollTimeout(self) -> float:
+		"""Return the max seconds to wait for socket events before calling `tick` again."""
+		if self.__posted:
+			return 0
+		timeout = self.pollInterval
+		deadline = self.nextDeadline()
+		if deadline is not None:
+			timeout = max(0, min(timeout, (deadline - self._now()) / 1000))
+		return timeout
 	def run(self):
 		self.isRunning = True
-		con = self.__ircConnection
+		con = self._ircConnection
 		while self.isRunning:
 			self.tick()
-			con.tick()
-			sleep(0.125)
+			wakeSockets = self.__wakeSockets
+			con.tick(self._pollTimeout(), wakeSockets[0] if wakeSockets is not None else None) # sleeps until data arrives, the next timer is due or a call is posted
 
 class IRC(IRCBase):
 	"""IRC is the main pyrclib class. It adds some essential automation to the IRCBase class."""
 	def __init__(self, nick: str, user: str, real: str):
 		super().__init__(nick, user, real)
-		self.addEventHandler('recv', IRC.__pingHandler)
+		self.isupport = ISupport() # what the server announced in RPL_ISUPPORT
+		self.addEventHandler('recv', IRC.__pingHandler, 'PING')
+		self.addEventHandler('recv', IRC.__isupportHandler, 'RPL_ISUPPORT')
 		self.__dataReceivedTime = 0 # timestamp of the last time we received some data
 		self.__pingSentTime = 0 # timestamp of the last time a ping was sent
 	# 'built-in'/default handlers
 	@staticmethod
 	def __pingHandler(irc, msg: Message):
-		if msg.command == 'PING':
-			irc.sendRaw(msg.raw.replace('PING', 'PONG'))
-			# return True
+		irc.sendMessage(Message.make('PONG', *msg.params))
+		# return True
+	@staticmethod
+	def __isupportHandler(irc, msg: Message):
+		irc.isupport.update(msg.params[1:-1]) # between our nick and the trailing 'are supported by this server'
 	# IRCConnection delegate
 	def receivedMessage(self, msg: Message):
 		super().receivedMessage(msg)
 		self.__dataReceivedTime = now()
-	def connect(self, host: str, port: int, useSsl: bool):
-		super().connect(host, port, useSsl)
+	def connect(self, host: str, port: int, useSsl: bool, sock = None):
+		self.isupport = ISupport()
+		super().connect(host, port, useSsl, sock)
 		self.__dataReceivedTime = now()
 	# IRC commands
 	def ping(self):
 		super().ping()
 		self.__pingSentTime = now()
+	def joinMany(self, channels: list) -> list:
+		"""Join channels (names or (name, key) pairs) with as few JOIN messages as ISUPPORT allows.
+
+		Keyed channels go first, since keys belong to the first channels of a JOIN.
+		Channels beyond CHANLIMIT are left out with a warning. Return the Channels joined."""
+		isupport = self.isupport
+		keyed, unkeyed, skipped = [], [], []
+		counts = {} # CHANLIMIT channel types -> number of channels
+		for channel in channels:
+			name, key = (channel, None) if isinstance(channel, str) else (tuple(channel) + (None,))[:2]
+			for types, limit in isupport.chanLimit.items():
+				if name[:1] in types:
+					if limit is not None and counts.get(types, 0) >= limit:
+						skipped.append(name)
+						name = None
+					else:
+						counts[types] = counts.get(types, 0) + 1
+					break
+			if name is None:
+				continue
+			if key:
+				keyed.append((name, key))
+			else:
+				unkeyed.append(name)
+		if skipped:
+			logWarning('Channel limit reached, not joining %s.' % ', '.join(skipped))
+		names = [name for name, key in keyed] + unkeyed
+		for msg in packTargets('JOIN', names, [key for name, key in keyed], None,
+				isupport.targetLimit('JOIN'), isupport.lineLength - 2):
+			self.sendMessage(msg)
+		return [self._channel(name) for name in names]
+	def partMany(self, channels: list, message: str = None):
+		"""Leave channels with as few PART messages as ISUPPORT allows."""
+		isupport = self.isupport
+		for msg in packTargets('PART', list(channels), (), message or None, isupport.targetLimit('PART'), isupport.lineLength - 2):
+			self.sendMessage(msg)
+		for channel in channels:
+			self._forgetChannel(channel)
+	def msgAll(self, receivers: list, text: str):
+		"""Send text to several receivers with as few PRIVMSG messages as ISUPPORT (TARGMAX, MAXTARGETS) allows."""
+		self.__sendAll('PRIVMSG', receivers, text)
+	def noticeAll(self, receivers: list, text: str):
+		self.__sendAll('NOTICE', receivers, text)
+	def __sendAll(self, command: str, receivers: list, text: str):
+		isupport = self.isupport
+		for msg in packTargets(command, list(receivers), (), text, isupport.targetLimit(command), isupport.lineLength - 2):
+			self.sendMessage(msg)
+	def __textBytes(self, command: str) -> int:
+		"""Return the bytes left for receiver and text in the `command receiver :text` lines relayed to recipients."""
+		return self.isupport.lineLength - 2 - self.prefixLength() - len(command) - 3
+	def splitMessage(self, command: str, receiver: str, text: str, textBytes: int = None) -> list:
+		"""Return the `command receiver :line` messages of a (long or multi-line) text, see splitText.
+
+		Lines are as long as they can be for recipients to get them untruncated: the line length
+		announced in ISUPPORT minus CR LF, our prefix (see prefixLength) and the command."""
+		if textBytes is None:
+			textBytes = self.__textBytes(command)
+		make = Message.make
+		return [make(command, receiver, line, trailing = True) for line in splitText(text, textBytes - len(receiver.encode('utf-8')))]
+	def msgSplit(self, receiver: str, text: str) -> int:
+		"""Send a long or multi-line text in as many PRIVMSGs as needed. Return their number."""
+		msgs = self.splitMessage('PRIVMSG', receiver, text)
+		self.sendMessages(msgs, commandPriorities['PRIVMSG'])
+		return len(msgs)
+	def noticeSplit(self, receiver: str, text: str) -> int:
+		msgs = self.splitMessage('NOTICE', receiver, text)
+		self.sendMessages(msgs, commandPriorities['NOTICE'])
+		return len(msgs)
+	def msgMany(self, messages) -> int:
+		"""Send (receiver, text) pairs as PRIVMSGs in one batch, splitting texts like msgSplit. Return the number of lines."""
+		msgs = []
+		textBytes = self.__textBytes('PRIVMSG')
+		for receiver, text in messages:
+			msgs.extend(self.splitMessage('PRIVMSG', receiver, text, textBytes))
+		self.sendMessages(msgs, commandPriorities['PRIVMSG'])
+		return len(msgs)
 	#
 	def tick(self):
-		super().tick() # will call IRCBase.tick which is TimerManager.tick
-		# check if the connection is still alive
+		super().tick() # IRCBase.tick
+		self._checkAlive()
+	def _checkAlive(self):
+		"""Ping the server when it's been quiet for a while; raise IRCConnectionError if it stays quiet."""
 		_now = now()
 		lastReceivedDelta = _now - self.__dataReceivedTime
 		if lastReceivedDelta >= 20:
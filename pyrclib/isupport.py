@@ -0,0 +1,125 @@
+"""Parsing of the RPL_ISUPPORT (005) tokens servers announce after registration.
+
+See https://modern.ircdocs.horse/#rplisupport-005
+"""
+
+# str.translate tables for the CASEMAPPING values
+_upper = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+caseMappings = {
+	'ascii': str.maketrans(_upper, _upper.lower()),
+	'rfc1459': str.maketrans(_upper + '[]\\~', _upper.lower() + '{}|^'),
+	'strict-rfc1459': str.maketrans(_upper + '[]\\', _upper.lower() + '{}|'),
+}
+
+def _unescape(value: str) -> str:
+	"""Replace \\xHH escapes in a token value."""
+	if '\\x' not in value:
+		return value
+	parts = value.split('\\x')
+	result = [parts[0]]
+	for part in parts[1:]:
+		try:
+			result.append(chr(int(part[:2], 16)) + part[2:])
+		except ValueError:
+			result.append('\\x' + part)
+	return ''.join(result)
+
+def _limit(value: str):
+	"""Parse a limit; empty or invalid values mean no limit (None)."""
+	try:
+		return int(value)
+	except ValueError:
+		return None
+
+def _limits(value: str) -> dict:
+	"""Parse a comma separated list of name:limit pairs, like TARGMAX or CHANLIMIT values."""
+	limits = {}
+	for pair in value.split(','):
+		name, sep, limit = pair.partition(':')
+		if name:
+			limits[name] = _limit(limit)
+	return limits
+
+class ISupport:
+	"""The tokens of the current connection, with defaults for servers that don't send them."""
+	def __init__(self):
+		self.tokens = {} # name -> value ('' for tokens without value)
+		self.prefixModes = 'ov' # channel modes giving a membership prefix, highest first
+		self.prefixSymbols = '@+'
+		self.chanModes = ('b', 'k', 'l', 'imnpst') # list modes, modes with a parameter, modes with a parameter when set, flags
+		self.chanTypes = '#&'
+		self.caseMapping = 'rfc1459'
+		self.__table = caseMappings['rfc1459']
+		self.targMax = {} # command -> max number of targets, None for no limit
+		self.maxTargets = None # MAXTARGETS: max number of PRIVMSG/NOTICE targets if TARGMAX doesn't tell
+		self.chanLimit = {} # channel type(s) -> max number of channels of these types we may be in, None for no limit
+		self.lineLength = 512 # max length of a line in bytes, including CR LF
+	def update(self, params: list):
+		"""Apply the parameters of a 005 message (without our nick and the trailing text)."""
+		for token in params:
+			if token.startswith('-'):
+				name = token[1:].upper()
+				self.tokens.pop(name, None)
+				if name == 'TARGMAX':
+					self.targMax = {}
+				elif name == 'MAXTARGETS':
+					self.maxTargets = None
+				elif name in ('CHANLIMIT', 'MAXCHANNELS'):
+					self.chanLimit = {}
+				elif name == 'LINELEN':
+					self.lineLength = 512
+				continue
+			name, sep, value = token.partition('=')
+			name = name.upper()
+			value = _unescape(value)
+			self.tokens[name] = value
+			if name == 'PREFIX':
+				modes, sep, symbols = value[1:].partition(')')
+				if value.startswith('(') and len(modes) == len(symbols):
+					self.prefixModes, self.prefixSymbols = modes, symbols
+			elif name == 'CHANMODES':
+				groups = value.split(',')
+				if len(groups) >= 4:
+					self.chanModes = tuple(groups[:4])
+			elif name == 'CHANTYPES':
+				self.chanTypes = value
+			elif name == 'CASEMAPPING' and value.lower() in caseMappings:
+				self.caseMapping = value.lower()
+				self.__table = caseMappings[self.caseMapping]
+			elif name == 'TARGMAX':
+				self.targMax = {command.upper(): limit for command, limit in _limits(value).items()}
+			elif name == 'MAXTARGETS':
+				self.maxTargets = _limit(value)
+			elif name == 'CHANLIMIT':
+				self.chanLimit = _limits(value)
+			elif name == 'MAXCHANNELS' and 'CHANLIMIT' not in self.tokens: # pre-CHANLIMIT servers
+				self.chanLimit = {self.chanTypes: _limit(value)}
+			elif name == 'LINELEN':
+				self.lineLength = _limit(value) or 512
+	def lower(self, s: str) -> str:
+		"""Fold a nick or channel name according to CASEMAPPING."""
+		return s.translate(self.__table)
+	def targetLimit(self, command: str):
+		"""Return the max number of targets of a command, None for no limit.
+
+		PRIVMSG and NOTICE default to a single target when the server announces no limit."""
+		command = command.upper()
+		if command in self.targMax:
+			return self.targMax[command]
+		if command in ('PRIVMSG', 'NOTICE'):
+			return self.maxTargets if self.maxTargets is not None else 1
+		return None
+	def channelLimit(self, channel: str):
+		"""Return the max number of channels of the type of channel we may be in, None for no limit."""
+		for types, limit in self.chanLimit.items():
+			if channel[:1] in types:
+				return limit
+		return None
+	def isChannel(self, s: str) -> bool:
+		return bool(s) and s[0] in self.chanTypes
+	def modeTakesParam(self, mode: str, adding: bool) -> bool:
+		"""Whether a channel mode change has a parameter."""
+		if mode in self.prefixModes:
+			return True
+		listModes, paramModes, setParamModes, flags = self.chanModes
+		return mode in listModes or mode in paramModes or (adding and mode in setParamModes)
@@ -4,6 +4,7 @@ from time import time as now
 __out = sys.stdout
 
 def setOutput(out):
+	global __out
 	__out = out
 
 def getOutput():
@@ -15,12 +16,12 @@ def logString(s):
 
 def logException(e):
 	"""Log an exception."""
-	logString('%s: %s' % (e.__class__.__name__, e.message))
+	logString('%s: %s' % (e.__class__.__name__, e))
 
 def logError(s):
 	"""Log a string as error."""
-	logString('Error: %s' % e.message)
+	logString('Error: %s' % s)
 
 def logWarning(s):
 	"""Log a string as warning."""
-	logString('Warning: %s' % e.message)
+	logString('Warning: %s' % s)
@@ -1,47 +1,90 @@
 import time
+from .writer import FileWriter
 
 # Basic Loggers
 
 class Logger:
-	"""A buffered logger"""
-	def __init__(self, pathOrWritable, maxBufferLines: int = 2**10):
+	"""A buffered logger
+
+	Lines are buffered encoded (UTF-8, each followed by a line feed) in a single bytearray,
+	which is flushed when it holds more than `maxBufferLines` lines or `maxBufferBytes` bytes.
+	Flushed data is handed to a writer (see pyrclib.writer), which keeps output files open.
+	Use a BackgroundWriter to keep disk I/O off the IRC thread."""
+	def __init__(self, pathOrWritable, maxBufferLines: int = 2**10, writer: FileWriter = None, maxBufferBytes: int = 2**16):
 		"""
 		pathOrWritable: path to a file to append to or a writable file-like object (like sys.stdout)
 		maxBufferLines: number of lines the buffer can hold before automatically flushing, set to 0 for immediate flushing
+		writer: writer to hand flushed lines to, defaults to a synchronous FileWriter
+		maxBufferBytes: number of bytes the buffer can hold before automatically flushing
 		"""
 		super().__init__()
 		self._out = pathOrWritable
 		self._isWritable = hasattr(pathOrWritable, 'write')
-		self._buf = []
+		self._buf = bytearray()
+		self._bufLines = 0
 		self._maxBufferLines = maxBufferLines
+		self._maxBufferBytes = maxBufferBytes
+		self._writer = writer if writer is not None else FileWriter()
+	@property
+	def writer(self) -> FileWriter:
+		return self._writer
+	@property
+	def bufferedLines(self) -> int:
+		return self._bufLines
+	@property
+	def bufferedBytes(self) -> int:
+		return len(self._buf)
+	def _takeBuffer(self) -> bytearray:
+		"""Return the buffered data and start a new buffer."""
+		data, self._buf, self._bufLines = self._buf, bytearray(), 0
+		return data
 	def flush(self):
-		fo = self._out if self._isWritable else open(self._out, 'a')
-		try:
-			for line in self._buf:
-				fo.write(line + '\n')
-			self._buf = []
-		finally:
-			# if we opened it, we have to close it.
-			if not self._isWritable:
-				fo.close()
-	def log(self, s: str):
-		"""log a string"""
-		self._buf.append(s)
-		# automatically flush every X lines
-		if len(self._buf) > self._maxBufferLines:
+		if not self._buf:
+			return
+		data = self._takeBuffer()
+		if self._isWritable:
+			self._writer.write(self._out, [data.decode('utf-8', 'replace')])
+		else:
+			self._writer.write(self._out, [data]) # files are written in binary mode, so bytes lines go to disk untouched
+	def close(self):
+		"""Flush and let the writer close the output file."""
+		self.flush()
+		if not self._isWritable and self._out is not None:
+			self._writer.close(self._out)
+	def _checkTarget(self):
+		"""Called before a line is logged. Overwrite to switch the output (e.g. when the date changes)."""
+	def log(self, s: 'str or bytes'):
+		"""log a string (bytes are written to files as they are)"""
+		self._checkTarget()
+		buf = self._buf
+		buf += s if isinstance(s, bytes) else s.encode('utf-8')
+		buf += b'\n'
+		self._bufLines += 1
+		# automatically flush every X lines or bytes
+		if self._bufLines > self._maxBufferLines or len(buf) > self._maxBufferBytes:
 			self.flush()
 
 class AutoNamedLogger(Logger):
-	"""A logger that logs to file, automatically named using the supplied basename and current date."""
-	def __init__(self, basename, maxBufferLines = None):
-		if maxBufferLines is None:
-			super().__init__(None)
-		else:
-			super().__init__(None, maxBufferLines)
+	"""A logger that logs to file, automatically named using the supplied basename and current date.
+
+	The file changes exactly at midnight (local time): lines logged before are written to the old file."""
+	def __init__(self, basename, maxBufferLines = None, writer: FileWriter = None, maxBufferBytes = None):
+		limits = {}
+		if maxBufferLines is not None:
+			limits['maxBufferLines'] = maxBufferLines
+		if maxBufferBytes is not None:
+			limits['maxBufferBytes'] = maxBufferBytes
+		super().__init__(None, writer = writer, **limits)
 		self.basename = basename
-	def flush(self):
-		self._out = '%s-%s.txt' % (self.basename, time.strftime('%Y-%m-%d'))
-		super().flush()
+		self._rotateAt = 0 # unix time at which the current file name becomes invalid
+	def _checkTarget(self):
+		if time.time() >= self._rotateAt:
+			self._rotate()
+	def _rotate(self):
+		self.close() # lines of the old day go to the old file
+		now = time.localtime()
+		self._out = '%s-%s.txt' % (self.basename, time.strftime('%Y-%m-%d', now))
+		self._rotateAt = time.mktime((now.tm_year, now.tm_mon, now.tm_mday + 1, 0, 0, 0, 0, 0, -1))
 
 # IRC Loggers
 
@@ -60,67 +103,125 @@ class AutoFlushIRCLoggerMixin(IRCLoggerBase):
 	You shouldn't instantiate this class directly. Use it together with another IRCLogger derived class as sub-class.
 	When used with another class as sub-class, put this one first.
 
+	The flush timer runs on the IRC instance the logger receives messages from, so loggers of
+	different networks sharing one process don't depend on each other. It moves to the new
+	IRC instance when its client reconnects.
+
 	Overwrite `flushTime` in your class to change the default flush time period."""
-	_loggers = set()
 	flushTime = 60 # this logger will automatically flush every X seconds
-	@staticmethod
-	def autoFlush(irc):
-		cls = AutoFlushIRCLoggerMixin
-		for logger in cls._loggers:
-			logger.flush()
-		irc.callIn(cls.flushTime * 1000, cls.autoFlush, irc)
+	_flushTimer = None # repeating timer on _flushTimerIrc
+	_flushTimerIrc = None # the IRC instance the logger last logged from
 	def log(self, irc, msg):
-		# add to auto-flush list and check if we need to start the auto-flush callback loop
-		isFirstLogger = not bool(self._loggers)
-		self._loggers.add(self)
-		if isFirstLogger:
-			self.autoFlush(irc)
+		# check if we need to (re)start the auto-flush timer
+		if irc is not self._flushTimerIrc:
+			if self._flushTimer is not None:
+				self._flushTimer.cancel()
+			self._flushTimer = irc.callEvery(self.flushTime * 1000, self.flush)
+			self._flushTimerIrc = irc
 		super().log(irc, msg)
 
 class RawIRCLogger(IRCLoggerBase):
-	"""Log all IRC messages in their raw form with prepended unix timestamp."""
+	"""Log all IRC messages in their raw form with prepended unix timestamp.
+
+	Set `bytesThrough` to log received lines as the original bytes, without decoding them."""
+	bytesThrough = False
 	def log(self, irc, msg):
-		formattedMsg = '%.3f %s' % (time.time(), msg.raw)
+		if self.bytesThrough:
+			formattedMsg = b'%.3f %s' % (time.time(), msg.rawBytes)
+		else:
+			formattedMsg = '%.3f %s' % (time.time(), msg.raw)
 		super(IRCLoggerBase, self).log(formattedMsg) # skip IRCLoggerBase.log
 
+_controlChars = dict.fromkeys(range(32)) # str.translate table removing control characters
+
 class PrettyIRCLogger(IRCLoggerBase):
 	"""Log IRC messages in a prettified fashion.
 
-	Logs messages, join, part, and quit."""
+	Logs messages, notices, actions, join, part, quit, nick changes, kicks, mode and topic changes."""
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.__second = None # the second the cached timestamp prefix belongs to
+		self.__timestampPrefix = None
 	@staticmethod
 	def _clean(s: str) -> str:
 		"""Return a string without control characters."""
-		return ''.join(c for c in s if ord(c) >= 32)
+		return s.translate(_controlChars)
 	@staticmethod
 	def _unicodeEscaped(s: str) -> str:
+		if s.isascii() and s.isprintable() and '\\' not in s: # nothing to escape (DEL and other controls are)
+			return s
 		return s.encode('unicode-escape').decode('utf-8')
 	@staticmethod
 	def _parseSender(sender: str):
-		"""return the segments of a sender of format nick!user@host"""
-		nick, user = sender.split('!', 1)
-		user, host = user.split('@', 1)
+		"""return the segments of a sender of format nick!user@host (user and host are empty for servers)"""
+		nick, sep, user = sender.partition('!')
+		user, sep, host = user.partition('@')
 		return nick, user, host
-	def log(self, irc, msg):
-		formattedMsg = None
+	def _timestamp(self, timestamp: float) -> str:
+		"""Return the `[date time] ` prefix, formatting it only once per second."""
+		second = int(timestamp)
+		if second != self.__second:
+			self.__second = second
+			self.__timestampPrefix = time.strftime('[%Y-%m-%d %H:%M:%S] ', time.localtime(second))
+		return self.__timestampPrefix
+	# formatters: (nick, user, host, params) -> str or None
+	@staticmethod
+	def _formatPrivmsg(nick, user, host, params):
+		text = params[1]
+		if text.startswith('\x01ACTION ') or text == '\x01ACTION\x01':
+			return '* %s:%s %s' % (nick, params[0], text[8:].rstrip('\x01'))
+		return '<%s:%s> %s' % (nick, params[0], text)
+	@staticmethod
+	def _formatNotice(nick, user, host, params):
+		return '-%s:%s- %s' % (nick, params[0], params[1])
+	@staticmethod
+	def _formatJoin(nick, user, host, params):
+		return '%s (%s@%s) joined %s.' % (nick, user, host, params[0])
+	@staticmethod
+	def _formatPart(nick, user, host, params):
+		return '%s (%s@%s) left %s.' % (nick, user, host, params[0])
+	@staticmethod
+	def _formatQuit(nick, user, host, params):
+		return '%s (%s@%s) quit. (%s)' % (nick, user, host, params[0] if params else '')
+	@staticmethod
+	def _formatNick(nick, user, host, params):
+		return '%s (%s@%s) is now known as %s.' % (nick, user, host, params[0])
+	@staticmethod
+	def _formatKick(nick, user, host, params):
+		return '%s kicked %s from %s. (%s)' % (nick, params[1], params[0], params[2] if len(params) > 2 else '')
+	@staticmethod
+	def _formatMode(nick, user, host, params):
+		return '%s sets mode %s on %s.' % (nick, ' '.join(params[1:]), params[0])
+	@staticmethod
+	def _formatTopic(nick, user, host, params):
+		return '%s changed the topic of %s to: %s' % (nick, params[0], params[1])
+	formatters = {
+		'PRIVMSG': _formatPrivmsg,
+		'NOTICE': _formatNotice,
+		'JOIN': _formatJoin,
+		'PART': _formatPart,
+		'QUIT': _formatQuit,
+		'NICK': _formatNick,
+		'KICK': _formatKick,
+		'MODE': _formatMode,
+		'TOPIC': _formatTopic,
+	}
+	def format(self, msg, timestamp: float = None) -> str:
+		"""Return the prettified message (logged at timestamp, default now), or None if it isn't logged."""
+		formatter = self.formatters.get(msg.command)
+		if formatter is None:
+			return None
 		try: # message parsing should never throw
-			if msg.command == 'PRIVMSG':
-				nick, user, host = (self._clean(e) for e in self._parseSender(msg.prefix))
-				receiver = self._clean(msg.params[0])
-				text = self._clean(msg.params[1])
-				formattedMsg = '<%s:%s> %s' % (nick, receiver, text)
-			elif msg.command in ('JOIN', 'PART', 'QUIT'):
-				nick, user, host = (self._clean(e) for e in self._parseSender(msg.prefix))
-				channel = self._clean(msg.params[0])
-				if msg.command == 'JOIN':
-					formattedMsg = '%s (%s@%s) joined %s.' % (nick, user, host, channel)
-				elif msg.command == 'PART':
-					formattedMsg = '%s (%s@%s) left %s.' % (nick, user, host, channel)
-				elif msg.command == 'QUIT':
-					formattedMsg = '%s (%s@%s) quit. (%s)' % (nick, user, host, channel) # channel is the quit message
+			formattedMsg = formatter.__func__(*self._parseSender(msg.prefix), msg.params)
 		except Exception as err:
 			print(self._unicodeEscaped('Message parsing error. `{}`, {}'.format(msg.raw, err)))
-		if formattedMsg:
-			# add timestamp
-			timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-			formattedMsg = '[%s] %s' % (timestamp, formattedMsg)
-			super(IRCLoggerBase, self).log(self._unicodeEscaped(formattedMsg)) # skip IRCLoggerBase.log
+			return None
+		if timestamp is None:
+			timestamp = time.time()
+		return self._unicodeEscaped(self._timestamp(timestamp) + formattedMsg.translate(_controlChars))
+	def log(self, irc, msg):
+		if msg.command not in self.formatters:
+			return
+		formattedMsg = self.format(msg)
+		if formattedMsg is not None:
+			super(IRCLoggerBase, self).log(formattedMsg) # skip IRCLoggerBase.log
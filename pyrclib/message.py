@@ -1,36 +1,154 @@
-import datetime
+import sys
+from . import numerics
+from .decoding import defaultDecoder
 
-def _decode(s: bytes, codecs = ('utf-8', 'iso-8859-15', 'shift_jis', 'latin-1')):
-	"""Try a bunch of codecs to decode the given string.
+_commands = {} # interned command strings
+_maxCommands = 2**10 # don't let a misbehaving server grow the command cache forever
 
-	Raise UnicodeError if unsuccessful."""
-	for codec in codecs:
-		try:
-			return s.decode(codec)
-		except UnicodeError:
-			pass
-	raise UnicodeError('Could not decode message text.')
+def _internCommand(command: str) -> str:
+	try:
+		return _commands[command]
+	except KeyError:
+		if len(_commands) < _maxCommands:
+			command = _commands[command] = sys.intern(command)
+		return command
+
+_tagEscapes = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+def _unescapeTagValue(value: str) -> str:
+	if '\\' not in value:
+		return value
+	chars, it = [], iter(value)
+	for c in it:
+		if c == '\\':
+			c = next(it, '')
+			chars.append(_tagEscapes.get(c, c))
+		else:
+			chars.append(c)
+	return ''.join(chars)
+
+def _parseTags(tagString: str) -> dict:
+	tags = {}
+	for tag in tagString.split(';'):
+		if tag:
+			key, sep, value = tag.partition('=')
+			tags[key] = _unescapeTagValue(value)
+	return tags
 
 class MessageBase:
-	"""A basic RFC compliant IRC message parser."""
-	__slots__ = 'prefix', 'command', 'params', 'raw'
+	"""A basic RFC compliant IRC message parser, with support for IRCv3 message tags.
+
+	Parsing is lazy: a message keeps the line it was created from, `command` only looks at
+	the start of the line, and the line is decoded and split up when another field is accessed.
+	Received lines are decoded by `decoder` (see pyrclib.decoding).
+	"""
+	__slots__ = '_data', '_raw', '_tags', '_prefix', '_command', '_params'
+	decoder = defaultDecoder
 	def __init__(self, msgString: 'str or bytes' = None):
-		self.prefix = ''
-		self.command = ''
-		self.params = []
-		self.raw = ''
-		if msgString:
-			self.parse(msgString)
+		self.parse(msgString or '')
+	@classmethod
+	def make(cls, command: str, *params: str, trailing: bool = False) -> 'MessageBase':
+		"""Create an already parsed message from its parts.
+
+		The last param is sent as trailing param (with a leading ':') if needed or if `trailing` is set."""
+		parts = [command]
+		if params:
+			parts.extend(params[:-1])
+			last = params[-1]
+			if trailing or not last or ' ' in last or last.startswith(':'):
+				last = ':' + last
+			parts.append(last)
+		msg = cls.__new__(cls)
+		msg._data = msg._raw = ' '.join(parts)
+		msg._tags, msg._prefix, msg._command, msg._params = {}, '', _internCommand(command), list(params)
+		return msg
+	def __reduce__(self):
+		# the per network subclasses (see IRCBase.messageClass) can't be pickled; pickle the decoded line as a MessageBase
+		try:
+			data = self.raw
+		except UnicodeError:
+			data = self._data
+		return (MessageBase, (data,))
 	def __str__(self):
 		return self.raw
+	def __repr__(self):
+		return '%s(%r)' % (self.__class__.__name__, self._data)
 	def parse(self, msgString: 'str or bytes'):
-		"""Parse msgString into prefix, command, and params.
+		"""(Re)initialize the message with msgString. The actual parsing happens on first access."""
+		self._data = msgString
+		self._raw = self._tags = self._prefix = self._command = self._params = None
+	# fields
+	@property
+	def data(self) -> 'str or bytes':
+		"""The line as it was received, without decoding."""
+		return self._data
+	@property
+	def rawBytes(self) -> bytes:
+		"""The line as bytes: received lines as they were received, others utf-8 encoded."""
+		data = self._data
+		return data if isinstance(data, bytes) else data.encode('utf-8')
+	@property
+	def raw(self) -> str:
+		"""The decoded line.
 
-		Raise UnicodeError if msgString cannot be decoded.
+		Raise UnicodeError if the line cannot be decoded."""
+		if self._raw is None:
+			data = self._data
+			self._raw = self.decoder.decode(data) if isinstance(data, bytes) else data
+		return self._raw
+	@property
+	def command(self) -> str:
+		if self._command is None:
+			self._command = self.__parseCommand()
+		return self._command
+	@property
+	def name(self) -> str:
+		"""The command, with numerics translated to their names (e.g. 'ERR_NICKNAMEINUSE')."""
+		return numerics.names.get(self.command, self.command)
+	@property
+	def tags(self) -> dict:
+		if self._tags is None:
+			self.__parse()
+		return self._tags
+	@property
+	def prefix(self) -> str:
+		if self._prefix is None:
+			self.__parse()
+		return self._prefix
+	@property
+	def params(self) -> list:
+		if self._params is None:
+			self.__parse()
+		return self._params
+	# parsing
+	def __parseCommand(self) -> str:
+		"""Find the command without decoding or splitting the rest of the line."""
+		data = self._data
+		space = b' ' if isinstance(data, bytes) else ' '
+		start = 0
+		if data[:1] in (b'@', '@'): # skip tags
+			start = data.find(space) + 1 or len(data)
+		if data[start:start + 1] in (b':', ':'): # skip prefix
+			start = data.find(space, start) + 1 or len(data)
+		end = data.find(space, start)
+		command = data[start:] if end < 0 else data[start:end]
+		if isinstance(command, bytes):
+			command = command.decode('ascii', 'replace')
+		return _internCommand(command)
+	def __parse(self):
+		"""Parse the line into tags, prefix, command, and params.
+
+		Raise UnicodeError if the line cannot be decoded.
 		"""
-		if isinstance(msgString, bytes):
-			msgString = _decode(msgString)
-		prefix, command, params, raw = '', '', [], msgString
+		msgString = self.raw
+		tags, prefix, command, params = {}, '', '', []
+		# check for tags
+		if msgString.startswith('@'):
+			try:
+				tagString, msgString = msgString.split(' ', 1)
+			except ValueError:
+				tagString, msgString = msgString, ''
+			tags = _parseTags(tagString[1:])
 		# check for prefix
 		if msgString.startswith(':'):
 			try:
@@ -57,4 +175,6 @@ class MessageBase:
 			if trailing is not None:
 				params.append(trailing)
 		# done.
-		self.prefix, self.command, self.params, self.raw = prefix, command, params, raw
+		self._tags, self._prefix, self._params = tags, prefix, params
+		if self._command is None:
+			self._command = _internCommand(command)
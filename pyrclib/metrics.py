@@ -0,0 +1,244 @@
+"""Runtime metrics for clients, connections, handlers, timers and loggers.
+
+Nothing is measured unless a Metrics instance watches something. Connections always count
+their bytes and lines (one addition per read), everything else is read when a snapshot is taken,
+except for the handler and timer instrumentation installed by `watchIRC`.
+
+	metrics = Metrics()
+	metrics.watchClient(client, network = 'example')
+	metrics.watchLogger(logger, network = 'example', name = 'file')
+	metrics.serve(9100) # Prometheus text on http://127.0.0.1:9100/metrics, JSON on /metrics.json
+
+Handler metrics are summaries per event, key and handler: calls are the summary's count,
+the cumulative time its sum.
+"""
+
+import json
+import threading
+import time
+from inspect import unwrap
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COUNTER, GAUGE, SUMMARY = 'counter', 'gauge', 'summary'
+
+_help = {
+	'pyrclib_received_bytes_total': 'Bytes received on the current connection.',
+	'pyrclib_received_lines_total': 'Lines received on the current connection.',
+	'pyrclib_sent_bytes_total': 'Bytes written to the current connection.',
+	'pyrclib_sent_lines_total': 'Lines sent on the current connection.',
+	'pyrclib_connected': 'Whether the connection is up.',
+	'pyrclib_receive_buffer_bytes': 'Received bytes not yet framed into lines.',
+	'pyrclib_send_buffer_bytes': 'Bytes written but not yet sent by the socket or transport.',
+	'pyrclib_send_queue_lines': 'Lines waiting for flood control.',
+	'pyrclib_handler_seconds': 'Calls and cumulative time of event handlers.',
+	'pyrclib_timer_lag_seconds': 'How late timers fired.',
+	'pyrclib_reconnects_total': 'Reconnects by reason (exception type).',
+	'pyrclib_logger_buffer_lines': 'Lines buffered in a logger.',
+	'pyrclib_logger_flush_seconds': 'Duration of logger flushes.',
+	'pyrclib_writer_pending': 'Jobs queued in a background writer.',
+	'pyrclib_worker_up': 'Whether a worker process is running.',
+	'pyrclib_worker_restarts_total': 'Restarts of a worker process.',
+	'pyrclib_worker_networks': 'Networks assigned to a worker process.',
+	'pyrclib_worker_heartbeat_age_seconds': 'Seconds since a worker process last sent a heartbeat.',
+}
+
+def _funcName(func) -> str:
+	func = unwrap(func) # other instrumentation, see EventEmitter.instrument
+	name = getattr(func, '__qualname__', None)
+	if name is None: # callable object, e.g. a logger
+		name = type(func).__qualname__
+	return name
+
+def _escape(value) -> str:
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labelString(labels: tuple) -> str:
+	if not labels:
+		return ''
+	return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+class Metrics:
+	"""A registry of counters, gauges and summaries.
+
+	Counters and summaries are updated by instrumentation, gauges and connection counters
+	are collected from the watched objects when a snapshot is taken. Labels are tuples of (name, value) pairs."""
+	def __init__(self):
+		self.__cells = {} # (name, labels) -> [value] for counters, [count, sum, max] for summaries
+		self.__types = {} # name -> COUNTER, GAUGE or SUMMARY
+		self.__collectors = {} # id -> func returning (name, type, labels, value) tuples
+	def __cell(self, name: str, kind: str, labels: tuple) -> list:
+		cell = self.__cells.get((name, labels))
+		if cell is None:
+			self.__types[name] = kind
+			cell = self.__cells[name, labels] = [0] if kind == COUNTER else [0, 0.0, 0.0]
+		return cell
+	def count(self, name: str, labels: tuple = (), amount = 1):
+		self.__cell(name, COUNTER, labels)[0] += amount
+	def observe(self, name: str, value: float, labels: tuple = ()):
+		cell = self.__cell(name, SUMMARY, labels)
+		cell[0] += 1
+		cell[1] += value
+		if value > cell[2]:
+			cell[2] = value
+	def addCollector(self, collectorId, func: callable):
+		"""Call func() on every snapshot; it returns (name, type, labels, value) tuples.
+
+		A collector added with an existing id replaces the old one."""
+		self.__collectors[collectorId] = func
+	def removeCollector(self, collectorId):
+		self.__collectors.pop(collectorId, None)
+	# watching
+	def watchIRC(self, irc, **labels):
+		"""Collect connection metrics of an IRC instance and time its handlers and timers."""
+		labels = tuple(sorted(labels.items()))
+		observe = self.observe
+		clock = time.perf_counter
+		def wrap(event: str, key, func):
+			cell = self.__cell('pyrclib_handler_seconds', SUMMARY,
+				labels + (('event', event), ('key', key or '*'), ('handler', _funcName(func))))
+			def timed(*args, **kwargs):
+				start = clock()
+				try:
+					return func(*args, **kwargs)
+				finally:
+					elapsed = clock() - start
+					cell[0] += 1
+					cell[1] += elapsed
+					if elapsed > cell[2]:
+						cell[2] = elapsed
+			timed.__wrapped__ = func # for handler names in other instrumentation
+			return timed
+		previous = irc.instrument(None) # stack on top of an existing instrumentation, e.g. a HandlerProfiler
+		if previous is None:
+			irc.instrument(wrap)
+		else:
+			irc.instrument(lambda event, key, func: previous(event, key, wrap(event, key, func)))
+		irc.observeTimerLag(lambda timer, lag: observe('pyrclib_timer_lag_seconds', max(0, lag) / 1000, labels))
+		def collect():
+			con = irc._ircConnection
+			if con is None:
+				return ()
+			sendQueue = con.sendQueue
+			return (
+				('pyrclib_connected', GAUGE, labels, int(con.isConnected())),
+				('pyrclib_received_bytes_total', COUNTER, labels, getattr(con, 'bytesIn', 0)),
+				('pyrclib_received_lines_total', COUNTER, labels, getattr(con, 'linesIn', 0)),
+				('pyrclib_sent_bytes_total', COUNTER, labels, getattr(con, 'bytesOut', 0)),
+				('pyrclib_sent_lines_total', COUNTER, labels, sendQueue.sentLines),
+				('pyrclib_receive_buffer_bytes', GAUGE, labels, con.receiveBufferSize() if hasattr(con, 'receiveBufferSize') else 0),
+				('pyrclib_send_buffer_bytes', GAUGE, labels, con.sendBufferSize()),
+				('pyrclib_send_queue_lines', GAUGE, labels, len(sendQueue)),
+			)
+		self.addCollector(('irc',) + labels, collect)
+	def watchClient(self, client, **labels):
+		"""Watch the IRC instances a client creates (see watchIRC) and its reconnects."""
+		client.metrics = self
+		client.metricsLabels = labels
+		if client.irc is not None:
+			self.watchIRC(client.irc, **labels)
+		labels = tuple(sorted(labels.items()))
+		def collect():
+			return [('pyrclib_reconnects_total', COUNTER, labels + (('reason', reason),), amount)
+				for reason, amount in list(client.reconnects.items())]
+		self.addCollector(('client',) + labels, collect)
+	def watchLogger(self, logger, **labels):
+		"""Collect a logger's buffer size and time its flushes.
+
+		Call this before the logger logs anything: flushes are timed by wrapping its `flush`."""
+		labels = tuple(sorted(labels.items()))
+		flush = logger.flush
+		observe = self.observe
+		clock = time.perf_counter
+		def timedFlush():
+			start = clock()
+			try:
+				flush()
+			finally:
+				observe('pyrclib_logger_flush_seconds', clock() - start, labels)
+		logger.flush = timedFlush
+		def collect():
+			result = [
+				('pyrclib_logger_buffer_lines', GAUGE, labels, logger.bufferedLines),
+				('pyrclib_logger_buffer_bytes', GAUGE, labels, logger.bufferedBytes),
+			]
+			pending = getattr(logger.writer, 'pending', None)
+			if pending is not None:
+				result.append(('pyrclib_writer_pending', GAUGE, labels, pending()))
+			stats = logger.writer.stats()
+			result.append(('pyrclib_writer_dropped_bytes_total', COUNTER, labels, stats['droppedBytes']))
+			if 'spillBytes' in stats:
+				result.append(('pyrclib_writer_spill_bytes', GAUGE, labels, stats['spillBytes']))
+				result.append(('pyrclib_writer_spilled_bytes_total', COUNTER, labels, stats['spilledBytes']))
+			return result
+		self.addCollector(('logger', id(logger)) + labels, collect)
+	def unwatchLogger(self, logger, **labels):
+		"""Stop collecting a logger's metrics (e.g. after replacing it)."""
+		self.removeCollector(('logger', id(logger)) + tuple(sorted(labels.items())))
+	def forget(self, **labels):
+		"""Drop all metrics and collectors with these labels, e.g. those of a removed network."""
+		pairs = set(labels.items())
+		for nameLabels in [nameLabels for nameLabels in self.__cells if pairs.issubset(nameLabels[1])]:
+			del self.__cells[nameLabels]
+		for collectorId in [collectorId for collectorId in self.__collectors if pairs.issubset(collectorId[1:])]:
+			del self.__collectors[collectorId]
+	# export
+	def samples(self) -> list:
+		"""Return all (name, type, labels, value) samples; summaries' values are [count, sum, max]."""
+		types = self.__types
+		samples = [(name, types[name], labels, list(cell)) if types[name] == SUMMARY else (name, types[name], labels, cell[0])
+			for (name, labels), cell in list(self.__cells.items())]
+		for collect in list(self.__collectors.values()):
+			samples.extend(collect())
+		return samples
+	def snapshot(self) -> dict:
+		"""Return {metric name: [(labels dict, value), ...]}; summary values are dicts of count, sum and max."""
+		snapshot = {}
+		for name, kind, labels, value in self.samples():
+			if kind == SUMMARY:
+				value = {'count': value[0], 'sum': value[1], 'max': value[2]}
+			snapshot.setdefault(name, []).append((dict(labels), value))
+		return snapshot
+	def prometheus(self) -> str:
+		"""Return all metrics in the Prometheus text exposition format."""
+		byName = {}
+		for name, kind, labels, value in self.samples():
+			byName.setdefault((name, kind), []).append((labels, value))
+		lines = []
+		for (name, kind), samples in sorted(byName.items()):
+			if name in _help:
+				lines.append('# HELP %s %s' % (name, _help[name]))
+			lines.append('# TYPE %s %s' % (name, kind))
+			for labels, value in samples:
+				labelString = _labelString(labels)
+				if kind == SUMMARY:
+					lines.append('%s_count%s %s' % (name, labelString, value[0]))
+					lines.append('%s_sum%s %r' % (name, labelString, value[1]))
+				else:
+					lines.append('%s%s %s' % (name, labelString, value))
+			if kind == SUMMARY:
+				lines.append('# TYPE %s_max gauge' % name)
+				lines.extend('%s_max%s %r' % (name, _labelString(labels), value[2]) for labels, value in samples)
+		return '\n'.join(lines) + '\n'
+	def serve(self, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+		"""Serve /metrics (Prometheus) and /metrics.json on a daemon thread; call shutdown() on the result to stop."""
+		metrics = self
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path == '/metrics':
+					body, contentType = metrics.prometheus().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+				elif self.path == '/metrics.json':
+					body, contentType = json.dumps(metrics.snapshot()).encode('utf-8'), 'application/json'
+				else:
+					self.send_error(404)
+					return
+				self.send_response(200)
+				self.send_header('Content-Type', contentType)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			def log_message(self, format, *args):
+				pass
+		server = ThreadingHTTPServer((host, port), Handler)
+		server.daemon_threads = True
+		threading.Thread(target = server.serve_forever, daemon = True).start()
+		return server
@@ -0,0 +1,88 @@
+"""Names of common IRC numeric replies (RFC 1459, RFC 2812 and widespread extensions)."""
+
+names = {
+	'001': 'RPL_WELCOME',
+	'002': 'RPL_YOURHOST',
+	'003': 'RPL_CREATED',
+	'004': 'RPL_MYINFO',
+	'005': 'RPL_ISUPPORT',
+	'221': 'RPL_UMODEIS',
+	'251': 'RPL_LUSERCLIENT',
+	'252': 'RPL_LUSEROP',
+	'253': 'RPL_LUSERUNKNOWN',
+	'254': 'RPL_LUSERCHANNELS',
+	'255': 'RPL_LUSERME',
+	'265': 'RPL_LOCALUSERS',
+	'266': 'RPL_GLOBALUSERS',
+	'301': 'RPL_AWAY',
+	'305': 'RPL_UNAWAY',
+	'306': 'RPL_NOWAWAY',
+	'311': 'RPL_WHOISUSER',
+	'312': 'RPL_WHOISSERVER',
+	'313': 'RPL_WHOISOPERATOR',
+	'315': 'RPL_ENDOFWHO',
+	'317': 'RPL_WHOISIDLE',
+	'318': 'RPL_ENDOFWHOIS',
+	'319': 'RPL_WHOISCHANNELS',
+	'321': 'RPL_LISTSTART',
+	'322': 'RPL_LIST',
+	'323': 'RPL_LISTEND',
+	'324': 'RPL_CHANNELMODEIS',
+	'329': 'RPL_CREATIONTIME',
+	'331': 'RPL_NOTOPIC',
+	'332': 'RPL_TOPIC',
+	'333': 'RPL_TOPICWHOTIME',
+	'341': 'RPL_INVITING',
+	'352': 'RPL_WHOREPLY',
+	'353': 'RPL_NAMREPLY',
+	'366': 'RPL_ENDOFNAMES',
+	'367': 'RPL_BANLIST',
+	'368': 'RPL_ENDOFBANLIST',
+	'372': 'RPL_MOTD',
+	'375': 'RPL_MOTDSTART',
+	'376': 'RPL_ENDOFMOTD',
+	'381': 'RPL_YOUREOPER',
+	'396': 'RPL_HOSTHIDDEN',
+	'401': 'ERR_NOSUCHNICK',
+	'402': 'ERR_NOSUCHSERVER',
+	'403': 'ERR_NOSUCHCHANNEL',
+	'404': 'ERR_CANNOTSENDTOCHAN',
+	'405': 'ERR_TOOMANYCHANNELS',
+	'407': 'ERR_TOOMANYTARGETS',
+	'421': 'ERR_UNKNOWNCOMMAND',
+	'422': 'ERR_NOMOTD',
+	'431': 'ERR_NONICKNAMEGIVEN',
+	'432': 'ERR_ERRONEUSNICKNAME',
+	'433': 'ERR_NICKNAMEINUSE',
+	'436': 'ERR_NICKCOLLISION',
+	'437': 'ERR_UNAVAILRESOURCE',
+	'441': 'ERR_USERNOTINCHANNEL',
+	'442': 'ERR_NOTONCHANNEL',
+	'443': 'ERR_USERONCHANNEL',
+	'451': 'ERR_NOTREGISTERED',
+	'461': 'ERR_NEEDMOREPARAMS',
+	'462': 'ERR_ALREADYREGISTRED',
+	'464': 'ERR_PASSWDMISMATCH',
+	'465': 'ERR_YOUREBANNEDCREEP',
+	'471': 'ERR_CHANNELISFULL',
+	'472': 'ERR_UNKNOWNMODE',
+	'473': 'ERR_INVITEONLYCHAN',
+	'474': 'ERR_BANNEDFROMCHAN',
+	'475': 'ERR_BADCHANNELKEY',
+	'476': 'ERR_BADCHANMASK',
+	'477': 'ERR_NEEDREGGEDNICK',
+	'481': 'ERR_NOPRIVILEGES',
+	'482': 'ERR_CHANOPRIVSNEEDED',
+	'900': 'RPL_LOGGEDIN',
+	'903': 'RPL_SASLSUCCESS',
+	'904': 'ERR_SASLFAIL',
+}
+
+numbers = {name: number for number, name in names.items()}
+
+def canonical(command: 'str or int') -> str:
+	"""Return the command in the form servers send it: upper case, numerics as three digit numbers (1 -> '001')."""
+	if isinstance(command, int):
+		return '%03i' % command
+	command = command.upper()
+	return numbers.get(command, command)
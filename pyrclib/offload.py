@@ -0,0 +1,167 @@
+"""Running slow event handlers on a thread or process pool.
+
+	offloader = Offloader() # or Offloader(concurrent.futures.ProcessPoolExecutor())
+	offloader.addEventHandler('recv', lookup, 'PRIVMSG', done = reply)
+	offloader.install(irc) # or client.offloader = offloader before running an IRCClient
+
+`lookup(msg)` runs on a worker and `reply(irc, msg, result)` runs on the IRC thread afterwards,
+so it may use irc.msg and friends. Meanwhile the IRC thread goes on answering PINGs and reading
+the socket. With a process pool, handlers and messages have to be picklable.
+
+Messages of the same channel (or, outside channels, of the same nick) of an IRC instance are handled
+one after the other, in the order they were received; others run in parallel. At most `maxPending` messages
+wait or run at a time; when that many are pending, reading from the connection is paused until
+no more than `resumeAt` are left (the server keeps the rest, so don't let handlers take minutes).
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .isupport import ISupport
+from .log import logException
+
+_defaultISupport = ISupport()
+
+def targetOf(irc, msg):
+	"""Return the ordering key of a message: its (folded) channel, or the nick it is from, or None."""
+	isupport = getattr(irc, 'isupport', _defaultISupport)
+	params = msg.params
+	if params and isupport.isChannel(params[0]):
+		return isupport.lower(params[0])
+	if msg.prefix:
+		return isupport.lower(msg.prefix.split('!', 1)[0])
+	return None
+
+class _Job:
+	__slots__ = 'irc', 'func', 'args', 'done'
+	def __init__(self, irc, func: callable, args: tuple, done: callable):
+		self.irc = irc
+		self.func = func
+		self.args = args
+		self.done = done
+
+class Offloader:
+	"""Runs event handlers on an executor (a ThreadPoolExecutor with `workers` threads by default)."""
+	def __init__(self, executor = None, workers: int = 4, maxPending: int = 2**8, resumeAt: int = None):
+		self.__ownExecutor = executor is None
+		self.executor = executor if executor is not None else ThreadPoolExecutor(workers, 'pyrclib offload')
+		self.maxPending = maxPending
+		self.resumeAt = resumeAt if resumeAt is not None else maxPending // 2
+		self.__handlers = [] # (name, func, key, done, orderBy)
+		self.__subscriptions = {} # irc -> list of Subscriptions
+		self.__queues = {} # (irc, ordering key) -> deque of jobs waiting for the running one; a key is present while its job runs
+		self.__lock = threading.Lock() # guards the statistics, which are read from any thread
+		self.__paused = set() # IRC instances we paused reading of
+		# statistics
+		self.pending = 0 # jobs waiting or running
+		self.submitted = 0
+		self.completed = 0
+		self.errors = 0
+		self.pauses = 0 # times reading was paused
+		self.maxPendingSeen = 0
+	def addEventHandler(self, name: str, func: callable, key = None, done: callable = None, orderBy: callable = targetOf):
+		"""Run func(*event args without the IRC instance) on the executor for each event, e.g. func(msg) for 'recv'.
+
+		done(irc, *event args, result) is called on the IRC thread with func's return value.
+		orderBy(irc, *event args) returns the key of the events which have to be handled in order (see `targetOf`)."""
+		handler = (name, func, key, done, orderBy)
+		self.__handlers.append(handler)
+		for irc, subs in self.__subscriptions.items():
+			subs.append(self.__subscribe(irc, handler))
+	def install(self, irc):
+		"""Register the handlers on an IRC instance."""
+		self.__subscriptions[irc] = [self.__subscribe(irc, handler) for handler in self.__handlers]
+	def uninstall(self, irc):
+		"""Unregister the handlers and forget irc; jobs already submitted still complete.
+
+		Call it when an IRC instance is discarded (IRCClient does), so it isn't kept alive."""
+		for sub in self.__subscriptions.pop(irc, ()):
+			sub.remove()
+		self.__paused.discard(irc)
+		for key in [key for key in self.__queues if key[0] is irc]:
+			waiting = self.__queues.pop(key) # dropped; a running job is only counted when it's done
+			with self.__lock:
+				self.pending -= len(waiting)
+	def __subscribe(self, irc, handler: tuple):
+		name, func, key, done, orderBy = handler
+		def offloaded(irc, *args):
+			self.submit(irc, orderBy(irc, *args), func, *args, done = done)
+		offloaded.__wrapped__ = func # for handler names in metrics and profiles
+		return irc.addEventHandler(name, offloaded, key)
+	def submit(self, irc, orderKey, func: callable, *args, done: callable = None):
+		"""Run func(*args) on the executor after the jobs submitted earlier with the same irc and orderKey.
+
+		Call from the IRC thread. done(irc, *args, result) is called there afterwards."""
+		job = _Job(irc, func, args, done)
+		with self.__lock:
+			self.pending += 1
+			self.submitted += 1
+			if self.pending > self.maxPendingSeen:
+				self.maxPendingSeen = self.pending
+		key = irc, orderKey # the same channel on two networks isn't the same
+		queue = self.__queues.get(key)
+		if queue is None:
+			self.__queues[key] = deque()
+			self.__start(key, job)
+		else:
+			queue.append(job)
+		if self.pending >= self.maxPending and irc not in self.__paused:
+			self.__paused.add(irc)
+			self.pauses += 1
+			irc.pauseReading()
+	def __start(self, key: tuple, job: _Job):
+		try:
+			future = self.executor.submit(job.func, *job.args)
+		except RuntimeError as err: # executor shut down
+			self.__finished(key, job, None, err)
+			return
+		future.add_done_callback(lambda future: self.__done(key, job, future))
+	def __done(self, key: tuple, job: _Job, future):
+		"""Called on a worker when a job ran: collect it on the IRC thread, unless irc was uninstalled meanwhile."""
+		if key in self.__queues:
+			job.irc.callSoonThreadsafe(self.__collect, key, job, future)
+			return
+		with self.__lock:
+			self.pending -= 1
+			self.completed += 1
+	def __collect(self, key: tuple, job: _Job, future):
+		try:
+			result = future.result()
+		except Exception as err:
+			self.__finished(key, job, None, err)
+		else:
+			self.__finished(key, job, result, None)
+	def __finished(self, key: tuple, job: _Job, result, err: Exception):
+		with self.__lock:
+			self.pending -= 1
+			self.completed += 1
+			if err is not None:
+				self.errors += 1
+		queue = self.__queues.get(key) # None if irc was uninstalled
+		if queue:
+			self.__start(key, queue.popleft())
+		elif queue is not None:
+			del self.__queues[key]
+		if self.pending <= self.resumeAt and self.__paused:
+			for irc in self.__paused:
+				irc.resumeReading()
+			self.__paused.clear()
+		if err is not None:
+			logException(err)
+		elif job.done is not None:
+			job.done(job.irc, *job.args, result)
+	def stats(self) -> dict:
+		with self.__lock:
+			return {
+				'pending': self.pending,
+				'submitted': self.submitted,
+				'completed': self.completed,
+				'errors': self.errors,
+				'pauses': self.pauses,
+				'maxPending': self.maxPendingSeen,
+				'readingPaused': bool(self.__paused),
+			}
+	def shutdown(self, wait: bool = True):
+		"""Shut down the executor if it was created by the Offloader."""
+		if self.__ownExecutor:
+			self.executor.shutdown(wait)
@@ -0,0 +1,182 @@
+"""Opt-in profiling of event handlers.
+
+	profiler = HandlerProfiler(budget = 0.01)
+	profiler.install(irc) # or client.profiler = profiler before running an IRCClient
+	profiler.installSignal() # SIGUSR1 dumps a report and the cProfile stats
+	print(profiler.report())
+
+Every handler call is timed into a rolling histogram of the handler. Calls taking longer than
+the budget are logged as warnings (at most one per handler every `warnInterval` seconds).
+With `cprofile` enabled, handler calls also run under a cProfile.Profile, whose stats
+`dump` writes in the usual format (see the pstats module).
+"""
+
+import cProfile
+import os
+import signal
+import time
+from bisect import bisect_left
+from collections import deque
+from inspect import unwrap
+from .log import logString, logWarning
+
+# histogram bucket upper bounds in seconds: 10us, 20us, 40us, ... ~1.3s; the last bucket is unbounded
+bounds = tuple(1e-5 * 2**i for i in range(18))
+
+def handlerName(func) -> str:
+	func = unwrap(func)
+	name = getattr(func, '__qualname__', None)
+	if name is None: # callable object, e.g. a logger
+		return type(func).__qualname__
+	module = getattr(func, '__module__', None)
+	return '%s.%s' % (module, name) if module else name
+
+def _command(args) -> str:
+	"""Return the command of the message a recv/send handler was called for, or None."""
+	if len(args) >= 2:
+		return getattr(args[1], 'command', None)
+	return None
+
+class HandlerStats:
+	"""Call counts and a rolling duration histogram of one handler."""
+	__slots__ = 'name', 'calls', 'total', 'max', 'overBudget', 'windows', 'lastWarning', 'suppressed'
+	def __init__(self, name: str):
+		self.name = name
+		self.calls = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.overBudget = 0
+		self.windows = deque() # (window number, bucket counts), oldest first
+		self.lastWarning = 0.0
+		self.suppressed = 0 # warnings not logged since the last one
+	def add(self, duration: float, window: int, maxWindows: int):
+		self.calls += 1
+		self.total += duration
+		if duration > self.max:
+			self.max = duration
+		windows = self.windows
+		if not windows or windows[-1][0] != window:
+			windows.append((window, [0] * (len(bounds) + 1)))
+			while windows[0][0] <= window - maxWindows:
+				windows.popleft()
+		windows[-1][1][bisect_left(bounds, duration)] += 1
+	def histogram(self, window: int, maxWindows: int) -> list:
+		"""Return the bucket counts of the rolling window."""
+		counts = [0] * (len(bounds) + 1)
+		for number, windowCounts in self.windows:
+			if number > window - maxWindows:
+				for i, n in enumerate(windowCounts):
+					counts[i] += n
+		return counts
+
+def percentile(counts: list, fraction: float) -> float:
+	"""Return the upper bound of the bucket containing the percentile (inf for the last bucket), or None."""
+	total = sum(counts)
+	if not total:
+		return None
+	rank = fraction * total
+	seen = 0
+	for i, n in enumerate(counts):
+		seen += n
+		if seen >= rank:
+			return bounds[i] if i < len(bounds) else float('inf')
+
+class HandlerProfiler:
+	"""Times the handlers of EventEmitters it is installed on.
+
+	budget: seconds a handler call may take before a warning is logged, None for no warnings
+	windowSeconds, windows: the histograms cover the last windows * windowSeconds seconds
+	cprofile: also collect cProfile stats of handler calls
+	"""
+	warnInterval = 10 # min seconds between warnings about the same handler
+	def __init__(self, budget: float = 0.05, windowSeconds: float = 10, windows: int = 6, cprofile: bool = False):
+		self.budget = budget
+		self.windowSeconds = windowSeconds
+		self.windows = windows
+		self.handlers = {} # handler name -> HandlerStats
+		self.profile = cProfile.Profile() if cprofile else None
+		self.__depth = 0 # nesting of profiled calls, handlers may emit events themselves
+	def install(self, emitter):
+		"""Time all handlers of an emitter (e.g. an IRC instance), on top of an existing instrumentation."""
+		previous = emitter.instrument(None)
+		if previous is None:
+			emitter.instrument(self.wrap)
+		else:
+			emitter.instrument(lambda name, key, func: previous(name, key, self.wrap(name, key, func)))
+	def wrap(self, event: str, key, func: callable) -> callable:
+		name = handlerName(func)
+		stats = self.handlers.get(name)
+		if stats is None:
+			stats = self.handlers[name] = HandlerStats(name)
+		clock = time.perf_counter
+		def timed(*args, **kwargs):
+			profile = self.profile
+			start = clock()
+			if profile is not None and not self.__depth:
+				self.__depth += 1
+				profile.enable()
+				try:
+					return func(*args, **kwargs)
+				finally:
+					profile.disable()
+					self.__depth -= 1
+					self.__record(stats, event, key, clock() - start, args)
+			else:
+				try:
+					return func(*args, **kwargs)
+				finally:
+					self.__record(stats, event, key, clock() - start, args)
+		timed.__wrapped__ = func # see handlerName
+		return timed
+	def __record(self, stats: HandlerStats, event: str, key, duration: float, args):
+		now = time.monotonic()
+		stats.add(duration, int(now / self.windowSeconds), self.windows)
+		budget = self.budget
+		if budget is not None and duration > budget:
+			stats.overBudget += 1
+			if now - stats.lastWarning < self.warnInterval:
+				stats.suppressed += 1
+				return
+			command = _command(args) or key or '-'
+			suppressed = ' (%i more since the last warning)' % stats.suppressed if stats.suppressed else ''
+			logWarning('Handler %s took %.1f ms for %s %s, the budget is %.1f ms%s.' % (
+				stats.name, duration * 1000, event, command, budget * 1000, suppressed))
+			stats.lastWarning = now
+			stats.suppressed = 0
+	# reports
+	def stats(self) -> dict:
+		"""Return {handler name: {calls, total, max, overBudget, p50, p99, recentCalls}}; percentiles are of the rolling window."""
+		window = int(time.monotonic() / self.windowSeconds)
+		result = {}
+		for name, stats in list(self.handlers.items()):
+			counts = stats.histogram(window, self.windows)
+			result[name] = {
+				'calls': stats.calls,
+				'total': stats.total,
+				'max': stats.max,
+				'overBudget': stats.overBudget,
+				'recentCalls': sum(counts),
+				'p50': min(percentile(counts, 0.5), stats.max) if sum(counts) else None,
+				'p99': min(percentile(counts, 0.99), stats.max) if sum(counts) else None,
+			}
+		return result
+	def report(self) -> str:
+		"""Return a table of all handlers, the most expensive first."""
+		def ms(value):
+			return '-' if value is None else '%.3f' % (value * 1000)
+		lines = ['%10s %12s %10s %10s %10s %8s  %s' % ('calls', 'total ms', 'p50 ms', 'p99 ms', 'max ms', 'slow', 'handler')]
+		for name, stats in sorted(self.stats().items(), key = lambda item: -item[1]['total']):
+			lines.append('%10i %12.1f %10s %10s %10s %8i  %s' % (stats['calls'], stats['total'] * 1000,
+				ms(stats['p50']), ms(stats['p99']), ms(stats['max']), stats['overBudget'], name))
+		return '\n'.join(lines)
+	def dump(self, path: str = None):
+		"""Log the report and write the cProfile stats (if enabled) to path."""
+		logString('Handler profile:\n' + self.report())
+		if self.profile is not None:
+			if path is None:
+				path = 'pyrclib-%i.prof' % os.getpid()
+			self.profile.dump_stats(path)
+			logString('cProfile stats written to %s' % path)
+	def installSignal(self, signum: int = signal.SIGUSR1, path: str = None):
+		"""Dump on a signal. Has to be called from the main thread."""
+		signal.signal(signum, lambda signum, frame: self.dump(path))
@@ -0,0 +1,181 @@
+"""Replay recorded raw logs through the client stack.
+
+RawIRCLogger files (`<unix timestamp> <raw line>`, plain or as gzip/xz archive segments) are
+turned back into wire data and go through ReceiveBuffer framing, message parsing, event dispatch
+and whatever handlers and loggers are registered on the IRC instance. Nothing is sent anywhere:
+the IRC instance uses a ReplayConnection, which only counts outgoing messages.
+
+Replays run in real time (speed 1), scaled time (e.g. speed 100) or as fast as possible (speed None).
+"""
+
+import gzip
+import lzma
+import time
+from .connection import ReceiveBuffer
+from .irc import IRC, IRCBase, deliverMessages
+from .sendqueue import SendQueue
+from . import numerics
+
+_opener = {'.gz': gzip.open, '.xz': lzma.open}
+
+def readRecords(paths):
+	"""Yield (timestamp, raw line) pairs from RawIRCLogger files; archive segments are decompressed."""
+	for path in paths:
+		with _opener.get(path[-3:], open)(path, 'rb') as fo:
+			for line in fo:
+				ts, sep, raw = line.rstrip(b'\r\n').partition(b' ')
+				if not sep:
+					continue
+				try:
+					yield float(ts), raw
+				except ValueError:
+					continue
+
+def _command(raw: bytes) -> bytes:
+	"""Return the command of a raw line (cheaper than parsing it)."""
+	parts = raw.split(b' ', 3)
+	i = 0
+	if parts[i].startswith(b'@'):
+		i += 1
+	if i < len(parts) and parts[i].startswith(b':'):
+		i += 1
+	return parts[i] if i < len(parts) else b''
+
+def _channels(raw: bytes) -> list:
+	"""Return the (lower case) channels a raw line is about."""
+	return [param.lower() for param in raw.split(b' :', 1)[0].split(b' ') if param[:1] in (b'#', b'&')]
+
+class ReplayConnection:
+	"""A stand-in for IRCConnection that drops everything sent through it."""
+	def __init__(self, host: str, port: int, delegate, useSsl: bool, sock = None):
+		self.delegate = delegate
+		self.sendQueue = SendQueue(None)
+		self.sentLines = 0
+		self.__connected = True
+	def send(self, msgString: str, priority: int = None):
+		self.sentLines += 1
+		return self.__connected
+	def sendMany(self, msgStrings: list, priority: int):
+		self.sentLines += len(msgStrings)
+		return self.__connected
+	def sendBufferSize(self) -> int:
+		return 0
+	def isConnected(self) -> bool:
+		return self.__connected
+	def disconnect(self):
+		self.__connected = False
+	def pauseReading(self):
+		pass
+	def resumeReading(self):
+		pass
+	def tick(self, timeout: float = 5, wakeSocket = None):
+		pass
+
+class ReplayIRC(IRC):
+	"""An IRC instance fed by a Replay instead of a server."""
+	_connectionClass = ReplayConnection
+	def tick(self):
+		IRCBase.tick(self) # only timers; gaps in a recording are no reason to ping or time out
+
+class Replay:
+	"""Feeds recorded lines into an IRC instance (usually a ReplayIRC).
+
+	speed: 1 for real time, 100 for 100 times faster, None for as fast as possible
+	start, end: unix time window of the recording to replay
+	channels: only replay lines about these channels (lines without a channel, like QUIT, are left out)
+	commands: only replay these commands (names or numbers, e.g. 'PRIVMSG' or 'RPL_NAMREPLY')
+	receivedOnly: leave out the lines we sent; these are recognized by their missing prefix
+	"""
+	EOL = b'\r\n'
+	maxBatchLines = 2**8 # lines framed and delivered in one go
+	def __init__(self, irc, speed: float = None, start: float = None, end: float = None,
+			channels = None, commands = None, receivedOnly: bool = True):
+		self.irc = irc
+		self.speed = speed
+		self.start = start
+		self.end = end
+		self.channels = {channel.lower().encode('utf-8') for channel in channels} if channels else None
+		self.commands = {numerics.canonical(command).encode('ascii') for command in commands} if commands else None
+		self.receivedOnly = receivedOnly
+		self.__buffer = ReceiveBuffer()
+		self.__resetStats()
+	def __resetStats(self):
+		self.readLines = 0
+		self.replayedLines = 0
+		self.maxLag = 0 # seconds the replay fell behind schedule, in timed modes
+		self.seconds = 0
+	def stats(self) -> dict:
+		con = self.irc._ircConnection
+		return {
+			'readLines': self.readLines,
+			'replayedLines': self.replayedLines,
+			'sentLines': getattr(con, 'sentLines', None),
+			'seconds': self.seconds,
+			'linesPerSec': self.replayedLines / self.seconds if self.seconds else None,
+			'maxLag': self.maxLag,
+		}
+	def accepts(self, ts: float, raw: bytes) -> bool:
+		if (self.start is not None and ts < self.start) or (self.end is not None and ts > self.end):
+			return False
+		command = None
+		if self.receivedOnly and not raw.startswith((b':', b'@')):
+			command = _command(raw).upper()
+			if command not in (b'PING', b'ERROR'): # the only prefix-less lines servers send
+				return False
+		if self.commands is not None:
+			if command is None:
+				command = _command(raw).upper()
+			if numerics.canonical(command.decode('ascii', 'replace')).encode('ascii') not in self.commands:
+				return False
+		if self.channels is not None and self.channels.isdisjoint(_channels(raw)):
+			return False
+		return True
+	def __deliver(self, lines: list):
+		buffer = self.__buffer
+		buffer.write(self.EOL.join(lines) + self.EOL)
+		msgsData = buffer.readLines(self.EOL)
+		self.replayedLines += len(msgsData)
+		deliverMessages(self.irc, msgsData)
+		self.irc.tick()
+	def run(self, records) -> dict:
+		"""Replay (timestamp, raw line) pairs (see readRecords) and return the stats."""
+		self.__resetStats()
+		irc = self.irc
+		if irc._ircConnection is None:
+			irc.connect('replay', 0, False)
+		irc.isRunning = True
+		speed = self.speed
+		clock = time.monotonic
+		started = clock()
+		first = None
+		batch = []
+		for ts, raw in records:
+			self.readLines += 1
+			if not self.accepts(ts, raw):
+				continue
+			if speed is not None:
+				if first is None:
+					first = ts
+				due = started + (ts - first) / speed
+				wait = due - clock()
+				if wait > 0:
+					if batch:
+						self.__deliver(batch)
+						batch = []
+						wait = due - clock()
+					while wait > 0: # keep the timers (e.g. logger flushes) running while waiting
+						time.sleep(min(wait, irc._pollTimeout()))
+						irc.tick()
+						wait = due - clock()
+				elif -wait > self.maxLag:
+					self.maxLag = -wait
+			batch.append(raw)
+			if len(batch) >= self.maxBatchLines:
+				self.__deliver(batch)
+				batch = []
+			if not irc.isRunning:
+				break
+		if batch:
+			self.__deliver(batch)
+		self.seconds = clock() - started
+		return self.stats()
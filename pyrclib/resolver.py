@@ -0,0 +1,182 @@
+"""Name resolution with a cache, and connecting to the first of several addresses that answers.
+
+getaddrinfo doesn't tell the TTL of its results, so cached results live for a configured time.
+When a lookup fails, an expired result is used rather than nothing.
+
+`connectFirst` and `connectFirstAsync` race connection attempts (happy eyeballs, RFC 8305):
+attempts start `delay` seconds apart (or right away when the previous one failed), and the
+first connected socket wins; the others are closed.
+"""
+
+import asyncio
+import errno
+import select
+import socket
+import time
+
+def interleave(infos: list) -> list:
+	"""Order getaddrinfo results by alternating the address families, starting with the first one's."""
+	families = {}
+	for info in infos:
+		families.setdefault(info[0], []).append(info)
+	queues = list(families.values())
+	result = []
+	while queues:
+		for queue in queues:
+			result.append(queue.pop(0))
+		queues = [queue for queue in queues if queue]
+	return result
+
+class Resolver:
+	"""A getaddrinfo cache.
+
+	ttl: seconds a result is used for
+	"""
+	def __init__(self, ttl: float = 300):
+		self.ttl = ttl
+		self.__cache = {} # (host, port) -> (expiry time, interleaved getaddrinfo results)
+	def __cached(self, host: str, port: int, fresh: bool = True):
+		entry = self.__cache.get((host, port))
+		if entry is not None and (not fresh or entry[0] > time.monotonic()):
+			return entry[1]
+		return None
+	def __store(self, host: str, port: int, infos: list) -> list:
+		infos = interleave(infos)
+		self.__cache[host, port] = (time.monotonic() + self.ttl, infos)
+		return infos
+	def forget(self, host: str = None):
+		"""Drop the cached results of a host, or all of them."""
+		for key in [key for key in self.__cache if host is None or key[0] == host]:
+			del self.__cache[key]
+	def resolve(self, host: str, port: int) -> list:
+		"""Return the getaddrinfo results (family, type, proto, canonname, sockaddr) for a TCP connection.
+
+		Raise OSError (socket.gaierror) if the lookup fails and there is no earlier result."""
+		port = int(port)
+		infos = self.__cached(host, port)
+		if infos is not None:
+			return infos
+		try:
+			infos = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+		except OSError:
+			infos = self.__cached(host, port, False)
+			if infos is None:
+				raise
+			return infos
+		return self.__store(host, port, infos)
+	async def resolveAsync(self, host: str, port: int) -> list:
+		"""Like `resolve`, without blocking the event loop."""
+		port = int(port)
+		infos = self.__cached(host, port)
+		if infos is not None:
+			return infos
+		try:
+			infos = await asyncio.get_running_loop().getaddrinfo(host, port, family = socket.AF_UNSPEC, type = socket.SOCK_STREAM)
+		except OSError:
+			infos = self.__cached(host, port, False)
+			if infos is None:
+				raise
+			return infos
+		return self.__store(host, port, infos)
+
+defaultResolver = Resolver() # shared by all connections unless they are given another one
+
+def _connectError(errors: list) -> OSError:
+	if not errors:
+		return OSError('No addresses to connect to.')
+	if len(errors) == 1:
+		return errors[0]
+	return OSError('All connection attempts failed: %s' % ', '.join(str(err) for err in errors))
+
+def connectFirst(addresses: list, delay: float = 0.25, timeout: float = 10):
+	"""Connect to the first address that answers.
+
+	addresses: (key, getaddrinfo result) pairs, in the order to try them
+	Return (key, non-blocking connected socket). Raise OSError if all attempts fail or time out."""
+	pending = {} # socket -> key
+	errors = []
+	now = time.monotonic()
+	deadline = now + timeout
+	nextStart = now
+	todo = list(addresses)
+	try:
+		while True:
+			now = time.monotonic()
+			if todo and (now >= nextStart or not pending):
+				key, (family, socktype, proto, canonname, sockaddr) = todo.pop(0)
+				try:
+					sock = socket.socket(family, socktype, proto)
+				except OSError as err:
+					errors.append(err)
+					continue
+				sock.setblocking(False)
+				err = sock.connect_ex(sockaddr)
+				if err == 0:
+					return key, sock
+				if err not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+					sock.close()
+					errors.append(OSError(err, '%s: %s' % (sockaddr[0], errno.errorcode.get(err, err))))
+					continue
+				pending[sock] = key
+				nextStart = now + delay
+				continue
+			if not pending:
+				raise _connectError(errors)
+			if now >= deadline:
+				raise TimeoutError('Connecting timed out.')
+			wait = min(deadline, nextStart) - now if todo else deadline - now
+			readable, writable, failed = select.select([], list(pending), list(pending), max(0, wait))
+			for sock in set(writable + failed):
+				key = pending.pop(sock)
+				err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+				if err == 0:
+					return key, sock
+				sock.close()
+				errors.append(OSError(err, errno.errorcode.get(err, str(err))))
+				nextStart = now # start the next attempt right away
+	finally:
+		for sock in pending:
+			sock.close()
+
+async def connectFirstAsync(addresses: list, delay: float = 0.25, timeout: float = 10):
+	"""Like `connectFirst`, on the running event loop."""
+	loop = asyncio.get_running_loop()
+	async def attempt(key, family, socktype, proto, canonname, sockaddr):
+		sock = socket.socket(family, socktype, proto)
+		sock.setblocking(False)
+		try:
+			await loop.sock_connect(sock, sockaddr)
+		except BaseException:
+			sock.close()
+			raise
+		return key, sock
+	todo = list(addresses)
+	pending = set()
+	errors = []
+	winner = None
+	try:
+		async with asyncio.timeout(timeout):
+			while winner is None:
+				if todo:
+					key, info = todo.pop(0)
+					pending.add(asyncio.ensure_future(attempt(key, *info)))
+				if not pending:
+					raise _connectError(errors)
+				done, pending = await asyncio.wait(pending, timeout = delay if todo else None, return_when = asyncio.FIRST_COMPLETED)
+				for task in done:
+					if task.exception() is not None:
+						errors.append(task.exception())
+					elif winner is None:
+						winner = task.result()
+					else:
+						task.result()[1].close()
+	except TimeoutError:
+		raise TimeoutError('Connecting timed out.') from None
+	finally:
+		for task in pending:
+			task.cancel()
+		if pending:
+			for task in (await asyncio.wait(pending))[0]:
+				if not task.cancelled() and task.exception() is None:
+					task.result()[1].close()
+	return winner
@@ -0,0 +1,117 @@
+from collections import deque
+import time
+
+# priority classes, lower goes first
+PRIORITY_HIGH = 0 # connection upkeep, never delayed by flood control
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2 # chat messages
+
+commandPriorities = {
+	'PING': PRIORITY_HIGH,
+	'PONG': PRIORITY_HIGH,
+	'QUIT': PRIORITY_HIGH,
+	'PRIVMSG': PRIORITY_BULK,
+	'NOTICE': PRIORITY_BULK,
+}
+
+def priorityOf(msgString: str) -> int:
+	"""Return the default priority class of a raw message string."""
+	return commandPriorities.get(msgString.split(' ', 1)[0].upper(), PRIORITY_NORMAL)
+
+class FloodControl:
+	"""A token bucket modelled after the penalty clocks of common ircds.
+
+	Every line sent advances a penalty clock by `lineCost` seconds plus one second per `bytesPerSecond` bytes.
+	The clock may run up to `burst` seconds ahead of real time; servers disconnect clients beyond that.
+	The defaults follow ircu/hybrid style rules (2s per line, 10s burst)."""
+	def __init__(self, lineCost: float = 2.0, bytesPerSecond: int = 120, burst: float = 10.0):
+		self.lineCost = lineCost
+		self.bytesPerSecond = bytesPerSecond
+		self.burst = burst
+		self.__clock = 0.0
+	def reset(self):
+		self.__clock = 0.0
+	def cost(self, data: bytes) -> float:
+		return self.lineCost + len(data) / self.bytesPerSecond
+	def delay(self, cost: float, now: float) -> float:
+		"""Return the seconds to wait until something of the given cost may be sent."""
+		return max(0.0, max(self.__clock, now) + cost - self.burst - now)
+	def consume(self, cost: float, now: float):
+		self.__clock = max(self.__clock, now) + cost
+
+class SendQueue:
+	"""Outbound message queue with priority classes and optional flood control.
+
+	Messages are queued as encoded lines and handed out in batches by `pop`,
+	so they can be written with a single send call."""
+	def __init__(self, floodControl: FloodControl = None):
+		self.floodControl = floodControl
+		self.__queues = tuple(deque() for _ in range(PRIORITY_BULK + 1))
+		self.__size = 0
+		# statistics
+		self.sentLines = 0
+		self.sentBytes = 0
+		self.totalWait = 0.0 # sum of seconds messages spent queued
+		self.maxWait = 0.0
+	def __len__(self):
+		return self.__size
+	def put(self, data: bytes, priority: int = PRIORITY_NORMAL, now: float = None):
+		self.__queues[priority].append((data, time.monotonic() if now is None else now))
+		self.__size += 1
+	def putMany(self, lines: list, priority: int = PRIORITY_NORMAL, now: float = None):
+		"""Queue several lines of the same priority with a single append."""
+		queuedAt = time.monotonic() if now is None else now
+		self.__queues[priority].extend([(data, queuedAt) for data in lines])
+		self.__size += len(lines)
+	def pop(self, now: float = None) -> list:
+		"""Remove and return all lines which may be sent right now, highest priority first."""
+		if not self.__size:
+			return []
+		now = time.monotonic() if now is None else now
+		floodControl = self.floodControl
+		batch = []
+		for priority, queue in enumerate(self.__queues):
+			while queue:
+				data, queuedAt = queue[0]
+				if floodControl is not None:
+					cost = floodControl.cost(data)
+					if priority != PRIORITY_HIGH and floodControl.delay(cost, now) > 0:
+						break
+					floodControl.consume(cost, now)
+				queue.popleft()
+				batch.append(data)
+				wait = now - queuedAt
+				self.totalWait += wait
+				if wait > self.maxWait:
+					self.maxWait = wait
+			if queue: # flood limited; lower priorities have to wait as well
+				break
+		self.__size -= len(batch)
+		self.sentLines += len(batch)
+		self.sentBytes += sum(len(data) for data in batch)
+		return batch
+	def nextSendDelay(self, now: float = None) -> float:
+		"""Return the seconds until `pop` will return something, or None if the queue is empty."""
+		if not self.__size:
+			return None
+		if self.floodControl is None:
+			return 0.0
+		now = time.monotonic() if now is None else now
+		for queue in self.__queues:
+			if queue:
+				return self.floodControl.delay(self.floodControl.cost(queue[0][0]), now)
+	def oldestWait(self, now: float = None) -> float:
+		"""Return the seconds the longest waiting queued message has been waiting."""
+		now = time.monotonic() if now is None else now
+		waits = [now - queue[0][1] for queue in self.__queues if queue]
+		return max(waits) if waits else 0.0
+	def stats(self) -> dict:
+		return {
+			'depth': self.__size,
+			'depthByPriority': [len(queue) for queue in self.__queues],
+			'oldestWait': self.oldestWait(),
+			'sentLines': self.sentLines,
+			'sentBytes': self.sentBytes,
+			'averageWait': self.totalWait / self.sentLines if self.sentLines else 0.0,
+			'maxWait': self.maxWait,
+		}
@@ -0,0 +1,139 @@
+"""Choosing servers to connect to: health scores and exponential backoff with jitter.
+
+A ServerPool hands out the servers which may be tried right now, healthiest first;
+`connectAny` races the best few of them (and all of their addresses) and returns the first
+connected socket. Servers that failed wait for their backoff to pass, the others are available at once,
+so after a netsplit the client is back as soon as any server answers.
+"""
+
+import random
+import time
+from .resolver import defaultResolver, connectFirst, connectFirstAsync
+
+class ServerState:
+	"""Connection history of one server."""
+	__slots__ = 'failures', 'nextAttempt', 'score', 'connectTime', 'lastError'
+	def __init__(self):
+		self.failures = 0 # consecutive failures
+		self.nextAttempt = 0.0 # monotonic time before which the server isn't tried
+		self.score = 1.0 # moving average of successes (1) and failures (0)
+		self.connectTime = None # moving average of connect durations in seconds
+		self.lastError = None
+
+class ServerPool:
+	"""The servers of a network with their health.
+
+	Servers are (host, port, useSsl) tuples."""
+	backoffBase = 1.0 # seconds to wait after the first failure, doubled with every further one
+	backoffMax = 300.0
+	stableAfter = 60 # seconds a connection has to last for a disconnect not to count as failure
+	scoreWeight = 0.3 # weight of the latest result in the score
+	def __init__(self, servers = ()):
+		self.__states = {} # server -> ServerState, in config order
+		for server in servers:
+			self.add(*server)
+	def add(self, host: str, port: int, useSsl: bool):
+		self.__states.setdefault((host, port, useSsl), ServerState())
+	def update(self, servers: list):
+		"""Replace the servers, in the new order; servers kept keep their history."""
+		states = self.__states
+		self.__states = {}
+		for server in servers:
+			server = tuple(server)
+			self.__states[server] = states.get(server) or ServerState()
+	def servers(self) -> list:
+		return list(self.__states)
+	def state(self, server: tuple) -> ServerState:
+		return self.__states[server]
+	def candidates(self, now: float = None) -> list:
+		"""Return the servers which may be tried now, best first."""
+		if now is None:
+			now = time.monotonic()
+		ready = [(i, server, state) for i, (server, state) in enumerate(self.__states.items()) if state.nextAttempt <= now]
+		ready.sort(key = lambda item: (-item[2].score, item[2].connectTime if item[2].connectTime is not None else 0, item[0]))
+		return [server for i, server, state in ready]
+	def nextAttemptIn(self, now: float = None) -> float:
+		"""Return the seconds until a server may be tried."""
+		if now is None:
+			now = time.monotonic()
+		if not self.__states:
+			return self.backoffMax
+		return max(0.0, min(state.nextAttempt for state in self.__states.values()) - now)
+	def __updateScore(self, state: ServerState, success: bool):
+		state.score += self.scoreWeight * ((1.0 if success else 0.0) - state.score)
+	def succeeded(self, server: tuple, connectTime: float):
+		"""Record a successful connect taking connectTime seconds."""
+		state = self.__states[server]
+		self.__updateScore(state, True)
+		state.connectTime = connectTime if state.connectTime is None else state.connectTime + self.scoreWeight * (connectTime - state.connectTime)
+	def failed(self, server: tuple, err: Exception = None):
+		"""Record a failed connect (or an early disconnect) and back off."""
+		state = self.__states[server]
+		self.__updateScore(state, False)
+		state.failures += 1
+		state.lastError = err
+		delay = min(self.backoffMax, self.backoffBase * 2**(state.failures - 1))
+		state.nextAttempt = time.monotonic() + delay * random.uniform(0.5, 1.0) # jitter keeps clients from reconnecting in lockstep
+	def disconnected(self, server: tuple, connectedFor: float, err: Exception = None):
+		"""Record the end of a connection. Long lasting ones reset the backoff; short ones count as failures."""
+		if connectedFor >= self.stableAfter:
+			state = self.__states[server]
+			state.failures = 0
+			state.nextAttempt = 0.0
+			state.lastError = err
+		else:
+			self.failed(server, err)
+
+def _addresses(serversInfos: list) -> list:
+	"""Interleave the addresses of several servers: the first address of each server, then the second ones, ..."""
+	queues = [[(server, info) for info in infos] for server, infos in serversInfos if infos]
+	addresses = []
+	while queues:
+		for queue in queues:
+			addresses.append(queue.pop(0))
+		queues = [queue for queue in queues if queue]
+	return addresses
+
+def connectAny(pool: ServerPool, count: int = 2, resolver = defaultResolver, delay: float = 0.25, timeout: float = 10):
+	"""Race the `count` best candidates of the pool. Return (server, connected socket) or raise OSError.
+
+	The results are recorded in the pool: the winner succeeded, servers whose lookups failed failed,
+	and if nothing connected all raced servers failed."""
+	servers = pool.candidates()[:count]
+	serversInfos = []
+	for server in servers:
+		try:
+			serversInfos.append((server, resolver.resolve(server[0], server[1])))
+		except OSError as err:
+			pool.failed(server, err)
+	return _finish(pool, servers, serversInfos, lambda addresses: connectFirst(addresses, delay, timeout))
+
+async def connectAnyAsync(pool: ServerPool, count: int = 2, resolver = defaultResolver, delay: float = 0.25, timeout: float = 10):
+	"""Like `connectAny`, on the running event loop."""
+	servers = pool.candidates()[:count]
+	serversInfos = []
+	for server in servers:
+		try:
+			serversInfos.append((server, await resolver.resolveAsync(server[0], server[1])))
+		except OSError as err:
+			pool.failed(server, err)
+	started = time.monotonic()
+	try:
+		server, sock = await connectFirstAsync(_addresses(serversInfos), delay, timeout)
+	except OSError as err:
+		for server, infos in serversInfos:
+			pool.failed(server, err)
+		raise
+	pool.succeeded(server, time.monotonic() - started)
+	return server, sock
+
+def _finish(pool: ServerPool, servers: list, serversInfos: list, connect: callable):
+	started = time.monotonic()
+	try:
+		server, sock = connect(_addresses(serversInfos))
+	except OSError as err:
+		for server, infos in serversInfos:
+			pool.failed(server, err)
+		raise
+	pool.succeeded(server, time.monotonic() - started)
+	return server, sock
@@ -0,0 +1,323 @@
+"""Spreading networks over worker processes.
+
+In one process, parsing, formatting and compressing for all networks share one core (the GIL).
+A ShardedRunner starts a number of worker processes, each running a Supervisor with some of the
+networks, and from the parent process:
+
+- assigns every network to the worker with the fewest networks (and keeps it there),
+- restarts workers that exit, with exponential backoff, and kills workers whose event loop
+  stopped sending heartbeats,
+- merges the metrics the workers send with their heartbeats into its own Metrics.
+
+What runs in the workers is defined by a ShardWorker subclass:
+
+	class Worker(ShardWorker):
+		def createClient(self, name, spec):
+			return IRCClient(...)
+
+	runner = ShardedRunner(Worker(), workers = 4)
+	runner.setNetworks({'example': spec})
+	runner.run()
+
+The worker object and the specs are pickled into the worker processes, so the subclass has to be
+defined at module level (workers are spawned, the main module has to be import safe).
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import signal
+import time
+from .metrics import Metrics, COUNTER, GAUGE
+from .supervisor import Supervisor
+
+class ShardWorker:
+	"""Runs in a worker process: a Supervisor with the networks assigned to the worker.
+
+	`index` is the worker's number, `metrics` the Metrics sent to the parent, `supervisor`
+	the Supervisor; all are set in the worker process before `setUp` is called."""
+	heartbeatInterval = 5 # seconds between heartbeats (which carry metrics and stats) sent to the parent
+	def __init__(self):
+		self.index = None
+		self.metrics = None
+		self.supervisor = None
+	def setUp(self):
+		"""Called in the worker process before any client is created, e.g. to create the log writer."""
+	def tearDown(self):
+		"""Called in the worker process after all networks stopped."""
+	def createClient(self, name: str, spec):
+		"""Return the IRCClient of a network."""
+		raise NotImplementedError
+	def clientRemoved(self, name: str, client):
+		"""Called after a network was removed."""
+	def updateClient(self, name: str, client, spec):
+		"""Apply a changed spec to a running network. By default the network is restarted."""
+		self.removeNetwork(name)
+		self.addNetwork(name, spec)
+	def check(self):
+		"""Called when the parent was told to reload (e.g. on SIGHUP)."""
+	def stats(self) -> dict:
+		"""Return the statistics sent to the parent with every heartbeat."""
+		return {
+			'pid': os.getpid(),
+			'networks': self.supervisor.networks(),
+			'cpuSeconds': time.process_time(),
+		}
+	# networks
+	def addNetwork(self, name: str, spec):
+		try:
+			client = self.createClient(name, spec)
+		except Exception as err:
+			print('Worker %i: Cannot create network %s: %s' % (self.index, name, err))
+			return
+		self.__specs[name] = spec
+		self.supervisor.addNetwork(name, client)
+	def removeNetwork(self, name: str):
+		self.__specs.pop(name, None)
+		client = self.supervisor.clients.get(name)
+		if client is None:
+			return
+		self.supervisor.removeNetwork(name)
+		self.clientRemoved(name, client)
+	# worker process
+	def run(self, index: int, conn, networks: dict):
+		"""The worker process' main function."""
+		signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C reaches the whole process group; the parent stops us
+		asyncio.run(self.runAsync(index, conn, networks))
+	async def runAsync(self, index: int, conn, networks: dict):
+		loop = asyncio.get_running_loop()
+		self.index = index
+		self.metrics = Metrics()
+		self.supervisor = Supervisor()
+		self.__specs = {} # network name -> spec
+		self.setUp()
+		try:
+			for name, spec in networks.items():
+				self.addNetwork(name, spec)
+			loop.add_reader(conn.fileno(), self.__receive, conn)
+			loop.add_signal_handler(signal.SIGTERM, self.supervisor.stop)
+			self.__nextHeartbeat = loop.call_soon(self.__heartbeat, loop, conn)
+			try:
+				await self.supervisor.runAsync()
+			finally:
+				self.__nextHeartbeat.cancel()
+				loop.remove_reader(conn.fileno())
+		finally:
+			self.tearDown()
+			conn.close()
+	def __heartbeat(self, loop, conn):
+		try:
+			conn.send(('heartbeat', self.metrics.samples(), self.stats()))
+		except OSError: # parent is gone
+			self.supervisor.stop()
+			return
+		self.__nextHeartbeat = loop.call_later(self.heartbeatInterval, self.__heartbeat, loop, conn)
+	def __receive(self, conn):
+		try:
+			while conn.poll():
+				command, *args = conn.recv()
+				if command == 'add':
+					self.addNetwork(*args)
+				elif command == 'remove':
+					self.removeNetwork(*args)
+				elif command == 'update':
+					name, spec = args
+					if name in self.supervisor.clients and self.__specs.get(name) != spec:
+						self.__specs[name] = spec
+						self.updateClient(name, self.supervisor.clients[name], spec)
+				elif command == 'check':
+					self.check()
+				elif command == 'stop':
+					self.supervisor.stop()
+		except (EOFError, OSError): # parent is gone
+			asyncio.get_running_loop().remove_reader(conn.fileno())
+			self.supervisor.stop()
+
+def _workerMain(worker: ShardWorker, index: int, conn, networks: dict):
+	worker.run(index, conn, networks)
+
+class _WorkerState:
+	"""The parent's view of a worker process."""
+	def __init__(self, index: int):
+		self.index = index
+		self.networks = {} # network name -> spec
+		self.process = None
+		self.conn = None
+		self.startedAt = None # monotonic time the current process was started
+		self.lastHeartbeat = None
+		self.failures = 0 # consecutive early exits
+		self.restarts = 0
+		self.samples = [] # metrics of the last heartbeat
+		self.stats = {} # stats of the last heartbeat
+		self.restartHandle = None
+		self.exited = None # future set when the current process exited
+
+class ShardedRunner:
+	"""Runs the networks in `workers` worker processes (one per core by default).
+
+	worker: the ShardWorker pickled into each worker process
+	metrics: the Metrics to merge the workers' metrics into
+	"""
+	heartbeatTimeout = 30 # seconds without heartbeat after which a worker is killed
+	stopTimeout = 5 # seconds to wait for workers to quit before killing them
+	backoffBase = 1.0 # seconds to wait before restarting a worker after its first early exit, doubled with every further one
+	backoffMax = 300.0
+	stableAfter = 60 # seconds a worker has to run for its exit not to count as early
+	def __init__(self, worker: ShardWorker, workers: int = None, metrics = None, context = None):
+		self.worker = worker
+		self.metrics = metrics
+		self.context = context if context is not None else multiprocessing.get_context('spawn')
+		self.__workers = [_WorkerState(i) for i in range(workers or os.cpu_count() or 1)]
+		self.__loop = None
+		self.__stopped = None
+		self.__stopping = False
+		if metrics is not None:
+			for state in self.__workers:
+				metrics.addCollector(('worker', state.index), lambda state = state: self.__collect(state))
+	# networks
+	def networks(self) -> dict:
+		"""Return network name -> worker index."""
+		return {name: state.index for state in self.__workers for name in state.networks}
+	def setNetworks(self, networks: dict):
+		"""Run exactly these networks (name -> spec); changed specs are sent to the worker running the network."""
+		for state in self.__workers:
+			for name in [name for name in state.networks if name not in networks]:
+				del state.networks[name]
+				self.__send(state, ('remove', name))
+		assigned = self.networks()
+		for name, spec in networks.items():
+			index = assigned.get(name)
+			if index is not None:
+				state = self.__workers[index]
+				if state.networks[name] != spec:
+					state.networks[name] = spec
+					self.__send(state, ('update', name, spec))
+				continue
+			state = min(self.__workers, key = lambda state: len(state.networks))
+			state.networks[name] = spec
+			self.__send(state, ('add', name, spec))
+	def check(self):
+		"""Tell all workers to reload (see ShardWorker.check)."""
+		for state in self.__workers:
+			self.__send(state, ('check',))
+	def stats(self) -> list:
+		"""Return a dict per worker: index, pid, alive, restarts, networks, seconds since the last heartbeat and the worker's stats."""
+		now = time.monotonic()
+		return [{
+			'index': state.index,
+			'pid': state.process.pid if state.process is not None else None,
+			'alive': state.process is not None and state.exited is not None and not state.exited.done(),
+			'restarts': state.restarts,
+			'networks': sorted(state.networks),
+			'heartbeatAge': now - state.lastHeartbeat if state.lastHeartbeat is not None else None,
+			'worker': state.stats,
+		} for state in self.__workers]
+	def __collect(self, state: _WorkerState) -> list:
+		labels = (('worker', str(state.index)),)
+		alive = state.process is not None and state.exited is not None and not state.exited.done()
+		samples = list(state.samples) if alive else []
+		samples.extend((
+			('pyrclib_worker_up', GAUGE, labels, int(alive)),
+			('pyrclib_worker_restarts_total', COUNTER, labels, state.restarts),
+			('pyrclib_worker_networks', GAUGE, labels, len(state.networks)),
+		))
+		if alive and state.lastHeartbeat is not None:
+			samples.append(('pyrclib_worker_heartbeat_age_seconds', GAUGE, labels, time.monotonic() - state.lastHeartbeat))
+		return samples
+	# worker processes
+	def __send(self, state: _WorkerState, message: tuple):
+		if state.conn is None:
+			return # the assignment is passed to the next process
+		try:
+			state.conn.send(message)
+		except OSError:
+			pass # the process is exiting; it will be restarted with the current assignment
+	def __start(self, state: _WorkerState):
+		state.restartHandle = None
+		if self.__stopping:
+			return
+		loop = self.__loop
+		conn, childConn = self.context.Pipe()
+		process = self.context.Process(target = _workerMain, args = (self.worker, state.index, childConn, dict(state.networks)),
+			name = 'pyrclib worker %i' % state.index)
+		process.start()
+		childConn.close()
+		state.process = process
+		state.conn = conn
+		state.startedAt = state.lastHeartbeat = time.monotonic()
+		state.samples = []
+		state.exited = loop.create_future()
+		loop.add_reader(conn.fileno(), self.__receive, state)
+		loop.add_reader(process.sentinel, self.__exited, state)
+	def __receive(self, state: _WorkerState):
+		conn = state.conn
+		try:
+			while conn.poll():
+				message = conn.recv()
+				if message[0] == 'heartbeat':
+					state.lastHeartbeat = time.monotonic()
+					state.samples, state.stats = message[1], message[2]
+		except (EOFError, OSError):
+			self.__loop.remove_reader(conn.fileno()) # the exit is handled by __exited
+	def __exited(self, state: _WorkerState):
+		loop = self.__loop
+		process = state.process
+		loop.remove_reader(process.sentinel)
+		if state.conn is not None:
+			loop.remove_reader(state.conn.fileno())
+			state.conn.close()
+			state.conn = None
+		process.join()
+		state.exited.set_result(process.exitcode)
+		if self.__stopping:
+			return
+		if time.monotonic() - state.startedAt >= self.stableAfter:
+			state.failures = 0
+		state.failures += 1
+		state.restarts += 1
+		delay = min(self.backoffMax, self.backoffBase * 2**(state.failures - 1)) * random.uniform(0.5, 1.0)
+		print('Worker %i (pid %i) exited with code %s. Restarting in %.1f seconds.' % (state.index, process.pid, process.exitcode, delay))
+		state.restartHandle = loop.call_later(delay, self.__start, state)
+	def __healthCheck(self):
+		now = time.monotonic()
+		for state in self.__workers:
+			if state.conn is not None and now - state.lastHeartbeat > self.heartbeatTimeout:
+				print('Worker %i (pid %i) sent no heartbeat for %i seconds. Killing it.' % (state.index, state.process.pid, now - state.lastHeartbeat))
+				state.process.kill() # its loop is stuck, so it wouldn't handle SIGTERM
+				state.lastHeartbeat = now # don't kill it again before it's gone
+		self.__healthTimer = self.__loop.call_later(min(self.heartbeatTimeout, self.worker.heartbeatInterval), self.__healthCheck)
+	#
+	async def runAsync(self):
+		self.__loop = loop = asyncio.get_running_loop()
+		self.__stopped = loop.create_future()
+		self.__stopping = False
+		for state in self.__workers:
+			self.__start(state)
+		self.__healthTimer = loop.call_soon(self.__healthCheck)
+		try:
+			await self.__stopped
+		finally:
+			self.__stopping = True
+			self.__healthTimer.cancel()
+			running = []
+			for state in self.__workers:
+				if state.restartHandle is not None:
+					state.restartHandle.cancel()
+					state.restartHandle = None
+				if state.exited is not None and not state.exited.done():
+					self.__send(state, ('stop',))
+					running.append(state)
+			if running:
+				done, pending = await asyncio.wait([state.exited for state in running], timeout = self.stopTimeout)
+				for state in running:
+					if not state.exited.done():
+						state.process.kill()
+				await asyncio.gather(*(state.exited for state in running))
+			self.__loop = None
+	def run(self):
+		asyncio.run(self.runAsync())
+	def stop(self):
+		"""Stop all workers and return from `runAsync`."""
+		if self.__stopped is not None and not self.__stopped.done():
+			self.__stopped.set_result(None)
@@ -0,0 +1,301 @@
+"""Channel membership and nick tracking.
+
+Nicks are interned once in a NickTable shared by all channels; channels only hold integer ids
+(a set of members plus a dict of prefix mode bit flags for the members that have any).
+A nick change thus only touches the table, whatever the number of channels the nick is in.
+"""
+
+from array import array
+from .isupport import ISupport
+from .log import logWarning
+
+def _nickOf(prefix: str) -> str:
+	return prefix.split('!', 1)[0]
+
+class NickTable:
+	"""Interned nicks with reference counts; ids of nicks no channel refers to anymore are reused."""
+	def __init__(self, fold: callable):
+		self.fold = fold # case folding of nicks, see ISupport.lower
+		self.__ids = {} # folded nick -> id
+		self.__nicks = [] # id -> nick (as last seen), None for free ids
+		self.__refs = array('L') # id -> number of channels
+		self.__free = [] # free ids
+	def __len__(self):
+		return len(self.__ids)
+	def find(self, nick: str) -> int:
+		"""Return the id of a nick or None."""
+		return self.__ids.get(self.fold(nick))
+	def nick(self, nickId: int) -> str:
+		return self.__nicks[nickId]
+	def retain(self, nick: str) -> int:
+		"""Return the id of a nick, interning it if needed, and add a reference."""
+		folded = self.fold(nick)
+		nickId = self.__ids.get(folded)
+		if nickId is None:
+			if folded == nick:
+				folded = nick # don't keep two equal strings
+			if self.__free:
+				nickId = self.__free.pop()
+				self.__nicks[nickId] = nick
+			else:
+				nickId = len(self.__nicks)
+				self.__nicks.append(nick)
+				self.__refs.append(0)
+			self.__ids[folded] = nickId
+		self.__refs[nickId] += 1
+		return nickId
+	def release(self, nickId: int):
+		"""Remove a reference; the nick is forgotten with its last one."""
+		refs = self.__refs
+		refs[nickId] -= 1
+		if not refs[nickId]:
+			del self.__ids[self.fold(self.__nicks[nickId])]
+			self.__nicks[nickId] = None
+			self.__free.append(nickId)
+	def rename(self, nickId: int, nick: str):
+		"""Change the nick of an id. Raise KeyError if the new nick belongs to another id."""
+		ids = self.__ids
+		folded = self.fold(nick)
+		other = ids.get(folded)
+		if other is not None and other != nickId:
+			raise KeyError(nick)
+		del ids[self.fold(self.__nicks[nickId])]
+		ids[folded] = nickId
+		self.__nicks[nickId] = nick
+
+class ChannelMembers:
+	"""The members of a channel."""
+	__slots__ = 'name', 'members', 'flags', 'names'
+	def __init__(self, name: str):
+		self.name = name # as we joined it
+		self.members = set() # nick ids
+		self.flags = {} # nick id -> prefix mode bits (bit 0 is the highest prefix mode); only members with prefixes
+		self.names = None # (members, flags) while receiving a NAMES reply
+
+class StateTracker:
+	"""Tracks the channels we are in and their members from the messages an IRC instance receives.
+
+	Handles RPL_NAMREPLY/RPL_ENDOFNAMES, JOIN, PART, KICK, QUIT, NICK and MODE; ISUPPORT (PREFIX, CHANMODES,
+	CASEMAPPING) is taken from the IRC instance. All state is dropped on RPL_WELCOME, i.e. on every new connection.
+	"""
+	def __init__(self, irc):
+		self.irc = irc
+		self.nick = None # our nick, as confirmed by the server
+		self.__reset()
+		self.__subscriptions = [irc.addEventHandler('recv', func, command) for command, func in (
+			('RPL_WELCOME', self.__onWelcome),
+			('RPL_NAMREPLY', self.__onNames),
+			('RPL_ENDOFNAMES', self.__onEndOfNames),
+			('JOIN', self.__onJoin),
+			('PART', self.__onPart),
+			('KICK', self.__onKick),
+			('QUIT', self.__onQuit),
+			('NICK', self.__onNick),
+			('MODE', self.__onMode),
+		)]
+	def dispose(self):
+		"""Stop listening to the IRC instance."""
+		for sub in self.__subscriptions:
+			sub.remove()
+		self.__subscriptions = []
+	@property
+	def hostmask(self) -> str:
+		"""Our nick!user@host, as seen in our JOINs. It's kept on the IRC instance, which needs it to split long messages."""
+		return getattr(self.irc, 'hostmask', None)
+	@hostmask.setter
+	def hostmask(self, hostmask: str):
+		self.irc.hostmask = hostmask
+	@property
+	def isupport(self) -> ISupport:
+		return getattr(self.irc, 'isupport', None) or self.__isupport
+	def __reset(self):
+		self.__isupport = ISupport()
+		self.nicks = NickTable(lambda nick: self.isupport.lower(nick))
+		self.__channels = {} # folded name -> ChannelMembers
+	def __isMe(self, nick: str) -> bool:
+		return self.nick is not None and self.isupport.lower(nick) == self.isupport.lower(self.nick)
+	def __channel(self, name: str) -> ChannelMembers:
+		return self.__channels.get(self.isupport.lower(name))
+	def __removeMember(self, channel: ChannelMembers, nickId: int):
+		if nickId in channel.members:
+			channel.members.discard(nickId)
+			channel.flags.pop(nickId, None)
+			self.nicks.release(nickId)
+	def __dropChannel(self, channel: ChannelMembers):
+		del self.__channels[self.isupport.lower(channel.name)]
+		for nickId in channel.members:
+			self.nicks.release(nickId)
+		if channel.names is not None:
+			for nickId in channel.names[0]:
+				self.nicks.release(nickId)
+	# lookups
+	def channels(self) -> list:
+		"""Return the names of the channels we are in."""
+		return [channel.name for channel in self.__channels.values()]
+	def isOn(self, channel: str, nick: str) -> bool:
+		chan, nickId = self.__channel(channel), self.nicks.find(nick)
+		return chan is not None and nickId is not None and nickId in chan.members
+	def members(self, channel: str) -> list:
+		"""Return the nicks in a channel (empty if we aren't in it)."""
+		chan = self.__channel(channel)
+		if chan is None:
+			return []
+		nick = self.nicks.nick
+		return [nick(nickId) for nickId in chan.members]
+	def memberCount(self, channel: str) -> int:
+		chan = self.__channel(channel)
+		return len(chan.members) if chan is not None else 0
+	def channelsOf(self, nick: str) -> list:
+		"""Return the names of our channels a nick is in."""
+		nickId = self.nicks.find(nick)
+		if nickId is None:
+			return []
+		return [channel.name for channel in self.__channels.values() if nickId in channel.members]
+	def prefixes(self, channel: str, nick: str) -> str:
+		"""Return the membership prefix symbols of a nick in a channel, highest first (e.g. '@+')."""
+		chan, nickId = self.__channel(channel), self.nicks.find(nick)
+		if chan is None or nickId is None:
+			return ''
+		bits = chan.flags.get(nickId, 0)
+		symbols = self.isupport.prefixSymbols
+		return ''.join(symbols[i] for i in range(len(symbols)) if bits & (1 << i))
+	# handlers
+	def __onWelcome(self, irc, msg):
+		self.__reset()
+		self.nick = msg.params[0] if msg.params else None
+		self.hostmask = None
+	def __onNames(self, irc, msg):
+		# params: our nick, channel type symbol, channel, names
+		if len(msg.params) < 4:
+			return
+		chan = self.__channel(msg.params[2])
+		if chan is None: # NAMES of a channel we aren't in
+			return
+		if chan.names is None:
+			chan.names = (set(), {})
+		members, flags = chan.names
+		isupport = self.isupport
+		symbols = isupport.prefixSymbols
+		retain = self.nicks.retain
+		for name in msg.params[3].split():
+			bits = 0
+			start = 0
+			while start < len(name) and name[start] in symbols: # several with multi-prefix
+				bits |= 1 << symbols.index(name[start])
+				start += 1
+			nick = _nickOf(name[start:]) # may be nick!user@host with userhost-in-names
+			if not nick:
+				continue
+			nickId = retain(nick)
+			if nickId in members:
+				self.nicks.release(nickId)
+			else:
+				members.add(nickId)
+			if bits:
+				flags[nickId] = bits
+	def __onEndOfNames(self, irc, msg):
+		if len(msg.params) < 2:
+			return
+		chan = self.__channel(msg.params[1])
+		if chan is None or chan.names is None:
+			return
+		for nickId in chan.members:
+			self.nicks.release(nickId)
+		chan.members, chan.flags = chan.names
+		chan.names = None
+	def __onJoin(self, irc, msg):
+		if not msg.params:
+			return
+		nick = _nickOf(msg.prefix)
+		name = msg.params[0]
+		chan = self.__channel(name)
+		if self.__isMe(nick):
+			self.hostmask = msg.prefix
+			if chan is not None: # rejoin without having seen us leave
+				self.__dropChannel(chan)
+			chan = self.__channels[self.isupport.lower(name)] = ChannelMembers(name)
+		elif chan is None:
+			return
+		nickId = self.nicks.retain(nick)
+		if nickId in chan.members:
+			self.nicks.release(nickId)
+		else:
+			chan.members.add(nickId)
+	def __leave(self, name: str, nick: str):
+		chan = self.__channel(name)
+		if chan is None:
+			return
+		if self.__isMe(nick):
+			self.__dropChannel(chan)
+			return
+		nickId = self.nicks.find(nick)
+		if nickId is not None:
+			self.__removeMember(chan, nickId)
+	def __onPart(self, irc, msg):
+		if msg.params:
+			for name in msg.params[0].split(','):
+				self.__leave(name, _nickOf(msg.prefix))
+	def __onKick(self, irc, msg):
+		if len(msg.params) >= 2:
+			self.__leave(msg.params[0], msg.params[1])
+	def __onQuit(self, irc, msg):
+		nickId = self.nicks.find(_nickOf(msg.prefix))
+		if nickId is None:
+			return
+		for chan in list(self.__channels.values()):
+			self.__removeMember(chan, nickId)
+	def __onNick(self, irc, msg):
+		if not msg.params:
+			return
+		old, new = _nickOf(msg.prefix), msg.params[0]
+		if self.__isMe(old):
+			self.nick = new
+			if self.hostmask is not None:
+				self.hostmask = new + self.hostmask[len(old):]
+		nickId = self.nicks.find(old)
+		if nickId is None:
+			return
+		try:
+			self.nicks.rename(nickId, new)
+		except KeyError: # out of sync: the new nick still belongs to someone else
+			otherId = self.nicks.find(new)
+			for chan in list(self.__channels.values()):
+				self.__removeMember(chan, otherId)
+				if chan.names is not None and otherId in chan.names[0]: # from a NAMES reply still coming in
+					chan.names[0].discard(otherId)
+					chan.names[1].pop(otherId, None)
+					self.nicks.release(otherId)
+			if self.nicks.find(new) is not None:
+				logWarning('Nick %s is still in use, ignoring %s becoming %s.' % (new, old, new))
+				return
+			self.nicks.rename(nickId, new)
+	def __onMode(self, irc, msg):
+		params = msg.params
+		if len(params) < 2:
+			return
+		chan = self.__channel(params[0])
+		if chan is None: # user mode or a channel we aren't in
+			return
+		isupport = self.isupport
+		prefixModes = isupport.prefixModes
+		args = iter(params[2:])
+		adding = True
+		for mode in params[1]:
+			if mode == '+':
+				adding = True
+			elif mode == '-':
+				adding = False
+			elif isupport.modeTakesParam(mode, adding):
+				arg = next(args, None)
+				if arg is None or mode not in prefixModes:
+					continue
+				nickId = self.nicks.find(arg)
+				if nickId is None or nickId not in chan.members:
+					continue
+				bit = 1 << prefixModes.index(mode)
+				bits = chan.flags.get(nickId, 0)
+				bits = bits | bit if adding else bits & ~bit
+				if bits:
+					chan.flags[nickId] = bits
+				else:
+					chan.flags.pop(nickId, None)
@@ -0,0 +1,76 @@
+import asyncio
+import traceback
+
+class Supervisor:
+	"""Runs any number of IRCClients (one per network) on a single asyncio loop.
+
+	Every network runs in a task of its own: errors and reconnects of one network
+	don't affect the others. Networks can be added and removed while running."""
+	restartDelay = 5 # seconds to wait before restarting a network whose task crashed
+	stopTimeout = 2 # seconds to wait for a network to quit before cancelling it
+	def __init__(self):
+		super().__init__()
+		self.clients = {} # network name -> IRCClient
+		self.__tasks = {} # network name -> asyncio.Task
+		self.__loop = None
+		self.__stopped = None
+	# accessors
+	def addNetwork(self, name: str, client):
+		"""Add a network. If the supervisor is already running, the client is started right away."""
+		if name in self.clients:
+			raise KeyError('Network %s already exists.' % name)
+		self.clients[name] = client
+		if self.__loop is not None:
+			self.__start(name)
+	def removeNetwork(self, name: str):
+		"""Quit a network and forget about it."""
+		client = self.clients.pop(name)
+		task = self.__tasks.pop(name, None)
+		client.stop()
+		if task is not None and not task.done():
+			self.__loop.call_later(self.stopTimeout, task.cancel)
+	def networks(self):
+		return list(self.clients)
+	# task handling
+	def __start(self, name: str):
+		task = self.__loop.create_task(self.clients[name].runAsync(), name = name)
+		task.add_done_callback(lambda task: self.__taskDone(name, task))
+		self.__tasks[name] = task
+	def __taskDone(self, name: str, task: asyncio.Task):
+		if self.__tasks.get(name) is not task:
+			return # network was removed or replaced
+		del self.__tasks[name]
+		if task.cancelled() or task.exception() is None:
+			return
+		err = task.exception()
+		traceback.print_exception(type(err), err, err.__traceback__)
+		print('Network %s crashed. Restarting in %i seconds.' % (name, self.restartDelay))
+		def restart():
+			if self.__loop is not None and name in self.clients and name not in self.__tasks:
+				self.__start(name)
+		self.__loop.call_later(self.restartDelay, restart)
+	#
+	async def runAsync(self):
+		self.__loop = asyncio.get_running_loop()
+		self.__stopped = self.__loop.create_future()
+		for name in self.clients:
+			self.__start(name)
+		try:
+			await self.__stopped
+		finally:
+			tasks = list(self.__tasks.values())
+			for name in list(self.clients):
+				self.clients[name].stop()
+			if tasks:
+				await asyncio.wait(tasks, timeout = self.stopTimeout)
+				for task in tasks:
+					task.cancel()
+				await asyncio.gather(*tasks, return_exceptions = True)
+			self.__tasks = {}
+			self.__loop = None
+	def run(self):
+		asyncio.run(self.runAsync())
+	def stop(self):
+		"""Quit all networks and return from `runAsync`."""
+		if self.__stopped is not None and not self.__stopped.done():
+			self.__stopped.set_result(None)
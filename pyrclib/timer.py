@@ -1,26 +1,71 @@
+import heapq
 import time
+from itertools import count
+
+class Timer:
+	"""A scheduled callback as returned by TimerManager.callIn/callEvery."""
+	__slots__ = 'deadline', 'interval', 'func', 'args', 'kwargs', 'cancelled'
+	def __init__(self, deadline, interval, func, args, kwargs):
+		self.deadline = deadline
+		self.interval = interval # ms between calls of repeating timers, None for one-shot timers
+		self.func = func
+		self.args = args
+		self.kwargs = kwargs
+		self.cancelled = False
+	def cancel(self):
+		"""Make sure the callback won't be called (again)."""
+		self.cancelled = True
 
 class TimerManager:
+	"""Calls functions after a delay. Times are in ms on a monotonic clock (see `_now`)."""
 	def __init__(self):
 		super().__init__()
-		self.__timers = []
+		self.__timers = [] # heap of (deadline, sequence number, Timer)
+		self.__sequence = count() # keeps timers with equal deadlines in insertion order
+		self.__lagObserver = None
+	def observeTimerLag(self, func: callable = None):
+		"""Call func(timer, lag) before each timer callback, lag being the ms it fires late; None to stop."""
+		self.__lagObserver = func
 	@staticmethod
-	def __now():
-		return int(time.time() * 1000)
-	def callIn(self, ms, func, *args, **kwargs):
-		self.__timers.append((self.__now() + ms, func, args, kwargs))
-		self.__timers.sort()
+	def _now():
+		return time.monotonic() * 1000
+	def __push(self, timer: Timer):
+		heapq.heappush(self.__timers, (timer.deadline, next(self.__sequence), timer))
+	def callIn(self, ms, func, *args, **kwargs) -> Timer:
+		timer = Timer(self._now() + ms, None, func, args, kwargs)
+		self.__push(timer)
+		return timer
+	def callEvery(self, ms, func, *args, **kwargs) -> Timer:
+		"""Call func every `ms` milliseconds, starting in `ms` milliseconds, until the returned timer is cancelled."""
+		timer = Timer(self._now() + ms, ms, func, args, kwargs)
+		self.__push(timer)
+		return timer
+	def nextDeadline(self):
+		"""Return the time (in ms, same clock as `_now`) the next timer is due, or None."""
+		timers = self.__timers
+		while timers and timers[0][2].cancelled:
+			heapq.heappop(timers)
+		return timers[0][0] if timers else None
 	def tick(self):
-		# filter active timers
-		now = self.__now()
-		active = []
+		# collect due timers first, so timers added by callbacks don't run in this tick
+		now = self._now()
 		timers = self.__timers
-		for timer in timers:
-			if timer[0] <= now:
-				active.append(timer[1:])
-			else:
-				break
-		self.__timers = timers[len(active):]
+		active = []
+		while timers and timers[0][0] <= now:
+			timer = heapq.heappop(timers)[2]
+			if timer.cancelled:
+				continue
+			active.append((timer, timer.deadline))
+			if timer.interval is not None:
+				# skip calls we missed instead of calling the function repeatedly to catch up
+				timer.deadline += timer.interval
+				if timer.deadline <= now:
+					timer.deadline = now + timer.interval
+				self.__push(timer)
 		# call active timer callbacks
-		for func, args, kwargs in active:
-			func(*args, **kwargs)
+		observer = self.__lagObserver
+		for timer, deadline in active:
+			if not timer.cancelled:
+				if observer is not None:
+					observer(timer, self._now() - deadline)
+				timer.func(*timer.args, **timer.kwargs)
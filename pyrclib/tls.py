@@ -0,0 +1,81 @@
+"""TLS contexts with session resumption.
+
+A TLSContext is an ssl.SSLContext for clients (TLS 1.2 or newer, certificates verified unless told
+otherwise, optionally with a client certificate) that remembers the last session of every server
+and offers it again on the next connection to the same host name, so reconnects do an abbreviated
+handshake. Sessions are handed out in `wrap_socket` and `wrap_bio`, which is how both the
+socket based and the asyncio connections create their TLS layer.
+"""
+
+import ssl
+from collections import OrderedDict
+
+class TLSContext(ssl.SSLContext):
+	"""A client SSLContext caching sessions per server host name.
+
+	verify: check the server's certificate and host name
+	caFile: CA certificates to verify with, instead of the system's
+	certFile, keyFile, password: client certificate (e.g. for SASL EXTERNAL / CertFP)
+	"""
+	maxSessions = 2**10
+	def __new__(cls, *args, **kwargs):
+		return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+	def __init__(self, verify: bool = True, caFile: str = None, certFile: str = None, keyFile: str = None, password = None):
+		super().__init__()
+		self.minimum_version = ssl.TLSVersion.TLSv1_2
+		if verify:
+			if caFile is not None:
+				self.load_verify_locations(caFile)
+			else:
+				self.load_default_certs()
+		else:
+			self.check_hostname = False
+			self.verify_mode = ssl.CERT_NONE
+		if certFile is not None:
+			self.load_cert_chain(certFile, keyFile, password)
+		self.sessions = OrderedDict() # server host name -> SSLSession, least recently used first
+		self.handshakes = 0 # completed handshakes
+		self.resumedHandshakes = 0 # ... which resumed a session
+	def __session(self, serverHostname: str):
+		session = self.sessions.get(serverHostname)
+		if session is not None:
+			self.sessions.move_to_end(serverHostname)
+		return session
+	def wrap_socket(self, sock, server_side = False, do_handshake_on_connect = True,
+			suppress_ragged_eofs = True, server_hostname = None, session = None):
+		if session is None and server_hostname is not None:
+			session = self.__session(server_hostname)
+		return super().wrap_socket(sock, server_side, do_handshake_on_connect,
+			suppress_ragged_eofs, server_hostname, session)
+	def wrap_bio(self, incoming, outgoing, server_side = False, server_hostname = None, session = None):
+		if session is None and server_hostname is not None:
+			session = self.__session(server_hostname)
+		return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+	def storeSession(self, serverHostname: str, sslObject):
+		"""Remember the session of an SSLSocket or SSLObject for the next connection to the server.
+
+		Call it after the handshake and again before closing: TLS 1.3 servers send their
+		session tickets after the handshake."""
+		session = sslObject.session
+		if session is None:
+			return
+		sessions = self.sessions
+		sessions[serverHostname] = session
+		sessions.move_to_end(serverHostname)
+		if len(sessions) > self.maxSessions:
+			sessions.popitem(last = False)
+	def handshakeDone(self, serverHostname: str, sslObject):
+		"""Count a completed handshake and store its session."""
+		self.handshakes += 1
+		if sslObject.session_reused:
+			self.resumedHandshakes += 1
+		self.storeSession(serverHostname, sslObject)
+
+_defaultContext = None
+
+def defaultContext() -> TLSContext:
+	"""Return the TLSContext shared by all connections which weren't given one (verifying certificates)."""
+	global _defaultContext
+	if _defaultContext is None:
+		_defaultContext = TLSContext()
+	return _defaultContext
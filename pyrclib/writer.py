@@ -0,0 +1,487 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+import traceback
+from collections import deque
+
+def _size(lines: list) -> int:
+	return sum(len(line) for line in lines)
+
+class FileWriter:
+	"""Writes batches of log lines to files (by path) or writable objects (like sys.stdout).
+
+	Files are opened in binary append mode once and kept open until `close` is called for them.
+	This writer does its work right away, on the calling thread; see BackgroundWriter."""
+	def __init__(self):
+		super().__init__()
+		self.__files = {} # path -> open file
+		self._lock = threading.Lock() # guards the statistics
+		# statistics
+		self.writes = 0
+		self.errors = 0
+		self.dropped = 0 # batches dropped because the writer couldn't keep up
+		self.droppedBytes = 0
+		self.lastLatency = 0.0 # seconds from `write` to the data being handed to the OS
+		self.maxLatency = 0.0
+		self.totalLatency = 0.0
+	def write(self, target, lines: list):
+		"""Write lines (bytes for paths, str for writables; each including its line break) to target."""
+		self._write(target, lines, time.monotonic())
+	def submit(self, func: callable, *args):
+		"""Run func(*args) where the writing happens (e.g. to compress data off the IRC thread)."""
+		func(*args)
+	def close(self, path = None):
+		"""Close the file of path, or all files."""
+		self._close(path)
+	def flush(self):
+		"""Wait for all pending writes; there are none with this writer."""
+	def stop(self):
+		self.close()
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				'writes': self.writes,
+				'errors': self.errors,
+				'dropped': self.dropped,
+				'droppedBytes': self.droppedBytes,
+				'openFiles': len(self.__files),
+				'lastLatency': self.lastLatency,
+				'maxLatency': self.maxLatency,
+				'averageLatency': self.totalLatency / self.writes if self.writes else 0.0,
+			}
+	# the actual work
+	def _writeData(self, target, lines: list):
+		"""Write lines to target; raise OSError (after closing the file) if that fails."""
+		if hasattr(target, 'write'):
+			target.write(''.join(lines))
+			target.flush()
+			return
+		fo = self.__files.get(target)
+		try:
+			if fo is None:
+				fo = self.__files[target] = open(target, 'ab')
+			fo.writelines(lines)
+			fo.flush()
+		except OSError:
+			self._close(target) # reopen on the next write; the file may have moved or its disk come back
+			raise
+	def _write(self, target, lines: list, queuedAt: float) -> bool:
+		try:
+			self._writeData(target, lines)
+		except Exception:
+			traceback.print_exc()
+			with self._lock:
+				self.errors += 1
+			return False
+		self._written(queuedAt)
+		return True
+	def _written(self, queuedAt: float):
+		latency = time.monotonic() - queuedAt
+		with self._lock:
+			self.writes += 1
+			self.lastLatency = latency
+			self.totalLatency += latency
+			if latency > self.maxLatency:
+				self.maxLatency = latency
+	def _dropped(self, lines: list):
+		with self._lock:
+			self.dropped += 1
+			self.droppedBytes += _size(lines)
+	def _close(self, path = None):
+		paths = list(self.__files) if path is None else [path]
+		for path in paths:
+			fo = self.__files.pop(path, None)
+			if fo is not None:
+				try:
+					fo.close()
+				except OSError:
+					traceback.print_exc()
+
+class SpillFile:
+	"""An overflow file keeping (path, data) records which couldn't be written yet, oldest first.
+
+	Records survive restarts: an existing spill file is read back from its start, after cutting off
+	a record written partially (e.g. by a crash). It grows to at most `maxBytes`; it is emptied (truncated) once all its records were read back.
+	Put it on a local disk other than the one the logs go to. Safe to use from several threads."""
+	__header = struct.Struct('<II') # path length, data length
+	def __init__(self, path: str, maxBytes: int = 2**30):
+		self.path = path
+		self.maxBytes = maxBytes
+		self.__lock = threading.Lock()
+		self.__file = open(path, 'a+b')
+		self.__size = self.__complete() # bytes in the file
+		self.__readOffset = 0 # start of the first record not read back yet
+	def __complete(self) -> int:
+		"""Truncate a partially written last record; return the size of the complete ones."""
+		header = self.__header
+		fo = self.__file
+		size = fo.seek(0, os.SEEK_END)
+		offset = 0
+		fo.seek(0)
+		while offset + header.size <= size:
+			pathLength, dataLength = header.unpack(fo.read(header.size))
+			if offset + header.size + pathLength + dataLength > size:
+				break
+			offset += header.size + pathLength + dataLength
+			fo.seek(offset)
+		if offset < size:
+			print('Cutting off %i bytes of a partial record at the end of %s.' % (size - offset, self.path))
+			fo.truncate(offset)
+		return offset
+	def __len__(self):
+		"""Return the number of bytes not read back yet."""
+		return self.__size - self.__readOffset
+	def append(self, path: str, lines: list) -> bool:
+		"""Store lines (bytes) for path. Return False if the file is full or can't be written."""
+		data = b''.join(lines)
+		pathData = os.fsencode(path)
+		record = self.__header.pack(len(pathData), len(data)) + pathData + data
+		with self.__lock:
+			if self.__size + len(record) > self.maxBytes:
+				return False
+			try:
+				self.__file.seek(self.__size)
+				self.__file.write(record)
+				self.__file.flush()
+			except OSError:
+				traceback.print_exc()
+				return False
+			self.__size += len(record)
+		return True
+	def prepend(self, records: list) -> bool:
+		"""Store (path, lines) records ahead of the stored ones, rewriting the file. Return False if they don't fit."""
+		data = b''.join(self.__header.pack(len(pathData), len(recordData)) + pathData + recordData
+			for pathData, recordData in ((os.fsencode(path), b''.join(lines)) for path, lines in records))
+		with self.__lock:
+			if self.__size - self.__readOffset + len(data) > self.maxBytes:
+				return False
+			fo = self.__file
+			try:
+				fo.seek(self.__readOffset)
+				data += fo.read(self.__size - self.__readOffset)
+				fo.truncate(0)
+				fo.write(data)
+				fo.flush()
+			except OSError:
+				traceback.print_exc()
+				return False
+			self.__size, self.__readOffset = len(data), 0
+		return True
+	def read(self, maxBytes: int = 2**20) -> list:
+		"""Return the oldest (path, data, end) records not read back yet, about maxBytes of them.
+
+		Pass a record's end to `consume` once it is written."""
+		header = self.__header
+		records = []
+		with self.__lock:
+			fo, offset = self.__file, self.__readOffset
+			fo.seek(offset)
+			while offset + header.size <= self.__size and offset - self.__readOffset < maxBytes:
+				pathLength, dataLength = header.unpack(fo.read(header.size))
+				end = offset + header.size + pathLength + dataLength
+				if end > self.__size: # not written completely
+					break
+				records.append((os.fsdecode(fo.read(pathLength)), fo.read(dataLength), end))
+				offset = end
+		return records
+	def consume(self, end: int):
+		"""Drop the records before end."""
+		with self.__lock:
+			self.__readOffset = end
+			if self.__readOffset >= self.__size:
+				self.__file.truncate(0)
+				self.__size = self.__readOffset = 0
+	def close(self):
+		with self.__lock:
+			self.__file.close()
+
+class BackgroundWriter(FileWriter):
+	"""A FileWriter doing the writing on a background thread, so slow disks don't block the caller.
+
+	At most `maxPending` batches are queued. When the queue is full, `overflow` decides what happens to a new batch:
+	'drop-newest': it is dropped
+	'drop-oldest': the oldest queued batch is dropped to make room
+	'block': `write` blocks the calling thread (so usually the IRC loop) for up to `blockTimeout` seconds
+	         (backpressure) and drops the batch if there's still no room
+	'spill': it is spilled, together with the queued batches for its file
+
+	Spilling needs a spill directory (spillPath), which holds a SpillFile per log file. Spill files are
+	written and read back by a thread of their own, never by the thread calling `write`. A batch that
+	can't be written is spilled as well, instead of being dropped. Until everything spilled for a file
+	was written back, newer batches for that file are spilled too, so its lines stay in order; other
+	files aren't held up. Writing back is retried every `retryInterval` seconds for each file on its own.
+	Spilled data left on `stop` is written back by the next BackgroundWriter using the spill directory.
+
+	Lines for writables (like sys.stdout) and submitted jobs are never spilled: a block of an archive
+	or binary log that can't be written is lost (its logger keeps its segment readable, though)."""
+	overflowPolicies = 'drop-newest', 'drop-oldest', 'block', 'spill'
+	def __init__(self, maxPending: int = 2**8, blockTimeout: float = 5.0, overflow: str = 'drop-newest',
+			spillPath: str = None, maxSpillBytes: int = 2**30, retryInterval: float = 5.0):
+		super().__init__()
+		if overflow not in self.overflowPolicies:
+			raise ValueError('Unknown overflow policy: %s' % overflow)
+		if overflow == 'spill' and spillPath is None:
+			raise ValueError('The spill overflow policy needs a spill path.')
+		self.maxPending = maxPending
+		self.blockTimeout = blockTimeout
+		self.overflow = overflow
+		self.retryInterval = retryInterval
+		self.spillPath = spillPath
+		self.maxSpillBytes = maxSpillBytes
+		self.spilledBytes = 0
+		self.replayedBytes = 0
+		self.__jobs = deque() # (target, lines, queued at) batches and (None, func, args) jobs
+		self.__busy = False # the thread is working on a job
+		self.__current = None # the path the thread is writing to
+		self.__spilling = set() # paths whose batches are spilled
+		self.__staged = deque() # (path, batches, ahead of the spilled ones) for the spill thread
+		self.__retryAt = {} # path -> monotonic time before which writing back its spilled data isn't retried
+		self.__spills = {} # path -> SpillFile; only used from the spill thread
+		self.__spillBytes = 0
+		self.__stopping = False
+		self.__condition = threading.Condition()
+		self.__replayWriter = FileWriter() # the files written back to, by the spill thread
+		if spillPath is not None:
+			self.__loadSpills()
+		self.__thread = threading.Thread(target = self.__run, name = 'pyrclib log writer', daemon = True)
+		self.__thread.start()
+		self.__spillThread = None
+		if spillPath is not None:
+			self.__spillThread = threading.Thread(target = self.__runSpill, name = 'pyrclib log spill', daemon = True)
+			self.__spillThread.start()
+	def pending(self) -> int:
+		return len(self.__jobs)
+	def write(self, target, lines: list):
+		isPath = not hasattr(target, 'write')
+		with self.__condition:
+			if isPath and target in self.__spilling: # keep the order behind its older spilled lines
+				self.__spill(target, [lines])
+				return
+			jobs = self.__jobs
+			if len(jobs) >= self.maxPending:
+				if self.overflow == 'spill' and isPath:
+					self.__spill(target, [lines])
+					return
+				if self.overflow == 'drop-oldest':
+					for i, job in enumerate(jobs):
+						if job[0] is not None:
+							del jobs[i]
+							self._dropped(job[1])
+							break
+				elif self.overflow == 'block':
+					self.__condition.wait_for(lambda: len(jobs) < self.maxPending, self.blockTimeout)
+				if len(jobs) >= self.maxPending:
+					self._dropped(lines)
+					print('Log writer queue is full, dropped %i bytes.' % _size(lines))
+					return
+			jobs.append((target, lines, time.monotonic()))
+			self.__condition.notify_all()
+	def submit(self, func: callable, *args):
+		with self.__condition:
+			if self.overflow == 'block':
+				self.__condition.wait_for(lambda: len(self.__jobs) < self.maxPending, self.blockTimeout)
+			if len(self.__jobs) >= self.maxPending:
+				with self._lock:
+					self.dropped += 1
+				print('Log writer queue is full, dropped a job.')
+				return
+			self.__call(func, *args)
+	def close(self, path = None):
+		with self.__condition:
+			self.__call(self._close, path)
+	def __call(self, func: callable, *args):
+		"""Queue a job regardless of the queue limit."""
+		self.__jobs.append((None, func, args))
+		self.__condition.notify_all()
+	def __spill(self, path: str, batches: list, failed: bool = False):
+		"""Hand batches for path to the spill thread, after its queued ones; the condition has to be held.
+
+		failed: the first batch failed to be written, so it's older than the ones spilled already."""
+		jobs = self.__jobs
+		queued = [job for job in jobs if job is not None and job[0] == path]
+		if queued:
+			kept = [job for job in jobs if job is None or job[0] != path]
+			jobs.clear()
+			jobs.extend(kept)
+			at = 1 if failed else 0 # queued after the failed batch, before the new one
+			batches[at:at] = [lines for target, lines, queuedAt in queued]
+		self.__staged.append((path, batches, failed and path in self.__spilling))
+		self.__spilling.add(path)
+		self.__condition.notify_all()
+	def flush(self):
+		"""Wait for the queued batches and jobs (spilled data may still be waiting for its disk)."""
+		with self.__condition:
+			self.__condition.wait_for(lambda: not self.__jobs and not self.__busy)
+	def stop(self):
+		"""Write everything queued, close all files and end the threads. Spilled data stays in the spill directory."""
+		self.close()
+		with self.__condition:
+			self.__jobs.append(None)
+			self.__condition.notify_all()
+		self.__thread.join()
+		if self.__spillThread is not None:
+			with self.__condition:
+				self.__stopping = True
+				self.__condition.notify_all()
+			self.__spillThread.join()
+	def stats(self) -> dict:
+		stats = super().stats()
+		stats['pending'] = self.pending()
+		with self.__condition:
+			stats['spilledBytes'] = self.spilledBytes
+			stats['replayedBytes'] = self.replayedBytes
+			stats['spillBytes'] = self.__spillBytes
+		return stats
+	def __run(self):
+		condition = self.__condition
+		jobs = self.__jobs
+		while True:
+			with condition:
+				condition.wait_for(lambda: jobs)
+				job = jobs.popleft()
+				self.__busy = True
+				if job is not None and job[0] is not None:
+					self.__current = job[0]
+				condition.notify_all() # room for blocked writers
+			try:
+				if job is None:
+					return
+				if job[0] is None:
+					job[1](*job[2])
+				else:
+					target, lines, queuedAt = job
+					if self.spillPath is None or hasattr(target, 'write'):
+						if not self._write(target, lines, queuedAt):
+							self._dropped(lines)
+					else:
+						try:
+							self._writeData(target, lines)
+						except Exception:
+							traceback.print_exc()
+							with self._lock:
+								self.errors += 1
+							with condition:
+								self.__retryAt[target] = time.monotonic() + self.retryInterval
+								self.__spill(target, [lines], True)
+						else:
+							self._written(queuedAt)
+			except Exception:
+				traceback.print_exc()
+			finally:
+				with condition:
+					self.__busy = False
+					self.__current = None
+					condition.notify_all()
+	# the spill thread
+	def __spillFile(self, path: str) -> str:
+		return os.path.join(self.spillPath, '%s.spill' % hashlib.sha1(os.fsencode(path)).hexdigest())
+	def __loadSpills(self):
+		"""Pick up the spill files left by an earlier writer."""
+		os.makedirs(self.spillPath, exist_ok = True)
+		for name in sorted(os.listdir(self.spillPath)):
+			if not name.endswith('.spill'):
+				continue
+			spill = SpillFile(os.path.join(self.spillPath, name), self.maxSpillBytes)
+			records = spill.read(1)
+			if not records:
+				spill.close()
+				os.remove(spill.path)
+				continue
+			path = records[0][0]
+			self.__spills[path] = spill
+			self.__spilling.add(path)
+			self.__spillBytes += len(spill)
+	def __store(self, path: str, batches: list, ahead: bool):
+		spill = self.__spills.get(path)
+		try:
+			if spill is None:
+				spill = self.__spills[path] = SpillFile(self.__spillFile(path))
+		except OSError:
+			traceback.print_exc()
+			stored = False
+		else:
+			before = len(spill)
+			spill.maxBytes = self.maxSpillBytes - self.__spillBytes + before
+			if ahead:
+				stored = spill.prepend([(path, lines) for lines in batches])
+			else:
+				stored = all(spill.append(path, lines) for lines in batches)
+			with self.__condition:
+				self.__spillBytes += len(spill) - before
+		size = sum(_size(lines) for lines in batches)
+		if stored:
+			with self.__condition:
+				self.spilledBytes += size
+		else:
+			with self._lock:
+				self.dropped += len(batches)
+				self.droppedBytes += size
+			print('Log spill is full or failing, dropped %i bytes for %s.' % (size, path))
+	def __replay(self, path: str):
+		"""Write back the spilled data of path until done or writing fails; then it's no longer spilled."""
+		spill = self.__spills.get(path)
+		while spill is not None and len(spill):
+			try:
+				records = spill.read()
+				if not records:
+					raise ValueError('Unreadable record in %s.' % spill.path)
+				for recordPath, data, end in records:
+					self.__replayWriter._writeData(recordPath, [data])
+					before = len(spill)
+					spill.consume(end)
+					with self.__condition:
+						self.replayedBytes += len(data)
+						self.__spillBytes += len(spill) - before
+			except Exception:
+				traceback.print_exc()
+				with self._lock:
+					self.errors += 1
+				with self.__condition:
+					self.__retryAt[path] = time.monotonic() + self.retryInterval
+				return # the remaining records stay in the spill file
+		self.__replayWriter._close(path)
+		with self.__condition:
+			if any(staged[0] == path for staged in self.__staged):
+				return # store those first
+			self.__spilling.discard(path)
+			self.__retryAt.pop(path, None)
+		if spill is not None:
+			del self.__spills[path]
+			spill.close()
+			try:
+				os.remove(spill.path)
+			except OSError:
+				traceback.print_exc()
+	def __runSpill(self):
+		condition = self.__condition
+		staged = self.__staged
+		while True:
+			with condition:
+				while True:
+					if staged:
+						job = self.__store, staged.popleft()
+						break
+					if self.__stopping:
+						job = None
+						break
+					# the path being written by the writer thread waits until it's done (and notifies)
+					waiting = [(self.__retryAt.get(path, 0.0), path) for path in self.__spilling if path != self.__current]
+					timeout = None
+					if waiting:
+						retryAt, path = min(waiting)
+						timeout = retryAt - time.monotonic()
+						if timeout <= 0:
+							job = self.__replay, (path,)
+							break
+					condition.wait(timeout)
+			if job is None:
+				break
+			try:
+				job[0](*job[1])
+			except Exception:
+				traceback.print_exc()
+		for spill in self.__spills.values():
+			spill.close()
+		self.__replayWriter._close()
@@ -0,0 +1,60 @@
+"""Replay recorded raw logs through a client configured like logger.py.
+
+Usage: replay.py config-file log-file [...] [options], see replay.py --help
+
+Log files are RawIRCLogger files (like the ones written by logger.py) or archive segments.
+The client's loggers write to `<log path>-replay` unless --log-path is given, so replays
+don't end up in the real logs.
+"""
+
+from pyrclib.replay import Replay, ReplayIRC, readRecords
+from pyrclib.archive import parseTime
+from pyrclib.writer import BackgroundWriter
+from logger import loadConf, clientFromConf
+import argparse
+import cProfile
+
+def _speed(s):
+	return None if s == 'asap' else float(s)
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = 'Replay recorded raw IRC logs through the client stack.')
+	parser.add_argument('conf', help = 'config file (as used by logger.py)')
+	parser.add_argument('logs', nargs = '+', help = 'raw log files or archive segments, oldest first')
+	parser.add_argument('--speed', type = _speed, default = None, help = '1 for real time, 100 for 100 times faster, asap (default) for as fast as possible')
+	parser.add_argument('--from', dest = 'start', type = parseTime, help = 'unix timestamp or local time (YYYY-MM-DD HH:MM[:SS])')
+	parser.add_argument('--to', dest = 'end', type = parseTime, help = 'unix timestamp or local time (YYYY-MM-DD HH:MM[:SS])')
+	parser.add_argument('--channel', action = 'append', help = 'only replay lines about this channel (repeatable)')
+	parser.add_argument('--command', action = 'append', help = 'only replay this command, e.g. PRIVMSG or 353 (repeatable)')
+	parser.add_argument('--include-sent', action = 'store_true', help = 'also replay the lines we sent')
+	parser.add_argument('--log-path', help = 'log path for the client\'s loggers')
+	parser.add_argument('--quiet', action = 'store_true', help = 'don\'t log to stdout')
+	parser.add_argument('--profile', metavar = 'FILE', help = 'write cProfile stats of the replay to FILE')
+	args = parser.parse_args(argv)
+	conf = loadConf(args.conf)
+	conf['log path'] = [args.log_path or conf['log path'][0] + '-replay']
+	if args.quiet:
+		conf['quiet'] = True
+	writer = BackgroundWriter()
+	try:
+		client = clientFromConf(conf, writer)
+		irc = client._createIRC(ReplayIRC)
+		replay = Replay(irc, args.speed, args.start, args.end, args.channel, args.command, not args.include_sent)
+		records = readRecords(args.logs)
+		try:
+			if args.profile:
+				profile = cProfile.Profile()
+				stats = profile.runcall(replay.run, records)
+				profile.dump_stats(args.profile)
+			else:
+				stats = replay.run(records)
+		except KeyboardInterrupt:
+			stats = replay.stats()
+		for logger, send, recv in client.loggers:
+			logger.close()
+	finally:
+		writer.stop()
+	print('Replayed %(replayedLines)i of %(readLines)i lines in %(seconds).3f seconds, max lag %(maxLag).3f seconds.' % stats)
+
+if __name__ == '__main__':
+	main()
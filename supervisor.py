@@ -0,0 +1,170 @@
+"""Run the loggers of many networks in a single process.
+
+Usage: supervisor.py [--workers N] [--metrics-port PORT] [--watch SECONDS] [--spill DIR] config-file-or-directory [...]
+
+Directories are searched for *.conf files. Each config file is one network,
+named after the file. Send SIGHUP to rescan: networks of new config files are
+started, networks whose config file is gone are stopped and changed config files
+are applied to their running networks (see logger.applyConf).
+With --watch, the rescan also happens every SECONDS seconds.
+With --spill, log lines the disk can't take right now go to spill files in DIR (on another disk)
+and are written back later; see pyrclib.writer.BackgroundWriter.
+With --metrics-port, metrics of all networks are served on http://127.0.0.1:PORT/metrics.
+With --workers, the networks are spread over N worker processes (see pyrclib.sharding), which
+are restarted when they crash or hang; each has its own log writer (and spill directory DIR/<worker>).
+"""
+
+from pyrclib.supervisor import Supervisor
+from pyrclib.sharding import ShardWorker, ShardedRunner
+from pyrclib.writer import BackgroundWriter
+from pyrclib.metrics import Metrics
+from logger import loadConf, clientFromConf, ConfWatcher
+import asyncio
+import os
+import signal
+import sys
+
+def findConfs(paths):
+	"""Return a dict of network name -> config file path."""
+	confs = {}
+	for path in paths:
+		if os.path.isdir(path):
+			files = [os.path.join(path, fn) for fn in sorted(os.listdir(path)) if fn.endswith('.conf')]
+		else:
+			files = [path]
+		for fn in files:
+			confs[os.path.splitext(os.path.basename(fn))[0]] = fn
+	return confs
+
+def sync(supervisor, paths, writer, metrics = None, watchers = None):
+	"""Start and stop networks to match the config files found in paths.
+
+	watchers: network name -> ConfWatcher; changed config files of running networks are applied to them"""
+	if watchers is None:
+		watchers = {}
+	confs = findConfs(paths)
+	for name in supervisor.networks():
+		if name not in confs:
+			print('Removing network %s.' % name)
+			supervisor.removeNetwork(name)
+			watchers.pop(name, None)
+			if metrics is not None:
+				metrics.forget(network = name)
+	for name, fn in confs.items():
+		if name in supervisor.clients:
+			watcher = watchers.get(name)
+			if watcher is not None and watcher.path == fn:
+				watcher.check()
+			continue
+		try:
+			conf = loadConf(fn)
+			client = clientFromConf(conf, writer, metrics, name)
+		except KeyError as err:
+			print('%s: Missing config key: %s' % (fn, err))
+		except (ValueError, OSError) as err:
+			print('%s: %s' % (fn, err))
+		else:
+			print('Adding network %s.' % name)
+			supervisor.addNetwork(name, client)
+			watchers[name] = ConfWatcher(fn, conf, client, writer, metrics, name)
+
+class LoggerWorker(ShardWorker):
+	"""Runs the networks of some config files in a worker process."""
+	def __init__(self, spillPath = None):
+		super().__init__()
+		self.spillPath = spillPath
+	def setUp(self):
+		if self.spillPath is not None:
+			self.writer = BackgroundWriter(overflow = 'spill', spillPath = os.path.join(self.spillPath, str(self.index)))
+		else:
+			self.writer = BackgroundWriter()
+		self.watchers = {} # network name -> ConfWatcher
+	def tearDown(self):
+		self.writer.stop()
+	def createClient(self, name, path):
+		conf = loadConf(path)
+		try:
+			client = clientFromConf(conf, self.writer, self.metrics, name)
+		except KeyError as err:
+			raise KeyError('Missing config key: %s' % err) from None
+		self.watchers[name] = ConfWatcher(path, conf, client, self.writer, self.metrics, name)
+		return client
+	def clientRemoved(self, name, client):
+		self.watchers.pop(name, None)
+		self.metrics.forget(network = name)
+	def check(self):
+		for watcher in list(self.watchers.values()):
+			watcher.check()
+
+def syncSharded(runner, paths):
+	"""Like sync, for networks running in worker processes."""
+	before = runner.networks()
+	runner.setNetworks(findConfs(paths))
+	after = runner.networks()
+	for name in before:
+		if name not in after:
+			print('Removing network %s.' % name)
+	for name, index in after.items():
+		if name not in before:
+			print('Adding network %s to worker %i.' % (name, index))
+	runner.check()
+
+async def runShardedAsync(paths, workers, metrics = None, watchInterval = None, spillPath = None):
+	runner = ShardedRunner(LoggerWorker(spillPath), workers, metrics)
+	syncSharded(runner, paths)
+	loop = asyncio.get_running_loop()
+	loop.add_signal_handler(signal.SIGHUP, syncSharded, runner, paths)
+	loop.add_signal_handler(signal.SIGTERM, runner.stop)
+	loop.add_signal_handler(signal.SIGINT, runner.stop)
+	if watchInterval:
+		def poll():
+			syncSharded(runner, paths)
+			loop.call_later(watchInterval, poll)
+		loop.call_later(watchInterval, poll)
+	await runner.runAsync()
+
+async def runAsync(paths, writer, metrics = None, watchInterval = None):
+	supervisor = Supervisor()
+	watchers = {}
+	sync(supervisor, paths, writer, metrics, watchers)
+	loop = asyncio.get_running_loop()
+	loop.add_signal_handler(signal.SIGHUP, sync, supervisor, paths, writer, metrics, watchers)
+	loop.add_signal_handler(signal.SIGTERM, supervisor.stop)
+	if watchInterval:
+		def poll():
+			sync(supervisor, paths, writer, metrics, watchers)
+			loop.call_later(watchInterval, poll)
+		loop.call_later(watchInterval, poll)
+	await supervisor.runAsync()
+
+def main():
+	paths = sys.argv[1:]
+	metrics = watchInterval = spillPath = workers = None
+	while paths[:1] in (['--workers'], ['--metrics-port'], ['--watch'], ['--spill']) and len(paths) > 1:
+		if paths[0] == '--workers':
+			workers = int(paths[1])
+		elif paths[0] == '--metrics-port':
+			metrics = Metrics()
+			metrics.serve(int(paths[1]))
+		elif paths[0] == '--watch':
+			watchInterval = float(paths[1])
+		else:
+			spillPath = paths[1]
+		paths = paths[2:]
+	if not paths:
+		print('Usage: %s [--workers N] [--metrics-port PORT] [--watch SECONDS] [--spill DIR] config-file-or-directory [...]' % sys.argv[0])
+		return
+	if workers is not None:
+		asyncio.run(runShardedAsync(paths, workers, metrics, watchInterval, spillPath))
+		return
+	# one log writer thread for all networks
+	writer = BackgroundWriter(overflow = 'spill', spillPath = spillPath) if spillPath is not None else BackgroundWriter()
+	try:
+		asyncio.run(runAsync(paths, writer, metrics, watchInterval))
+	except KeyboardInterrupt:
+		pass
+	finally:
+		writer.stop()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,27 @@
+import time
+import pytest
+from pyrclib.archive import ArchiveLogger, ArchiveReader, compressions, parseTime
+
+@pytest.mark.parametrize('compression', sorted(compressions))
+def testRoundTrip(tmp_path, compression):
+	basename = str(tmp_path / 'net')
+	logger = ArchiveLogger(basename, 10, compression = compression)
+	now = int(time.time()) - 30 # whole seconds, so the formatted timestamps compare exactly
+	lines = [b'%.3f PRIVMSG #c :line %i' % (now + i, i) for i in range(25)]
+	for line in lines:
+		logger.log(line)
+	logger.close()
+	reader = ArchiveReader(basename, compression)
+	assert list(reader.read()) == lines
+	assert list(reader.read(now + 5, now + 7)) == lines[5:8]
+	assert len(reader.blocks(reader.segments()[0])) == 3
+
+def testUnknownCompression(tmp_path):
+	with pytest.raises(ValueError):
+		ArchiveLogger(str(tmp_path / 'net'), compression = 'zip')
+
+def testParseTime():
+	assert parseTime('1580428800.5') == 1580428800.5
+	assert parseTime('2020-01-31 14:32') == time.mktime((2020, 1, 31, 14, 32, 0, 0, 0, -1))
+	with pytest.raises(ValueError):
+		parseTime('yesterday')
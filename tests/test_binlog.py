@@ -0,0 +1,56 @@
+import glob
+import time
+from pyrclib.binlog import BinaryLogger, BinaryLogReader, fields
+
+lines = [
+	b':Alice!u@h PRIVMSG #Chan :hello',
+	b':bob!u@h JOIN :#chan',
+	b'@time=x :bob!u@h NOTICE #other :hi',
+	b'PING :server',
+]
+
+def write(basename, records):
+	logger = BinaryLogger(basename, 2)
+	for ts, data in records:
+		logger.logRecord(ts, data)
+	logger.close()
+
+def testFields():
+	assert fields(lines[0]) == (b'PRIVMSG', b'#chan', b'alice')
+	assert fields(lines[1]) == (b'JOIN', b'#chan', b'bob')
+	assert fields(lines[2]) == (b'NOTICE', b'#other', b'bob')
+	assert fields(lines[3]) == (b'PING', None, None)
+
+def testRoundTripAndFilters(tmp_path):
+	basename = str(tmp_path / 'net')
+	now = int(time.time()) - 30 # segments are picked by date
+	records = list(enumerate(lines, now))
+	write(basename, records)
+	reader = BinaryLogReader(basename)
+	assert [(float(ts), data) for ts, data in reader.read()] == records
+	assert [data for ts, data in reader.read(channel = '#CHAN')] == lines[:2]
+	assert [data for ts, data in reader.read(nick = 'alice')] == lines[:1]
+	assert [data for ts, data in reader.read(command = 'ping')] == lines[3:]
+	assert [data for ts, data in reader.read(now + 1, now + 2)] == lines[1:3]
+
+def testTornBlock(tmp_path):
+	basename = str(tmp_path / 'net')
+	write(basename, [(1000, lines[0]), (1001, lines[1])])
+	path, = glob.glob(basename + '-*.bin')
+	with open(path, 'rb') as fo:
+		data = fo.read()
+	with open(path, 'ab') as fo: # a block cut short by a crash
+		fo.write(data[:len(data) - 5])
+	assert [data for ts, data in BinaryLogReader(basename).read()] == lines[:2]
+	write(basename, [(1002, lines[2])]) # cuts off the partial block before appending
+	assert [data for ts, data in BinaryLogReader(basename).read()] == lines[:3]
+
+def testResyncAfterTornBlock(tmp_path):
+	basename = str(tmp_path / 'net')
+	write(basename, [(1000, lines[0]), (1001, lines[1])])
+	path, = glob.glob(basename + '-*.bin')
+	with open(path, 'rb') as fo:
+		data = fo.read()
+	with open(path, 'wb') as fo: # a torn block in the middle, followed by a complete one
+		fo.write(data + data[:len(data) - 5] + data)
+	assert [data for ts, data in BinaryLogReader(basename).read()] == lines[:2] * 2
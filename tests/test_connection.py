@@ -0,0 +1,55 @@
+from pyrclib.connection import ReceiveBuffer
+
+def testLinesInOneChunk():
+	buf = ReceiveBuffer()
+	buf.write(b'PING :a\r\nPING :b\r\n')
+	assert buf.readLines(b'\r\n') == [b'PING :a', b'PING :b']
+	assert len(buf) == 0
+
+def testPartialLineIsKept():
+	buf = ReceiveBuffer()
+	buf.write(b'PING :a\r\nPRIV')
+	assert buf.readLines(b'\r\n') == [b'PING :a']
+	assert buf.peek() == b'PRIV'
+	buf.write(b'MSG #c :hi\r\n')
+	assert buf.readLines(b'\r\n') == [b'PRIVMSG #c :hi']
+
+def testEolSplitAcrossChunks():
+	buf = ReceiveBuffer()
+	buf.write(b'PING :a\r')
+	assert buf.readLines(b'\r\n') == []
+	buf.write(b'\nPING :b\r\n')
+	assert buf.readLines(b'\r\n') == [b'PING :a', b'PING :b']
+
+def testByteByByte():
+	data = b':n!u@h PRIVMSG #c :hello\r\n\r\nPING :x\r\n'
+	buf = ReceiveBuffer(16)
+	lines = []
+	for i in range(len(data)):
+		buf.write(data[i:i + 1])
+		lines += buf.readLines(b'\r\n')
+	assert lines == [b':n!u@h PRIVMSG #c :hello', b'', b'PING :x']
+
+def testGrowsForLongLines():
+	buf = ReceiveBuffer(8)
+	line = b'x' * 10000
+	for i in range(0, len(line), 100):
+		buf.write(line[i:i + 100])
+		assert buf.readLines(b'\r\n') == []
+	buf.write(b'\r\nrest')
+	assert buf.readLines(b'\r\n') == [line]
+	assert buf.peek() == b'rest'
+
+def testGetBufferAndCommit():
+	buf = ReceiveBuffer(32)
+	view = buf.getBuffer(8)
+	assert len(view) >= 8
+	view[:6] = b'a\r\nb\r\n'
+	buf.commit(6)
+	assert buf.readLines(b'\r\n') == [b'a', b'b']
+
+def testDiscard():
+	buf = ReceiveBuffer()
+	buf.write(b'abc\r\ndef\r\n')
+	buf.discard(5)
+	assert buf.readLines(b'\r\n') == [b'def']
@@ -0,0 +1,58 @@
+import pytest
+from pyrclib.irc import splitText, packTargets
+from pyrclib.numerics import canonical
+
+def testSplitShortText():
+	assert splitText('hello', 100) == ['hello']
+	assert splitText('', 100) == []
+
+def testSplitLineBreaks():
+	assert splitText('a\r\nb\rc\n\nd', 100) == ['a', 'b', 'c', 'd']
+
+def testSplitKeepsItalics():
+	assert splitText('a\x1db', 100) == ['a\x1db']
+
+def testSplitAtSpaces():
+	assert splitText('aaa bbb ccc', 7) == ['aaa bbb', 'ccc']
+	assert splitText('aaaa bbbb', 6) == ['aaaa', 'bbbb']
+
+def testSplitWithoutSpaces():
+	assert splitText('abcdefgh', 4) == ['abcd', 'efgh']
+	assert splitText('ab cdefghij', 4) == ['ab', 'cdef', 'ghij']
+
+@pytest.mark.parametrize('maxBytes', [4, 5, 7, 10, 31, 100])
+def testSplitUtf8Limits(maxBytes):
+	text = 'grüße 日本語のテキスト 😀😀 ' * 20
+	lines = splitText(text, maxBytes)
+	assert all(0 < len(line.encode('utf-8')) <= maxBytes for line in lines)
+	assert ''.join(lines).replace(' ', '') == text.replace(' ', '')
+
+def testSplitTooSmall():
+	with pytest.raises(ValueError):
+		splitText('abc', 3)
+
+def testPackTargets():
+	msgs = packTargets('JOIN', ['#a', '#b', '#c', '#d'], ['k1', 'k2'], None, 3, 510)
+	assert [msg.raw for msg in msgs] == ['JOIN #a,#b,#c k1,k2', 'JOIN #d']
+
+def testPackTargetsTrailing():
+	msgs = packTargets('PRIVMSG', ['x%i' % i for i in range(5)], (), 'hello world', 4, 510)
+	assert [msg.raw for msg in msgs] == ['PRIVMSG x0,x1,x2,x3 :hello world', 'PRIVMSG x4 :hello world']
+
+@pytest.mark.parametrize('maxBytes', [20, 64, 510])
+def testPackTargetsByteLimit(maxBytes):
+	channels = ['#channel-%i' % i for i in range(300)]
+	msgs = packTargets('JOIN', channels, [], None, None, maxBytes)
+	assert all(len(msg.raw.encode('utf-8')) <= maxBytes for msg in msgs)
+	assert [name for msg in msgs for name in msg.params[0].split(',')] == channels
+
+def testPackTargetsLongTarget():
+	msgs = packTargets('JOIN', ['#a', '#' + 'x' * 30, '#b'], [], None, None, 20)
+	assert [msg.params[0] for msg in msgs] == ['#a', '#' + 'x' * 30, '#b']
+
+def testCanonicalCommands():
+	assert canonical('privmsg') == 'PRIVMSG'
+	assert canonical('ERR_NICKNAMEINUSE') == '433'
+	assert canonical('rpl_welcome') == '001'
+	assert canonical(433) == '433'
+	assert canonical(1) == '001'
@@ -0,0 +1,28 @@
+import pickle
+from pyrclib.message import MessageBase as Message
+
+def testParse():
+	msg = Message(':nick!user@host PRIVMSG #chan :hello there')
+	assert msg.prefix == 'nick!user@host'
+	assert msg.command == 'PRIVMSG'
+	assert msg.params == ['#chan', 'hello there']
+	assert msg.tags == {}
+
+def testTags():
+	msg = Message('@time=2020-01-01T00:00:00.000Z;account=bob;+draft/flag :n!u@h PRIVMSG #c :hi')
+	assert msg.tags == {'time': '2020-01-01T00:00:00.000Z', 'account': 'bob', '+draft/flag': ''}
+	assert msg.command == 'PRIVMSG'
+	assert msg.params == ['#c', 'hi']
+
+def testTagUnescaping():
+	msg = Message(r'@a=semi\:colon;b=sp\sace;c=back\\slash;d=cr\rlf\n;e=unknown\x;f=trailing\ PING :x')
+	assert msg.tags == {'a': 'semi;colon', 'b': 'sp ace', 'c': 'back\\slash', 'd': 'cr\rlf\n', 'e': 'unknownx', 'f': 'trailing'}
+
+def testMake():
+	msg = Message.make('PRIVMSG', '#c', 'hello world', trailing = True)
+	assert msg.raw == 'PRIVMSG #c :hello world'
+	assert Message(msg.raw).params == ['#c', 'hello world']
+
+def testPickle():
+	msg = Message(b':n!u@h PRIVMSG #c :hi')
+	assert pickle.loads(pickle.dumps(msg)).params == ['#c', 'hi']
@@ -0,0 +1,71 @@
+from pyrclib.timer import TimerManager
+
+class FakeClock(TimerManager):
+	def __init__(self):
+		super().__init__()
+		self.now = 0
+	def _now(self):
+		return self.now
+	def advance(self, ms):
+		self.now += ms
+		self.tick()
+
+def testOrder():
+	timers, calls = FakeClock(), []
+	timers.callIn(30, calls.append, 'c')
+	timers.callIn(10, calls.append, 'a')
+	timers.callIn(20, calls.append, 'b')
+	timers.callIn(10, calls.append, 'a2') # equal deadlines run in insertion order
+	timers.advance(5)
+	assert calls == []
+	timers.advance(25)
+	assert calls == ['a', 'a2', 'b', 'c']
+	assert timers.nextDeadline() is None
+
+def testCancel():
+	timers, calls = FakeClock(), []
+	timer = timers.callIn(10, calls.append, 'x')
+	timers.callIn(20, calls.append, 'y')
+	timer.cancel()
+	assert timers.nextDeadline() == 20
+	timers.advance(30)
+	assert calls == ['y']
+
+def testCancelledByEarlierCallback():
+	timers, calls = FakeClock(), []
+	later = timers.callIn(10, calls.append, 'later')
+	timers.callIn(5, later.cancel)
+	timers.advance(10)
+	assert calls == []
+
+def testRepeating():
+	timers, calls = FakeClock(), []
+	timer = timers.callEvery(10, calls.append, 'x')
+	for i in range(3):
+		timers.advance(10)
+	assert calls == ['x'] * 3
+	timer.cancel()
+	timers.advance(10)
+	assert calls == ['x'] * 3
+
+def testRepeatingSkipsMissedCalls():
+	timers, calls = FakeClock(), []
+	timers.callEvery(10, calls.append, 'x')
+	timers.advance(55)
+	assert calls == ['x']
+	assert timers.nextDeadline() == 65
+
+def testAddedByCallbackRunsNextTick():
+	timers, calls = FakeClock(), []
+	timers.callIn(10, lambda: timers.callIn(0, calls.append, 'inner'))
+	timers.advance(10)
+	assert calls == []
+	timers.advance(0)
+	assert calls == ['inner']
+
+def testLagObserver():
+	timers, lags = FakeClock(), []
+	timers.observeTimerLag(lambda timer, lag: lags.append(lag))
+	timers.callIn(10, lambda: None)
+	timers.advance(15)
+	assert lags == [5]
@@ -0,0 +1,73 @@
+import os
+import struct
+import time
+from pyrclib.writer import BackgroundWriter, FileWriter, SpillFile
+
+def waitFor(condition, timeout = 5.0):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		assert time.monotonic() < deadline, 'timed out'
+		time.sleep(0.01)
+
+def read(path):
+	with open(path, 'rb') as fo:
+		return fo.read()
+
+def testFileWriter(tmp_path):
+	path = str(tmp_path / 'a.log')
+	writer = FileWriter()
+	writer.write(path, [b'a\n', b'b\n'])
+	writer.write(path, [b'c\n'])
+	writer.stop()
+	assert read(path) == b'a\nb\nc\n'
+
+def testSpillFileRoundTrip(tmp_path):
+	spill = SpillFile(str(tmp_path / 'spill'))
+	assert spill.append('a.log', [b'1\n', b'2\n'])
+	assert spill.append('b.log', [b'3\n'])
+	assert spill.prepend([('a.log', [b'0\n'])])
+	records = spill.read()
+	assert [(path, data) for path, data, end in records] == [('a.log', b'0\n'), ('a.log', b'1\n2\n'), ('b.log', b'3\n')]
+	spill.consume(records[-1][2])
+	assert len(spill) == 0
+	spill.close()
+
+def testSpillFileTornTail(tmp_path):
+	path = str(tmp_path / 'spill')
+	spill = SpillFile(path)
+	spill.append('a.log', [b'1\n'])
+	spill.close()
+	with open(path, 'ab') as fo: # a record cut short by a crash
+		fo.write(struct.pack('<II', 5, 100) + b'a.log' + b'partial')
+	spill = SpillFile(path)
+	assert [(p, data) for p, data, end in spill.read()] == [('a.log', b'1\n')]
+	spill.close()
+
+def testSpillAndWriteBack(tmp_path):
+	good, bad = str(tmp_path / 'good.log'), str(tmp_path / 'missing' / 'bad.log')
+	writer = BackgroundWriter(overflow = 'spill', spillPath = str(tmp_path / 'spill'), retryInterval = 0.05)
+	for i in range(20):
+		writer.write(bad, [b'%i\n' % i])
+		writer.write(good, [b'%i\n' % i])
+	writer.flush()
+	assert read(good) == b''.join(b'%i\n' % i for i in range(20)) # not held up by the failing file
+	os.mkdir(str(tmp_path / 'missing'))
+	writer.write(bad, [b'20\n'])
+	waitFor(lambda: os.path.exists(bad) and read(bad).endswith(b'20\n'))
+	assert read(bad) == b''.join(b'%i\n' % i for i in range(21))
+	writer.stop()
+	assert os.listdir(str(tmp_path / 'spill')) == []
+
+def testSpillSurvivesRestart(tmp_path):
+	bad, spillPath = str(tmp_path / 'missing' / 'bad.log'), str(tmp_path / 'spill')
+	writer = BackgroundWriter(spillPath = spillPath, retryInterval = 60)
+	writer.write(bad, [b'1\n'])
+	writer.flush()
+	writer.stop()
+	assert os.listdir(spillPath)
+	os.mkdir(str(tmp_path / 'missing'))
+	writer = BackgroundWriter(spillPath = spillPath, retryInterval = 60)
+	writer.write(bad, [b'2\n'])
+	waitFor(lambda: os.path.exists(bad) and read(bad).endswith(b'2\n'))
+	writer.stop()
+	assert read(bad) == b'1\n2\n'